@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import udf, col, rand, floor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sql_queries
+
+# previous implementation of the arrival date dimension (python udf + distinct scan)
+legacy_arrival_date_sql=("""
+select da.*,
+    year(arrdate_conv) as year,
+    month(arrdate_conv) as month,
+    dayofmonth(arrdate_conv) as dayofmonth,
+    dayofweek(arrdate_conv) as dayofweek,
+    date_format(arrdate_conv,'E') as dayofweek_name,
+    dayofyear(arrdate_conv) as dayofyear,
+    weekofyear(arrdate_conv) as weekofyear,
+    quarter(arrdate_conv) as quarter
+    from dim_arrival_date da
+""")
+
+
+def build_legacy(spark):
+    '''
+        - Builds arrival date dimension the way it was done before (udf + select distinct)
+    '''
+    get_datetime = udf(lambda vdt:(datetime(1960,1,1)+timedelta(days=vdt)).isoformat())
+    df=spark.sql("select distinct cast (arrdate as int) as arrdate from staging_immigration_table")
+    df=df.withColumn("arrdate_conv", get_datetime(col("arrdate")))
+    df.createOrReplaceTempView("dim_arrival_date")
+    return spark.sql(legacy_arrival_date_sql)
+
+
+def build_staging_keys(spark):
+    '''
+        - Builds and caches the staging key table the dimensions are read from (like extract_staging_keys in etl.py)
+    '''
+    df_keys=spark.sql(sql_queries.staging_keys_sql)
+    df_keys.cache()
+    num_rows=df_keys.count()
+    df_keys.createOrReplaceTempView("staging_keys_table")
+    return num_rows
+
+
+def build_native(spark):
+    '''
+        - Builds arrival date dimension from the min/max arrival range of the staging key table using native date functions
+    '''
+    return spark.sql(sql_queries.df_dim_arrival_date_sql)
+
+
+def time_build(name, build_function, spark, runs):
+    '''
+        - Materializes the dimension several times and prints the best duration
+    '''
+    durations=[]
+    for _ in range(runs):
+        start_time=time.time()
+        num_rows=build_function(spark).collect()
+        durations.append(time.time()-start_time)
+    print(f"{name}: rows={len(num_rows)}; best={min(durations):.3f}s; all={[round(d,3) for d in durations]}")
+
+
+def main():
+    """
+    - Creates a staging table with the given number of rows, random arrival dates and random key columns
+    - Builds the staging key table once, it is shared by all dimensions in etl.py
+    - Compares legacy and native build of the arrival date dimension
+    
+    """
+    parser = argparse.ArgumentParser(description="benchmark arrival date dimension build")
+    parser.add_argument("--rows", type=int, default=30000000, help="number of rows in staging table")
+    parser.add_argument("--days", type=int, default=366, help="number of distinct arrival days")
+    parser.add_argument("--runs", type=int, default=3, help="number of timed runs per variant")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").appName("bench_arrival_date_dim").getOrCreate()
+    # 20454 = 2016-01-01 as sas day offset; arrdate is an int like in the staging view of etl.py
+    df=spark.range(args.rows).withColumn("arrdate", (floor(rand(42)*args.days)+20454).cast("int"))
+    for seed, (key_column, num_values) in enumerate([("i94port",20), ("i94addr",10), ("i94cit",20), ("i94res",20), ("i94visa",3), ("i94mode",4)]):
+        df=df.withColumn(key_column, floor(rand(seed)*num_values).cast("int"))
+    df.cache().count()
+    df.createOrReplaceTempView("staging_immigration_table")
+    print(f"staging rows: {args.rows}; distinct days: {args.days}")
+
+    start_time=time.time()
+    num_key_rows=build_staging_keys(spark)
+    print(f"staging keys: rows={num_key_rows}; time={time.time()-start_time:.3f}s")
+
+    time_build("legacy (udf + distinct)", build_legacy, spark, args.runs)
+    time_build("native (calendar range)", build_native, spark, args.runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import etl
+
+
+def legacy_map_codes(labels_file, record_delimeter, target_basepath):
+    '''
+        - Extracts maps the way it was done before: one slice of the whole file per map
+        - Writes map csv files which get read back by spark in the previous implementation
+        - Returns a dictionary map name:dictionary code:label
+    '''
+    with open(labels_file) as f:
+        file_content = f.read()
+        file_content = file_content.replace('\t', '')
+
+    def map_codes(file, idx):
+        file_content2 = file_content[file_content.index(idx):]
+        file_content2 = file_content2[:file_content2.index(';')].split('\n')
+        file_content2 = [i.replace("'", "") for i in file_content2]
+        code_dic = [i.split('=') for i in file_content2[1:]]
+        code_dic = dict([i[0].strip(), i[1].strip()] for i in code_dic if len(i) == 2)
+        return code_dic
+
+    code_maps = {'i94cntyl':map_codes(file_content, "i94cntyl"),
+                 'i94prtl':map_codes(file_content, "i94prtl"),
+                 'i94model':map_codes(file_content, "i94model"),
+                 'i94addrl':map_codes(file_content, "i94addrl")}
+    for name, code_labels in code_maps.items():
+        with open(os.path.join(target_basepath, f"{name}.csv"), 'w') as f_map:
+            for key, value in code_labels.items():
+                f_map.write(record_delimeter.join((key, value)) + "\n")
+    return code_maps
+
+
+def parse_single_pass(labels_file, record_delimeter, target_basepath):
+    '''
+        - Extracts all maps with the single pass parser used by load_code_label_map
+    '''
+    return etl.parse_sas_labels(labels_file)
+
+
+def time_parser(name, parse_function, labels_file, runs):
+    '''
+        - Runs a parser several times and prints the best duration
+        - Returns the parsed maps of the last run
+    '''
+    durations=[]
+    with tempfile.TemporaryDirectory() as target_basepath:
+        for _ in range(runs):
+            start_time=time.time()
+            code_maps=parse_function(labels_file, ";", target_basepath)
+            durations.append(time.time()-start_time)
+    print(f"{name}: best={min(durations)*1000:.2f}ms; all={[round(d*1000,2) for d in durations]}")
+    return code_maps
+
+
+def time_spark_load(labels_file, runs):
+    '''
+        - Measures the complete load_code_label_map with and without the csv round trip
+    '''
+    spark = etl.SparkSession.builder.master("local[*]").appName("bench_labels_parser").getOrCreate()
+    code_maps_exp_num_cols = {'df_cit_res':2, 'df_addr':2, 'df_mode':2, 'df_port':3, 'df_visa':2}
+    with tempfile.TemporaryDirectory() as target_basepath:
+        for write_csv_maps in (True, False):
+            durations=[]
+            for _ in range(runs):
+                start_time=time.time()
+                etl.load_code_label_map(spark, target_basepath, labels_file, ";", code_maps_exp_num_cols, write_csv_maps)
+                spark.table("map_port").count()
+                durations.append(time.time()-start_time)
+            print(f"load_code_label_map(write_csv_maps={write_csv_maps}): best={min(durations):.3f}s")
+
+
+def main():
+    """
+    - Compares the previous label extraction with the single pass parser
+    - Verifies that both produce the same maps
+    
+    """
+    parser = argparse.ArgumentParser(description="benchmark parsing of the SAS labels description file")
+    parser.add_argument("labels_file", help="path of I94_SAS_Labels_Descriptions.SAS")
+    parser.add_argument("--runs", type=int, default=20, help="number of timed runs per variant")
+    parser.add_argument("--spark", action="store_true", help="also time load_code_label_map in a local spark session")
+    args = parser.parse_args()
+
+    legacy_maps=time_parser("legacy (slice per map + csv files)", legacy_map_codes, args.labels_file, args.runs)
+    single_pass_maps=time_parser("single pass parser", parse_single_pass, args.labels_file, args.runs)
+    for name, code_labels in legacy_maps.items():
+        print(f"{name}: records={len(code_labels)}; identical={code_labels == single_pass_maps.get(name)}")
+    if args.spark:
+        time_spark_load(args.labels_file, max(1, args.runs // 10))
+
+
+if __name__ == '__main__':
+    main()
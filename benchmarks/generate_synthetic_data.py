@@ -0,0 +1,241 @@
+import os
+import argparse
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# rows per month of immigration data at scale factor 1
+base_rows_per_month = 100000
+# rows per generated parquet file, bounds memory of the generator
+rows_per_chunk = 1000000
+
+# frequently used ports (code, city, state code), ordered by traffic
+major_ports = [('NYC','NEW YORK','NY'), ('MIA','MIAMI','FL'), ('LOS','LOS ANGELES','CA'),
+               ('SFR','SAN FRANCISCO','CA'), ('ORL','ORLANDO','FL'), ('NEW','NEWARK','NJ'),
+               ('HHW','HONOLULU','HI'), ('CHI','CHICAGO','IL'), ('HOU','HOUSTON','TX'),
+               ('FTL','FORT LAUDERDALE','FL'), ('ATL','ATLANTA','GA'), ('LVG','LAS VEGAS','NV'),
+               ('AGA','AGANA','GU'), ('WAS','WASHINGTON','DC'), ('DAL','DALLAS','TX'),
+               ('BOS','BOSTON','MA'), ('SEA','SEATTLE','WA'), ('DET','DETROIT','MI'),
+               ('PHI','PHILADELPHIA','PA'), ('SAN','SAN DIEGO','CA')]
+
+states = [('AL','ALABAMA'), ('AK','ALASKA'), ('AZ','ARIZONA'), ('AR','ARKANSAS'), ('CA','CALIFORNIA'),
+          ('CO','COLORADO'), ('CT','CONNECTICUT'), ('DE','DELAWARE'), ('DC','DIST. OF COLUMBIA'),
+          ('FL','FLORIDA'), ('GA','GEORGIA'), ('GU','GUAM'), ('HI','HAWAII'), ('ID','IDAHO'),
+          ('IL','ILLINOIS'), ('IN','INDIANA'), ('IA','IOWA'), ('KS','KANSAS'), ('KY','KENTUCKY'),
+          ('LA','LOUISIANA'), ('ME','MAINE'), ('MD','MARYLAND'), ('MA','MASSACHUSETTS'),
+          ('MI','MICHIGAN'), ('MN','MINNESOTA'), ('MS','MISSISSIPPI'), ('MO','MISSOURI'),
+          ('MT','MONTANA'), ('NE','NEBRASKA'), ('NV','NEVADA'), ('NH','NEW HAMPSHIRE'),
+          ('NJ','NEW JERSEY'), ('NM','NEW MEXICO'), ('NY','NEW YORK'), ('NC','N. CAROLINA'),
+          ('ND','N. DAKOTA'), ('OH','OHIO'), ('OK','OKLAHOMA'), ('OR','OREGON'),
+          ('PA','PENNSYLVANIA'), ('PR','PUERTO RICO'), ('RI','RHODE ISLAND'), ('SC','S. CAROLINA'),
+          ('SD','S. DAKOTA'), ('TN','TENNESSEE'), ('TX','TEXAS'), ('UT','UTAH'), ('VT','VERMONT'),
+          ('VI','VIRGIN ISLANDS'), ('VA','VIRGINIA'), ('WA','WASHINGTON'), ('WV','W. VIRGINIA'),
+          ('WI','WISCONSIN'), ('WY','WYOMING')]
+
+airlines = ['AA','UA','DL','BA','LH','AF','VS','JL','EK','QR','KE','CX','NH','IB','KL',
+            'AM','AV','CM','LA','TK','SQ','QF','NZ','AC','WS','B6','NK','F9','AS','HA']
+
+
+def zipf_weights(num_values, exponent):
+    '''
+        - Returns normalized zipf weights for ranks 1..num_values, used to skew value frequencies
+    '''
+    weights = 1.0 / np.arange(1, num_values + 1) ** exponent
+    return weights / weights.sum()
+
+
+def build_reference_data(seed):
+    '''
+        - Creates ports, countries and demographics which are shared by all generated files
+        - Returns a dictionary with ports, countries and demographics records
+
+            Args:
+                seed (int): seed of the random generator
+
+    '''
+    random_state = np.random.RandomState(seed)
+    state_codes = [state_code for state_code, _ in states]
+
+    # 20 major ports followed by 280 synthetic ones; some ports have no state (skipped in map_port)
+    ports = list(major_ports)
+    code_chars = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    for port_idx in range(280):
+        ports.append((f"Z{code_chars[port_idx // 36]}{code_chars[port_idx % 36]}",
+                      f"CITY {port_idx:03d}",
+                      state_codes[port_idx % len(state_codes)]))
+    port_labels = [(port_code, f"{city}, {state_code}") for port_code, city, state_code in ports]
+    port_labels += [('XXX', 'NOT REPORTED/UNKNOWN'), ('888', 'No PORT Code (888)'), ('ZZZ', 'MEXICO Land (Banco de Mexico)')]
+
+    # country codes 101-339 plus invalid and collapsed codes
+    countries = [(country_code, f"COUNTRY {country_code}") for country_code in range(101, 340)]
+    countries += [(400, 'No Country Code (400)'), (582, 'MEXICO Air Sea, and Not Reported (I-94, no land arrivals)'),
+                  (999, 'INVALID: STATELESS'), (990, 'Collapsed (should not show)')]
+
+    # demographics: 5 race rows for 85% of the ports
+    demographics = []
+    races = ['Hispanic or Latino', 'White', 'Black or African-American', 'American Indian and Alaska Native', 'Asian']
+    state_names = dict(states)
+    for port_code, city, state_code in ports:
+        if random_state.rand() > 0.85:
+            continue
+        total_population = int(random_state.lognormal(12, 1))
+        male_population = int(total_population * random_state.uniform(0.45, 0.52))
+        race_shares = random_state.dirichlet(np.ones(len(races)))
+        city_values = [city.title(), state_names.get(state_code, state_code).title(),
+                       round(random_state.uniform(25, 45), 1), male_population, total_population - male_population,
+                       total_population, int(total_population * random_state.uniform(0.02, 0.08)),
+                       int(total_population * random_state.uniform(0.05, 0.4)), round(random_state.uniform(2, 3.5), 2),
+                       state_code]
+        for race, race_share in zip(races, race_shares):
+            demographics.append(city_values + [race, int(total_population * race_share)])
+    return {'ports':ports, 'port_labels':port_labels, 'countries':countries, 'demographics':demographics}
+
+
+def write_labels_file(labels_file, reference_data):
+    '''
+        - Writes a labels description file in the format of I94_SAS_Labels_Descriptions.SAS
+    '''
+    with open(labels_file, 'w') as f_labels:
+        f_labels.write("libname library 'Your file location' ;\nproc format library=library ;\n\n")
+        f_labels.write("/* I94CIT & I94RES - This format shows all the valid and invalid codes for processing */\n")
+        f_labels.write("  value i94cntyl\n")
+        for country_code, country_name in reference_data.get('countries'):
+            f_labels.write(f"   {country_code} =  '{country_name}'\n")
+        f_labels.write(";\n\n/* I94PORT - This format shows all the valid and invalid port codes */\n")
+        f_labels.write("  value $i94prtl\n")
+        for port_code, port_label in reference_data.get('port_labels'):
+            f_labels.write(f"\t'{port_code}'\t=\t'{port_label:<24}'\n")
+        f_labels.write(";\n\n/* I94MODE - There are missing values as well as not reported (9) */\n")
+        f_labels.write("value i94model\n\t1 = 'Air'\n\t2 = 'Sea'\n\t3 = 'Land'\n\t9 = 'Not reported' ;\n\n")
+        f_labels.write("/* I94ADDR - There is lots of invalid codes in this variable */\n")
+        f_labels.write("value i94addrl\n")
+        for state_code, state_name in states:
+            f_labels.write(f"\t'{state_code}'='{state_name}'\n")
+        f_labels.write("\t'99'='All Other Codes'\n;\n\n")
+        f_labels.write("/* I94VISA - Visa codes collapsed into three categories:\n   1 = Business\n   2 = Pleasure\n   3 = Student\n*/\n")
+
+
+def write_demographics_file(demographics_file, reference_data):
+    '''
+        - Writes demographics records in the format of us-cities-demographics.csv
+    '''
+    columns = ['City','State','Median Age','Male Population','Female Population','Total Population',
+               'Number of Veterans','Foreign-born','Average Household Size','State Code','Race','Count']
+    pd.DataFrame(reference_data.get('demographics'), columns=columns).to_csv(demographics_file, sep=';', index=False)
+
+
+def generate_immigration_chunk(random_state, reference_data, year, month, num_rows, first_cicid):
+    '''
+        - Generates immigration records of a month with skewed ports, countries and dates
+        - Returns a pandas dataframe with the 28 columns of the source parquet files
+    '''
+    ports = reference_data.get('ports')
+    country_codes = np.array([country_code for country_code, _ in reference_data.get('countries')], dtype=float)
+    state_codes = np.array([state_code for state_code, _ in states], dtype=object)
+
+    port_idx = random_state.choice(len(ports), size=num_rows, p=zipf_weights(len(ports), 1.3))
+    port_codes = np.array([port[0] for port in ports], dtype=object)[port_idx]
+    # most immigrants give an address in the state of their arrival port
+    addr = np.array([port[2] for port in ports], dtype=object)[port_idx]
+    other_addr = random_state.rand(num_rows) < 0.15
+    addr[other_addr] = state_codes[random_state.randint(len(state_codes), size=other_addr.sum())]
+
+    country_weights = zipf_weights(len(country_codes), 1.1)
+    i94cit = country_codes[random_state.choice(len(country_codes), size=num_rows, p=country_weights)]
+    i94res = i94cit.copy()
+    other_res = random_state.rand(num_rows) < 0.2
+    i94res[other_res] = country_codes[random_state.choice(len(country_codes), size=other_res.sum(), p=country_weights)]
+
+    # arrival dates as days since 1960-01-01, weekends get more arrivals
+    first_day = (date(year, month, 1) - date(1960, 1, 1)).days
+    num_days = ((date(year + month // 12, month % 12 + 1, 1)) - date(year, month, 1)).days
+    day_weights = np.array([1.3 if date(year, month, day + 1).weekday() >= 5 else 1.0 for day in range(num_days)])
+    arrdate = first_day + random_state.choice(num_days, size=num_rows, p=day_weights / day_weights.sum()).astype(float)
+    depdate = arrdate + random_state.geometric(0.1, size=num_rows)
+    depdate[random_state.rand(num_rows) < 0.05] = np.nan
+
+    age = np.clip(random_state.normal(40, 18, size=num_rows), 0, 95).round()
+    age[random_state.rand(num_rows) < 0.005] = np.nan
+    gender = random_state.choice(np.array(['M','F','X',None], dtype=object), size=num_rows, p=[0.48, 0.48, 0.01, 0.03])
+
+    return pd.DataFrame({
+        'cicid':np.arange(first_cicid, first_cicid + num_rows, dtype=float),
+        'i94yr':np.full(num_rows, float(year)),
+        'i94mon':np.full(num_rows, float(month)),
+        'i94cit':i94cit,
+        'i94res':i94res,
+        'i94port':port_codes,
+        'arrdate':arrdate,
+        'i94mode':random_state.choice([1.0, 2.0, 3.0, 9.0], size=num_rows, p=[0.9, 0.02, 0.07, 0.01]),
+        'i94addr':addr,
+        'depdate':depdate,
+        'i94bir':age,
+        'i94visa':random_state.choice([1.0, 2.0, 3.0], size=num_rows, p=[0.15, 0.8, 0.05]),
+        'count':np.ones(num_rows),
+        'dtadfile':np.full(num_rows, f"{year}{month:02d}01", dtype=object),
+        'visapost':random_state.choice(np.array(['SPL','BGT','MEX','LND',None], dtype=object), size=num_rows),
+        'occup':np.full(num_rows, None, dtype=object),
+        'entdepa':np.full(num_rows, 'G', dtype=object),
+        'entdepd':np.full(num_rows, 'O', dtype=object),
+        'entdepu':np.full(num_rows, None, dtype=object),
+        'matflag':np.full(num_rows, 'M', dtype=object),
+        'biryear':year - age,
+        'dtaddto':np.full(num_rows, f"{month:02d}01{year + 1}", dtype=object),
+        'gender':gender,
+        'insnum':np.full(num_rows, None, dtype=object),
+        'airline':np.array(airlines, dtype=object)[random_state.choice(len(airlines), size=num_rows, p=zipf_weights(len(airlines), 1.0))],
+        'admnum':random_state.randint(10**9, 10**11, size=num_rows).astype(float),
+        'fltno':random_state.randint(1, 9999, size=num_rows).astype(str).astype(object),
+        'visatype':random_state.choice(np.array(['WT','B2','WB','B1','F1','E2'], dtype=object), size=num_rows)})
+
+
+def generate_workspace(workspace_path, scale_factor=1, months=12, start_year=2016, seed=42):
+    '''
+        - Generates a workspace with immigration parquet files, demographics csv and labels file
+        - Output is deterministic for given scale factor, months and seed
+
+            Args:
+                workspace_path (string): target directory (same layout as /home/workspace)
+                scale_factor (int): multiplies the number of immigration rows per month (1-100)
+                months (int): number of months starting in January of start_year
+                start_year (int): year of the first month
+                seed (int): seed of the random generator
+
+    '''
+    immigration_path = os.path.join(workspace_path, 'sas_data')
+    os.makedirs(immigration_path, exist_ok=True)
+    reference_data = build_reference_data(seed)
+    write_labels_file(os.path.join(workspace_path, 'I94_SAS_Labels_Descriptions.SAS'), reference_data)
+    write_demographics_file(os.path.join(workspace_path, 'us-cities-demographics.csv'), reference_data)
+
+    rows_per_month = int(base_rows_per_month * scale_factor)
+    for month_idx in range(months):
+        year, month = start_year + month_idx // 12, month_idx % 12 + 1
+        # separate generator per month keeps months independent of the chunk size
+        random_state = np.random.RandomState(seed + 1000 * (month_idx + 1))
+        for chunk_idx, first_row in enumerate(range(0, rows_per_month, rows_per_chunk)):
+            num_rows = min(rows_per_chunk, rows_per_month - first_row)
+            df = generate_immigration_chunk(random_state, reference_data, year, month, num_rows, first_row + 1)
+            chunk_file = os.path.join(immigration_path, f"i94_{year}_{month:02d}_part{chunk_idx:03d}.parquet")
+            df.to_parquet(chunk_file, index=False)
+            print(f"{chunk_file}: {num_rows} rows")
+
+
+def main():
+    """
+    - Generates a synthetic workspace for benchmarks of etl.py
+
+    """
+    parser = argparse.ArgumentParser(description="generate synthetic I94 source data")
+    parser.add_argument("workspace", help="target directory")
+    parser.add_argument("--scale-factor", type=float, default=1, help=f"1 = {base_rows_per_month} immigration rows per month")
+    parser.add_argument("--months", type=int, default=12, help="number of months to generate")
+    parser.add_argument("--start-year", type=int, default=2016, help="year of the first month")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the random generator")
+    args = parser.parse_args()
+    generate_workspace(args.workspace, args.scale_factor, args.months, args.start_year, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+
+from pyspark.sql import SparkSession
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import etl
+import plan_diff
+from generate_synthetic_data import generate_workspace
+
+
+def get_git_commit():
+    '''
+        - Returns the commit hash of the repository, "unknown" outside of git
+    '''
+    try:
+        return subprocess.check_output(["git","rev-parse","--short","HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def read_run_metrics(metrics_file, run_id):
+    '''
+        - Returns the metrics records of a run from the metrics file written by etl.py
+    '''
+    with open(metrics_file) as f_metrics:
+        records = [json.loads(line) for line in f_metrics if line.strip()]
+    return [record for record in records if record.get('run_id') == run_id]
+
+
+def summarize_metrics(records):
+    '''
+        - Builds one report row per phase/table with time and throughput
+    '''
+    report_rows = []
+    for record in records:
+        wall_time = record.get('wall_time_seconds') or 0
+        rows_written = record.get('rows_written')
+        input_records = record.get('inputRecords')
+        report_rows.append({'phase':record.get('phase'),
+                            'table':record.get('table'),
+                            'status':record.get('status'),
+                            'wall_time_seconds':wall_time,
+                            'input_records':input_records,
+                            'rows_written':rows_written,
+                            'input_rows_per_second':round(input_records / wall_time) if input_records and wall_time else None,
+                            'written_rows_per_second':round(rows_written / wall_time) if rows_written and wall_time else None,
+                            'shuffle_write_bytes':record.get('shuffleWriteBytes'),
+                            'spill_bytes':(record.get('memoryBytesSpilled') or 0) + (record.get('diskBytesSpilled') or 0)})
+    return report_rows
+
+
+def print_report(scale_factor, report_rows):
+    '''
+        - Prints a report table for a scale factor
+    '''
+    print("-"*100)
+    print(f"scale factor: {scale_factor}")
+    print(f"{'phase':<28}{'table':<28}{'time [s]':>10}{'input rows/s':>16}{'written rows/s':>16}")
+    for row in report_rows:
+        print(f"{row['phase']:<28}{(row['table'] or ''):<28}{row['wall_time_seconds']:>10}"
+              f"{str(row['input_rows_per_second'] or ''):>16}{str(row['written_rows_per_second'] or ''):>16}")
+
+
+def main():
+    """
+    - Generates synthetic workspaces for the given scale factors (once, reused afterwards)
+    - Runs etl.main with a local session profile for each scale factor
+    - Reports time and throughput per phase and table and writes a json report
+    - Saves the query plans of each scale factor and compares them with the plans of a baseline (exit code 1 on plan regressions)
+
+    """
+    parser = argparse.ArgumentParser(description="benchmark etl.py on synthetic data")
+    parser.add_argument("--workdir", default="/tmp/etl_benchmark", help="directory for synthetic workspaces and reports")
+    parser.add_argument("--scale-factors", type=float, nargs="+", default=[1], help="scale factors to run (1-100)")
+    parser.add_argument("--months", type=int, default=12, help="number of generated months")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the data generator")
+    parser.add_argument("--session-profile", choices=["local-small","local-large"], default="local-small",
+                        help="spark session profile of etl.py (driver memory is fixed by the first run of the process)")
+    parser.add_argument("--plan-baseline", help="plan directory of a previous benchmark (<workdir>/plans/<commit>) to compare plans with")
+    args = parser.parse_args()
+
+    report = {'commit':get_git_commit(),
+              'timestamp':time.strftime("%Y-%m-%dT%H:%M:%S"),
+              'spark_version':None,
+              'python_version':platform.python_version(),
+              'machine':platform.machine(),
+              'cpu_count':os.cpu_count(),
+              'session_profile':args.session_profile,
+              'months':args.months,
+              'seed':args.seed,
+              'runs':[]}
+    plan_regressions = False
+    for scale_factor in args.scale_factors:
+        workspace_path = os.path.join(args.workdir, f"sf{scale_factor:g}_m{args.months}_s{args.seed}")
+        if not os.path.exists(os.path.join(workspace_path, "sas_data")):
+            print(f"generating synthetic data into {workspace_path}")
+            generate_workspace(workspace_path, scale_factor, args.months, seed=args.seed)
+        start_time = time.time()
+        run_id = etl.main("full", workspace_path, session_profile=args.session_profile, resume=False, capture_plans=True)
+        total_time = round(time.time() - start_time, 3)
+        # stop the session, so the next scale factor gets sized by its own input
+        spark = SparkSession.getActiveSession()
+        report['spark_version'] = spark.version
+        spark.stop()
+        records = read_run_metrics(os.path.join(workspace_path, "spark-warehouse", "etl_metrics.jsonl"), run_id)
+        report_rows = summarize_metrics(records)
+        print_report(scale_factor, report_rows)
+        # keep plans of this commit, plans of synthetic data are comparable across commits
+        plan_directory = os.path.join(args.workdir, "plans", report['commit'], f"sf{scale_factor:g}")
+        shutil.rmtree(plan_directory, ignore_errors=True)
+        shutil.copytree(os.path.join(workspace_path, "spark-warehouse", "_plans"), plan_directory)
+        plan_findings = None
+        if args.plan_baseline:
+            print(f"comparing query plans with {args.plan_baseline}")
+            plan_findings = plan_diff.compare_plans(plan_diff.load_plans(os.path.join(args.plan_baseline, f"sf{scale_factor:g}")),
+                                                    plan_diff.load_plans(plan_directory))
+            plan_diff.print_findings(plan_findings)
+            plan_regressions = plan_regressions or any(finding.get('severity') == 'regression' for finding in plan_findings)
+        report['runs'].append({'scale_factor':scale_factor,
+                               'run_id':run_id,
+                               'total_wall_time_seconds':total_time,
+                               'plan_directory':plan_directory,
+                               'plan_findings':plan_findings,
+                               'metrics':report_rows})
+
+    report_file = os.path.join(args.workdir, f"benchmark_{report['commit']}_{time.strftime('%Y%m%dT%H%M%S')}.json")
+    with open(report_file, 'w') as f_report:
+        json.dump(report, f_report, indent=2)
+    print(f"report written into {report_file}")
+    if plan_regressions:
+        print("query plan regressions found.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
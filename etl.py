@@ -1,26 +1,159 @@
 import os
+import glob
 import pandas as pd
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import udf,col
-from datetime import datetime, timedelta
+from pyspark.sql import SparkSession, Observation
+from pyspark import StorageLevel
+from pyspark.sql.functions import expr
+from pyspark.sql.types import StructType, StructField, StringType
 from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, date_format, dayofweek, quarter, dayofyear
 import inspect
 import sql_queries
+import source_schemas
+import etl_metrics
+import etl_checkpoints
+import sas_ingest
+import etl_validation
+import plan_diff
 import time
+import argparse
+import re
+import json
+import threading
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
-# create spark session build function
-def create_spark_session():
+# spark session profiles
+# - packages: only loaded by the profile s3, which has to be selected explicitly (auto selects a local profile)
+# - memory_config: local mode runs tasks in the driver, clusters in executors
+# - memory and shuffle partitions get sized from the input size within the given bounds
+session_profiles = {'local-small':{'master':'local[*]',
+                                   'packages':[],
+                                   'memory_config':'spark.driver.memory',
+                                   'memory_input_factor':4,
+                                   'min_memory_gb':1,
+                                   'max_memory_gb':4,
+                                   'bytes_per_shuffle_partition':64*1024*1024,
+                                   'min_shuffle_partitions':4,
+                                   'max_shuffle_partitions':64},
+                    'local-large':{'master':'local[*]',
+                                   'packages':[],
+                                   'memory_config':'spark.driver.memory',
+                                   'memory_input_factor':2,
+                                   'min_memory_gb':4,
+                                   'max_memory_gb':32,
+                                   'bytes_per_shuffle_partition':128*1024*1024,
+                                   'min_shuffle_partitions':16,
+                                   'max_shuffle_partitions':800},
+                    's3':{'master':None,
+                          'packages':['org.apache.hadoop:hadoop-aws:2.7.0'],
+                          'memory_config':'spark.executor.memory',
+                          'memory_input_factor':1,
+                          'min_memory_gb':2,
+                          'max_memory_gb':16,
+                          'bytes_per_shuffle_partition':128*1024*1024,
+                          'min_shuffle_partitions':64,
+                          'max_shuffle_partitions':2000}}
+
+def select_session_profile(session_profile, input_size_bytes, local_small_max_bytes=2*1024*1024*1024):
+    '''
+        - Resolves the session profile "auto": local-small for small inputs, local-large otherwise
+        - Returns the name of the session profile
+        
+            Args:
+                session_profile (string): name of a profile in session_profiles or "auto"
+                input_size_bytes (int): measured size of the source data (None if unknown)
+                local_small_max_bytes (int): maximum input size for profile local-small
+        
+    '''
+    if session_profile != "auto":
+        if session_profile not in session_profiles:
+            raise Exception(f"unknown session profile: {session_profile}")
+        return session_profile
+    if input_size_bytes is not None and input_size_bytes <= local_small_max_bytes:
+        return "local-small"
+    return "local-large"
+
+def get_input_size(paths):
+    '''
+        - Measures the size in bytes of local source files (glob patterns allowed)
+        - Returns the total size
+        
+            Args:
+                paths (list): source paths
+        
     '''
-        - Creates spark session
+    total_size = 0
+    for path in paths:
+        total_size += sum(get_path_size(file_path) for file_path in glob.glob(path))
+    return total_size
+
+def get_session_sizing(profile_props, input_size_bytes):
     '''
-    spark = SparkSession \
+        - Sizes memory and shuffle partitions from the input size within the bounds of the profile
+        - Returns a dictionary of spark configs (minimums of the profile if the input size is unknown)
+        
+            Args:
+                profile_props (dict): session profile
+                input_size_bytes (int): measured size of the source data (None if unknown)
+        
+    '''
+    input_size_bytes = input_size_bytes or 0
+    memory_gb = -(-input_size_bytes * profile_props.get('memory_input_factor') // (1024*1024*1024))
+    shuffle_partitions = -(-input_size_bytes // profile_props.get('bytes_per_shuffle_partition'))
+    return {profile_props.get('memory_config'):f"{min(max(memory_gb, profile_props.get('min_memory_gb')), profile_props.get('max_memory_gb'))}g",
+            'spark.sql.shuffle.partitions':str(min(max(shuffle_partitions, profile_props.get('min_shuffle_partitions')),
+                                                   profile_props.get('max_shuffle_partitions')))}
+
+def create_spark_session(session_profile="local-small", input_size_bytes=None):
+    '''
+        - Creates spark session for a session profile
+        - S3 packages are only loaded by profiles which need them (no ivy resolution for local runs)
+        - Memory and shuffle partitions are sized from the input size
+        
+            Args:
+                session_profile (string): name of a profile in session_profiles
+                input_size_bytes (int): measured size of the source data (None if unknown)
+        
+    '''
+    profile_props = session_profiles.get(session_profile)
+    session_sizing = get_session_sizing(profile_props, input_size_bytes)
+    print(f"session profile: {session_profile}; input size: {input_size_bytes}; sizing: {session_sizing}")
+    builder = SparkSession \
         .builder \
-        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0")\
-        .getOrCreate()
+        .config("spark.scheduler.mode", "FAIR")\
+        .config("spark.sql.adaptive.enabled", "true")\
+        .config("spark.sql.adaptive.skewJoin.enabled", "true")
+    if profile_props.get('master'):
+        builder = builder.master(profile_props.get('master'))
+    if profile_props.get('packages'):
+        builder = builder.config("spark.jars.packages", ",".join(profile_props.get('packages')))
+    for config_key, config_value in session_sizing.items():
+        builder = builder.config(config_key, config_value)
+    spark = builder.getOrCreate()
+    # an already running session keeps its static configs, runtime configs get applied anyway
+    spark.conf.set("spark.sql.shuffle.partitions", session_sizing.get('spark.sql.shuffle.partitions'))
     return spark
 
 
+def check_num_rows(num_rows):
+    '''
+        - Checks if a number of rows determined during a load operation is greater than zero
+        - Raises exception if no rows have been loaded
+        
+            Args:
+                num_rows (int): number of loaded rows
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    print(f"number of rows:{num_rows}")
+    if num_rows > 0:
+        print("dataframe is not empty.")
+        print("quality check:passed!")
+    else:
+        print("ERROR:dataframe is empty!")
+        raise Exception("quality check for dataframe:failed!")
+
 def check_empty_df(dataframe_name):
     '''
         - Checks if dataframe is populated after a load operation
@@ -31,17 +164,114 @@ def check_empty_df(dataframe_name):
         
     '''
     print(f"running function: {inspect.stack()[0][3]}...")
-    has_passed=False
-    num_rows_df = dataframe_name.count() # number of rows
-    print(f"number of rows:{num_rows_df}")
-    if num_rows_df > 0:
-        has_passed=True
-        print("dataframe is not empty.")
-        print("quality check:passed!")
+    check_num_rows(dataframe_name.count())
+
+def observe_table_checks(table, df, key_columns):
+    '''
+        - Attaches the aggregations of the quality checks (row count, null values of key columns) to a dataframe as observed metrics
+        - Metrics get collected by the job writing the dataframe, so the table is neither computed twice nor read back
+        - Returns the observed dataframe and the observation
+        
+            Args:
+                table (string): name of the table
+                df (dataframe): table to be written
+                key_columns (list): columns which must not contain null values
+        
+    '''
+    observation = Observation(f"quality_check_{table}")
+    check_exprs = [expr("count(*)").alias("num_rows")] + [expr(f"sum(case when {key_column} is null then 1 else 0 end)").alias(f"nulls_{key_column}")
+                                                           for key_column in key_columns or []]
+    return df.observe(observation, *check_exprs), observation
+
+def check_observed_metrics(observation, key_columns, allow_empty=False):
+    '''
+        - Validates the metrics observed while a table was written
+        - Raises exception if table is empty (unless allowed, e.g. appended deltas) or key columns contain null values
+        - Returns the number of written rows
+        
+            Args:
+                observation (observation): observation returned by observe_table_checks, available once the write has completed
+                key_columns (list): columns which must not contain null values
+                allow_empty (bool): accepts writes without rows
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    check_result = observation.get
+    if allow_empty:
+        print(f"number of rows:{check_result.get('num_rows')}")
     else:
-        print("ERROR:dataframe is empty!")
+        check_num_rows(check_result.get('num_rows'))
+    for key_column in key_columns or []:
+        num_nulls = check_result.get(f"nulls_{key_column}") or 0
+        print(f"null values in key column {key_column}:{num_nulls}")
+        if num_nulls:
+            print(f"ERROR:key column {key_column} contains null values!")
+            raise Exception("quality check for dataframe:failed!")
+    print("quality check:passed!")
+    return check_result.get('num_rows')
+
+def compare_key_counts(check_result, surrogate_key, natural_key):
+    '''
+        - Compares the number of distinct surrogate and natural keys
+        - Raises exception if a surrogate key is derived from different natural keys
+        
+            Args:
+                check_result (row): aggregation including distinct_surrogate_keys and distinct_natural_keys
+                surrogate_key (string): key column derived from the natural key
+                natural_key (list): columns the surrogate key is derived from
+        
+    '''
+    print(f"distinct surrogate keys:{check_result['distinct_surrogate_keys']}; distinct natural keys:{check_result['distinct_natural_keys']}")
+    if check_result['distinct_surrogate_keys'] != check_result['distinct_natural_keys']:
+        print(f"ERROR:surrogate key {surrogate_key} collides for different natural keys {natural_key}!")
         raise Exception("quality check for dataframe:failed!")
+    print("quality check:passed!")
+
+def check_surrogate_keys(spark, df, surrogate_key, natural_key, file_path=None):
+    '''
+        - Detects hash collisions of surrogate keys by comparing distinct surrogate and natural keys in a single aggregation
+        - Keys already written into file_path are included, so new keys colliding with existing ones are detected as well
+        - Raises exception if a surrogate key is derived from different natural keys
+        
+            Args:
+                spark: spark session
+                df (dataframe): table to be written
+                surrogate_key (string): key column derived from the natural key
+                natural_key (list): columns the surrogate key is derived from
+                file_path (string): path of the written table (incremental and streaming mode)
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    df_keys = df.select([surrogate_key] + natural_key)
+    if file_path and os.path.exists(file_path):
+        df_keys = df_keys.unionByName(spark.read.parquet(file_path).select([surrogate_key] + natural_key))
+    check_result = df_keys.selectExpr(f"count(distinct {surrogate_key}) as distinct_surrogate_keys",
+                                      f"count(distinct struct({', '.join(natural_key)})) as distinct_natural_keys").collect()[0]
+    compare_key_counts(check_result, surrogate_key, natural_key)
+
+def check_unique_keys(df, surrogate_key, num_rows=None):
+    '''
+        - Checks a surrogate key whose natural key is not written into the table (e.g. id of the fact table) for duplicates
+        - Counts the distinct keys of the written rows in a single aggregation and compares them with the number of written rows
+        - Fewer distinct keys than rows mean duplicate natural keys or hash collisions
+        - Raises exception if the surrogate key is not unique
+        
+            Args:
+                df (dataframe): written rows (partitions written by the load)
+                surrogate_key (string): key column derived from the natural key
+                num_rows (int): rows observed by the write, counted together with the keys if None (e.g. appended partitions)
         
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    check_exprs = [f"count(distinct {surrogate_key}) as distinct_keys"] + (["count(*) as num_rows"] if num_rows is None else [])
+    check_result = df.selectExpr(*check_exprs).collect()[0]
+    num_rows = check_result['num_rows'] if num_rows is None else num_rows
+    print(f"distinct keys:{check_result['distinct_keys']}; rows:{num_rows}")
+    if check_result['distinct_keys'] != num_rows:
+        print(f"ERROR:surrogate key {surrogate_key} is not unique (duplicate natural keys or hash collisions)!")
+        raise Exception("quality check for dataframe:failed!")
+    print("quality check:passed!")
+
 def check_df_cols(dataframe_name,checkvalue_columns):
     '''
         - Checks if the amount columns in the dataframe matches the expected amount
@@ -67,11 +297,11 @@ def check_df_cols(dataframe_name,checkvalue_columns):
 def stage_source_data(spark,source_data_dict):
     '''
         - Reads a dictionary including processing properties
-        - Stages source data
+        - Stages source data using declared schemas, source filters and column projections
         
             Args:
                 spark: spark session
-                source_data_dict (int): dictionary including source data and processing props for each source data
+                source_data_dict (dict): dictionary including source data and processing props for each source data
         
     '''
     
@@ -79,60 +309,194 @@ def stage_source_data(spark,source_data_dict):
     start_time=time.time()
     print("-"*50)
     for key, value in source_data_dict.items():
-    # create read command
-        if value.get('data_format')=='csv':
-            read_cmd=f"{value.get('df_name')} = spark.read.option(\'mode\',\'DROPMALFORMED\').option(\'header\',True).{value.get('data_format')}(\'{value.get('path')}\',sep=\'{value.get('separator_in_source')}\')"
-        else:
-            read_cmd=f"{value.get('df_name')} = spark.read.option(\'mode\',\'DROPMALFORMED\').option(\'header\',True).{value.get('data_format')}(\'{value.get('path')}\')"
-
-        # create view command
-        create_view_cmd = f"{value.get('df_name')}.createOrReplaceTempView(\"{value.get('view_name')}\")"
-
-        # create check command for dataframe dimensions
-        check_rows_cmd = f"check_empty_df({value.get('df_name')})"
-        check_cols_cmd = f"check_df_cols({value.get('df_name')},{value.get('expected_num_cols')})"
         # stage source data
         try:
             print(f"loading source data: {value.get('path')} into dataframe: {value.get('df_name')}")
-            print(f"executing command: {read_cmd}")
-            exec(read_cmd)
+            reader=spark.read.option('mode','DROPMALFORMED').option('header',True)
+            if value.get('schema'):
+                reader=reader.schema(value.get('schema'))
+            if value.get('data_format')=='csv':
+                df=reader.csv(value.get('path'),sep=value.get('separator_in_source'))
+            else:
+                df=reader.format(value.get('data_format')).load(value.get('path'))
+            if value.get('source_filter'):
+                # filters on source columns get pushed down into the scan
+                print(f"applying source filter: {value.get('source_filter')}")
+                df=df.where(value.get('source_filter'))
+            if value.get('select_columns'):
+                print(f"projecting columns: {value.get('select_columns')}")
+                df=df.selectExpr(*value.get('select_columns'))
             print(f"{value.get('df_name')} has been created.")
         except Exception as e:
-            print(e)
+            # a failed read must not leave the dataframe of the previous source registered under this view name
+            print(f"ERROR:loading source data: {value.get('path')} failed: {e}")
+            raise
 
         # create temp view     
-        try:
-            print(f"creating temp view: {value.get('view_name')} for dataframe: {value.get('df_name')}")
-            print(f"executing command: {create_view_cmd}")
-            exec(create_view_cmd)
-            print(f"temp view: {value.get('view_name')} has been created.")
-        except Exception as e:
-            print(e)
+        print(f"creating temp view: {value.get('view_name')} for dataframe: {value.get('df_name')}")
+        df.createOrReplaceTempView(value.get('view_name'))
+        print(f"temp view: {value.get('view_name')} has been created.")
 
         # check dataframes
         try:
-            print(f"checking if dataframe:{value.get('df_name')} is empty...")
-            print(f"executing command: {check_rows_cmd}")
-            exec(check_rows_cmd)
+            # cached sources get checked while materializing the cache, saving one scan
+            if not value.get('cache_props'):
+                print(f"checking if dataframe:{value.get('df_name')} is empty...")
+                check_empty_df(df)
             print(f"checking number of columns of dataframe:{value.get('df_name')}")
-            print(f"executing command: {check_cols_cmd}")
-            exec(check_cols_cmd)
+            check_df_cols(df,value.get('expected_num_cols'))
             print(f"staging of source data: {value.get('path')} complete.")
             print("-"*50)
         except Exception as e:
             print(e)
-        end_time=time.time()
-        duration=end_time-start_time
-        print(f"execution of function complete: {inspect.stack()[0][3]}; duration: {duration} seconds.")
-        print("-"*50)
+    end_time=time.time()
+    duration=end_time-start_time
+    print(f"execution of function complete: {inspect.stack()[0][3]}; duration: {duration} seconds.")
+    print("-"*50)
+
+def parse_sas_labels(labels_file):
+    '''
+        - Reads the SAS labels description file line by line in a single pass
+        - Extracts all value-label blocks (value <name> ... ;)
+        - Returns a dictionary block name:dictionary code:label
+        
+            Args:
+                labels_file (string): path of the SAS labels description file
+        
+    '''
+    label_blocks = {}
+    code_labels = None
+    with open(labels_file) as f:
+        for line in f:
+            line = line.replace('\t', '')
+            if code_labels is None:
+                # search for the beginning of the next block, e.g. "value $i94prtl"
+                block_match = re.match(r"\s*value\s+\$?(\w+)", line, re.IGNORECASE)
+                if block_match:
+                    code_labels = label_blocks.setdefault(block_match.group(1).lower(), {})
+                    if ';' in line[block_match.end():]:
+                        code_labels = None
+                continue
+            is_block_end = ';' in line
+            code_label = line.split(';')[0].replace("'", "").split('=')
+            if len(code_label) == 2:
+                code_labels[code_label[0].strip()] = code_label[1].strip()
+            if is_block_end:
+                code_labels = None
+    return label_blocks
 
 # function to read & load map files
-def load_code_label_map(spark,target_basepath, labels_file, record_delimeter, code_maps_exp_num_cols_dict):
+def load_cached_label_maps(spark, map_cache_path, maps_fingerprint, code_maps_exp_num_cols_dict):
+    '''
+        - Loads label maps parsed by a previous run from parquet and creates temp views
+        - Marks the cached version as recently used
+        - Returns False if no complete cached version with the same fingerprint exists
+        
+            Args:
+                spark: spark session
+                map_cache_path (string): directory of the cached version (named by the hash of the labels file)
+                maps_fingerprint (string): fingerprint of the labels file and the map processing
+                code_maps_exp_num_cols_dict (dict): dictionary including the amount of expected columns for  each map file
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    cache_marker_file = os.path.join(map_cache_path, "_map_cache.json")
+    if not os.path.exists(cache_marker_file):
+        print(f"no cached label maps found in {map_cache_path}")
+        return False
+    with open(cache_marker_file) as f_marker:
+        cache_metadata = json.load(f_marker)
+    if cache_metadata.get('maps_fingerprint') != maps_fingerprint:
+        print(f"cached label maps in {map_cache_path} were built by a different map processing")
+        return False
+    for df_name, view_name in cache_metadata.get('views').items():
+        df_map = spark.read.parquet(os.path.join(map_cache_path, view_name))
+        check_df_cols(df_map, code_maps_exp_num_cols_dict.get(df_name))
+        df_map.createOrReplaceTempView(view_name)
+        print(f"{view_name} loaded from {map_cache_path}")
+    os.utime(cache_marker_file)
+    return True
+
+def write_label_map_cache(spark, map_cache_path, maps_fingerprint, labels_hash, map_views):
+    '''
+        - Writes the label maps as parquet into a version directory of the map cache
+        - The marker file gets written last, so interrupted writes are not used as cached version
+        
+            Args:
+                spark: spark session
+                map_cache_path (string): directory of the version (named by the hash of the labels file)
+                maps_fingerprint (string): fingerprint of the labels file and the map processing
+                labels_hash (string): sha256 hash of the labels file
+                map_views (dict): dataframe name:view name of the maps
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    for view_name in map_views.values():
+        spark.table(view_name).coalesce(1).write.mode("overwrite").parquet(os.path.join(map_cache_path, view_name))
+    cache_metadata = {'labels_sha256':labels_hash,
+                      'maps_fingerprint':maps_fingerprint,
+                      'views':map_views,
+                      'created_at':time.strftime("%Y-%m-%dT%H:%M:%S")}
+    with open(os.path.join(map_cache_path, "_map_cache.json"), 'w') as f_marker:
+        json.dump(cache_metadata, f_marker, indent=2)
+    print(f"label maps cached in {map_cache_path}")
+
+def prune_label_map_cache(cache_directory, max_versions):
+    '''
+        - Keeps the most recently used versions of the label map cache and deletes older and incomplete versions
+        
+            Args:
+                cache_directory (string): directory of the label map cache
+                max_versions (int): maximum number of versions kept
+        
+    '''
+    version_paths = [os.path.join(cache_directory, version) for version in os.listdir(cache_directory)]
+    complete_versions = sorted([version_path for version_path in version_paths if os.path.exists(os.path.join(version_path, "_map_cache.json"))],
+                               key=lambda version_path: os.path.getmtime(os.path.join(version_path, "_map_cache.json")), reverse=True)
+    for version_path in version_paths:
+        if version_path not in complete_versions[:max_versions]:
+            print(f"removing label map cache version {version_path}")
+            shutil.rmtree(version_path, ignore_errors=True)
+
+def get_label_maps_fingerprint(labels_hash, code_maps_exp_num_cols_dict):
+    '''
+        - Returns the fingerprint of the label maps: hash of the labels file, cleanup query of the country map and expected columns
+        - Used by the label map cache and by the run manifest
+        
+            Args:
+                labels_hash (string): sha256 hash of the labels file
+                code_maps_exp_num_cols_dict (dict): dictionary including the amount of expected columns for  each map file
+        
     '''
-        - Reads a given description file and extracts fields
-        - Generates map files
-        - Writes generated maps into csv files with given delimeter
+    return etl_checkpoints.get_text_fingerprint(labels_hash, sql_queries.map_cit_res_cleanup_sql, code_maps_exp_num_cols_dict)
+
+def get_staging_fingerprint(spark, source_props):
+    '''
+        - Returns the fingerprint of a staged source: its files and the properties changing the staged rows
+          (format, separator, schema, source filter and projected columns)
+        
+            Args:
+                spark: spark session
+                source_props (dict): staging properties of the source (see source_data_dict)
+        
+    '''
+    schema = source_props.get('schema')
+    return etl_checkpoints.get_text_fingerprint(etl_checkpoints.get_files_fingerprint(source_props.get('path'), spark),
+                                                source_props.get('data_format'),
+                                                source_props.get('separator_in_source'),
+                                                schema.json() if schema else None,
+                                                source_props.get('source_filter'),
+                                                source_props.get('select_columns'))
+
+def load_code_label_map(spark,target_basepath, labels_file, record_delimeter, code_maps_exp_num_cols_dict, write_csv_maps=False, map_cache_props=None):
+    '''
+        - Reads a given description file and extracts fields in a single pass
+        - Generates map dataframes with explicit schemas and creates temp views
+        - Optionally writes generated maps into csv files with given delimeter
         - Calls quality check function with specified expected column amount value
+        - With a map cache, loads maps of a previous run with the same labels file (sha256) from parquet instead of parsing it
+          and caches newly parsed maps, keeping a bounded number of versions
+        - Returns the directory of the cached version, None if the cache is disabled
         
             Args:
                 spark: spark session
@@ -140,6 +504,8 @@ def load_code_label_map(spark,target_basepath, labels_file, record_delimeter, co
                 labels_file (string): source data to be read
                 record_delimeter (string): delimeter to be used in target csv file of maps
                 code_maps_exp_num_cols_dict (dict): dictionary including the amount of expected columns for  each map file
+                write_csv_maps (bool): writes map files as csv into target_basepath if True
+                map_cache_props (dict): cache directory and maximum number of cached versions, None disables the cache
         
     '''
     print(f"running function: {inspect.stack()[0][3]}...")
@@ -149,301 +515,1012 @@ def load_code_label_map(spark,target_basepath, labels_file, record_delimeter, co
     print(f"source file to be processed: {labels_file}")
     print(f"delimeter to be used as generating csv files: \'{record_delimeter}\'")
     print(f"dictionary specifying number of expected columns for each dataframe: {code_maps_exp_num_cols_dict}")
+    print(f"write csv map files: {write_csv_maps}")
     print("-"*50)
     
-    # read labels_file and perform initial clean (remove '\t')
-    with open(labels_file) as f:
-        file_content = f.read()
-        file_content = file_content.replace('\t', '')
-        
-    def map_codes(file, idx):
-        '''
-        - Reads label file
-        - Extracts values under a given index value
-        - Creates key, value pairs from region of interest
-        - Returns a dictionary
-        
-            Args:
-                file (file): file object to read
-                idx (str): index to be searched
-    '''
-        file_content2 = file_content[file_content.index(idx):]
-        file_content2 = file_content2[:file_content2.index(';')].split('\n')
-        file_content2 = [i.replace("'", "") for i in file_content2]
-        code_dic = [i.split('=') for i in file_content2[1:]]
-        code_dic = dict([i[0].strip(), i[1].strip()] for i in code_dic if len(i) == 2)
-        return code_dic
+    # maps of a previous run with the same labels file get loaded from cache (csv files are only written when parsing)
+    map_cache_path = None
+    if map_cache_props:
+        labels_hash = etl_checkpoints.file_sha256(labels_file)
+        maps_fingerprint = get_label_maps_fingerprint(labels_hash, code_maps_exp_num_cols_dict)
+        map_cache_path = os.path.join(map_cache_props.get('cache_directory'), labels_hash)
+        if load_cached_label_maps(spark, map_cache_path, maps_fingerprint, code_maps_exp_num_cols_dict):
+            end_time=time.time()
+            print(f"execution of function complete: {inspect.stack()[0][3]}; duration: {end_time-start_time} seconds.")
+            print('-'*50)
+            return map_cache_path
     
     # extract labels
     print(f"extracting data from {labels_file}")
-    i94cit_res = map_codes(file_content, "i94cntyl")
-    i94port = map_codes(file_content, "i94prtl")
-    i94mode = map_codes(file_content, "i94model")
-    i94addr = map_codes(file_content, "i94addrl")
-    i94visa = {'1':'Business',
-        '2': 'Pleasure',
-        '3' : 'Student'}
+    label_blocks = parse_sas_labels(labels_file)
+    print(f"extracted label blocks: {list(label_blocks)}")
+    
+    # ports are labeled as "<name>, <state code>"; ports without state are skipped
+    port_records = []
+    for port_code, port_label in label_blocks.get('i94prtl').items():
+        port_label_arr = port_label.split(",")
+        if len(port_label_arr)==2:
+            port_records.append((port_code, port_label_arr[0], port_label_arr[1].strip(" ")))
+    
+    # map properties: dataframe name, view name, columns, csv file name and records
+    code_maps_dict = {'df_cit_res':{'view_name':'map_cit_res',
+                                    'columns':['country_code','country_name'],
+                                    'file_name':'i94cit_res.csv',
+                                    'records':list(label_blocks.get('i94cntyl').items())},
+                      'df_addr':{'view_name':'map_addr',
+                                 'columns':['state_code','state_name'],
+                                 'file_name':'i94addr.csv',
+                                 'records':list(label_blocks.get('i94addrl').items())},
+                      'df_mode':{'view_name':'map_transport_mode',
+                                 'columns':['transport_code','transport_type'],
+                                 'file_name':'i94mode.csv',
+                                 'records':list(label_blocks.get('i94model').items())},
+                      'df_port':{'view_name':'map_port',
+                                 'columns':['port_code','port_name','port_state'],
+                                 'file_name':'i94port.csv',
+                                 'records':port_records},
+                      'df_visa':{'view_name':'map_visa',
+                                 'columns':['visa_code','visa_type'],
+                                 'file_name':'i94visa.csv',
+                                 'records':[('1','Business'),
+                                            ('2','Pleasure'),
+                                            ('3','Student')]}}
     print(f"extracting data from {labels_file} complete")
     print("-"*50)
     
-    file_delimeter=record_delimeter
-    
-    # process citizenship/residence file and create map
-    i94cit_res_label_target_file_name = "i94cit_res.csv"
-    i94cit_res_label_target_file = os.path.join(target_basepath,i94cit_res_label_target_file_name)
-    print(f"preparing file: {i94cit_res_label_target_file}...")
-    # write headers into file
-    with open (i94cit_res_label_target_file,'w') as f_i94cit_res:
-        f_i94cit_res.write('country_code' + file_delimeter + 'country_name\n')
-    # write values into file
-    with open (i94cit_res_label_target_file,'a') as f_i94cit_res:
-        #f_i94cit_res.write('country_code' + file_delimeter + 'country_name\n')
-        for key, value in i94cit_res.items():
-            country_code = key
-            country_name = value
-            i94cit_res_line = file_delimeter.join((country_code, country_name))
-            i94cit_res_line = i94cit_res_line + "\n"
-            f_i94cit_res.write(i94cit_res_line)
-    print(f"{i94cit_res_label_target_file} ready.")
-    # load data into dataframe
-    print(f"loading {i94cit_res_label_target_file} into dataframe...")
-    df_cit_res=spark.read.option('mode','DROPMALFORMED').option('header',True).csv(i94cit_res_label_target_file,sep=";")
-    # read number of expected columns for the specified dataframe
-    df_cit_res_expnumcols = code_maps_exp_num_cols_dict.get('df_cit_res')
-    # check dataframe dimensions
-    check_empty_df(df_cit_res)
-    check_df_cols(df_cit_res,df_cit_res_expnumcols)
-    # create temp view 
-    df_cit_res=df_cit_res.na.drop("any")
-    df_cit_res.createOrReplaceTempView("map_cit_res")
+    for df_name, map_props in code_maps_dict.items():
+        records = map_props.get('records')
+        columns = map_props.get('columns')
+        if write_csv_maps:
+            map_target_file = os.path.join(target_basepath,map_props.get('file_name'))
+            print(f"preparing file: {map_target_file}...")
+            with open (map_target_file,'w') as f_map:
+                f_map.write(record_delimeter.join(columns) + "\n")
+                for record in records:
+                    f_map.write(record_delimeter.join(record) + "\n")
+            print(f"{map_target_file} ready.")
+        # load data into dataframe
+        print(f"loading {map_props.get('view_name')} into dataframe...")
+        schema = StructType([StructField(column, StringType(), True) for column in columns])
+        df_map = spark.createDataFrame(records, schema)
+        # check dataframe dimensions
+        check_num_rows(len(records))
+        check_df_cols(df_map,code_maps_exp_num_cols_dict.get(df_name))
+        # drop records with empty values
+        df_map = df_map.replace('', None).na.drop("any")
+        # create temp view
+        df_map.createOrReplaceTempView(map_props.get('view_name'))
+        print(f"loading {map_props.get('view_name')} into dataframe complete.")
+        print("-"*50)
+    
     # clean invalid labels for country records / allocate a common id for those
-    df_cit_res=spark.sql("""
-    with cte_1 as (select cast(country_code as int) as country_id,
-    case when lower(country_name) like '%collapsed%' 
-    or lower(country_name) like '%invalid%' 
-    or lower(country_name) like '%no country code%' 
-    then 'Unknown Country' else country_name end as country_name 
-    from map_cit_res)
-    select distinct case when country_name = 'Unknown Country' then 9999 else country_id end as country_id, country_name from cte_1
-    """)
+    df_cit_res=spark.sql(sql_queries.map_cit_res_cleanup_sql)
     # create temp view 
     df_cit_res.createOrReplaceTempView("map_cit_res")
-    print(f"loading {i94cit_res_label_target_file} into dataframe complete.")
-    print("-"*50)    
-        
-    # process addr file and create map
-    # read and save i94addr labels
-    i94addr_label_target_file_name = "i94addr.csv"
-    i94addr_label_target_file = os.path.join(target_basepath,i94addr_label_target_file_name)
-    print(f"preparing file: {i94addr_label_target_file}...")
-    # write headers into file
-    with open (i94addr_label_target_file,'w') as f_i94addr:
-        f_i94addr.write('state_code' + file_delimeter + 'state_name\n')
-    with open (i94addr_label_target_file,'a') as f_i94addr:
-        #f_i94addr.write('state_code' + file_delimeter + 'state_name\n')
-        for key, value in i94addr.items():
-            state_code = key
-            state_name = value
-            i94addr_line = file_delimeter.join((state_code, state_name))
-            i94addr_line = i94addr_line + "\n"
-            f_i94addr.write(i94addr_line)
-    print(f"{i94addr_label_target_file} ready.")
-    # load data into dataframe
-    print(f"loading {i94addr_label_target_file} into dataframe...")
-    df_addr=spark.read.option('mode','DROPMALFORMED').option('header',True).csv(i94addr_label_target_file,sep=";")
-    # read number of expected columns for the specified dataframe
-    df_addr_expnumcols = code_maps_exp_num_cols_dict.get('df_addr')
-    # check dataframe dimensions
-    check_empty_df(df_addr)
-    check_df_cols(df_addr,df_addr_expnumcols)
-    # create temp view
-    df_addr=df_addr.na.drop("any")
-    df_addr.createOrReplaceTempView("map_addr")
-    print(f"loading {i94addr_label_target_file} into dataframe complete.")
-    print("-"*50)
-            
-    # process mode/transport file and create map
-    # read and save i94mode labels
-    i94mode_label_target_file_name = "i94mode.csv"
-    i94mode_label_target_file = os.path.join(target_basepath,i94mode_label_target_file_name)
-    # write headers into file
-    print(f"preparing file: {i94mode_label_target_file}...")
-    with open (i94mode_label_target_file,'w') as f_i94mode:
-        f_i94mode.write('transport_code' + file_delimeter + 'transport_type\n')
-    with open (i94mode_label_target_file,'a') as f_i94mode:
-        #f_i94mode.write('transport_code' + file_delimeter + 'transport_type\n')
-        for key, value in i94mode.items():
-            transport_code = key
-            transport_type = value
-            i94mode_line = file_delimeter.join((transport_code, transport_type))
-            i94mode_line = i94mode_line + "\n"
-            f_i94mode.write(i94mode_line)
-    print(f"{i94mode_label_target_file} ready.")
-    # load data into dataframe
-    print(f"loading {i94mode_label_target_file} into dataframe...")
-    df_mode=spark.read.option('mode','DROPMALFORMED').option('header',True).csv(i94mode_label_target_file,sep=";")
-    # read number of expected columns for the specified dataframe
-    df_mode_expnumcols = code_maps_exp_num_cols_dict.get('df_mode')
-    # check dataframe dimensions
-    check_empty_df(df_mode)
-    check_df_cols(df_mode,df_mode_expnumcols)
-    # drop rows with null values
-    df_mode=df_mode.na.drop("any")
-    # create temp view 
-    df_mode.createOrReplaceTempView("map_transport_mode")
-    print(f"loading {i94mode_label_target_file} into dataframe complete.")
-    print("-"*50)
     
-    # create csv file for i94port and create map
-    i94port_label_target_file_name = "i94port.csv"
-    i94port_label_target_file = os.path.join(target_basepath,i94port_label_target_file_name)
-    print(f"preparing file: {i94port_label_target_file}...")
-    # write header into file
-    with open (i94port_label_target_file,'w') as f_i94port:
-        f_i94port.write('port_code' + file_delimeter + 'port_name' + file_delimeter + 'port_state\n')
-    with open (i94port_label_target_file,'a') as f_i94port:
-        #f_i94port.write('port_code' + file_delimeter + 'port_name' + file_delimeter + 'port_state\n')
-        for key, value in i94port.items():
-            value_arr = value.split(",")
-            if len(value_arr)==2:
-                port_code = key
-                port_name = value_arr[0]
-                port_statecode = value_arr[1].strip(" ")
-                port_line = file_delimeter.join((port_code, port_name, port_statecode))
-                port_line = port_line + "\n"
-                f_i94port.write(port_line)
-    print(f"{i94port_label_target_file} ready.")
-    # load data into dataframe
-    print(f"loading {i94port_label_target_file} into dataframe...")
-    df_port=spark.read.option('mode','DROPMALFORMED').option('header',True).csv(i94port_label_target_file,sep=";")
-    # read number of expected columns for the specified dataframe
-    df_port_expnumcols = code_maps_exp_num_cols_dict.get('df_port')
-    # check dataframe dimensions
-    check_empty_df(df_port)
-    check_df_cols(df_port,df_port_expnumcols)
-    # create temp view
-    df_port=df_port.na.drop("any")
-    df_port.createOrReplaceTempView("map_port")
-    print(f"loading {i94port_label_target_file} into dataframe complete.")
-    print("-"*50)
-                
-       
-    # create csv file for i94visa and create map          
-    i94visa_label_target_file_name = "i94visa.csv"
-    i94visa_label_target_file = os.path.join(target_basepath,i94visa_label_target_file_name)
-    print(f"preparing file: {i94visa_label_target_file}...")
-    # write header into file
-    with open (i94visa_label_target_file,'w') as f_i94visa:
-        f_i94visa.write('visa_code' + file_delimeter + 'visa_type' + '\n')
-    with open (i94visa_label_target_file,'a') as f_i94visa:
-        #f_i94visa.write('visa_code' + file_delimeter + 'visa_type' + '\n')
-        for key, value in i94visa.items():
-            visa_code = key
-            visa_type = value
-            visa_line = file_delimeter.join((visa_code, visa_type))
-            visa_line = visa_line + "\n"
-            f_i94visa.write(visa_line)
-    print(f"{i94visa_label_target_file} ready.")
-    # load data into dataframe
-    print(f"loading {i94visa_label_target_file} into dataframe...")
-    df_visa=spark.read.option('mode','DROPMALFORMED').option('header',True).csv(i94visa_label_target_file,sep=";")
-    # read number of expected columns for the specified dataframe
-    df_visa_expnumcols = code_maps_exp_num_cols_dict.get('df_visa')
-    # check dataframe dimensions
-    check_empty_df(df_visa)
-    check_df_cols(df_visa,df_visa_expnumcols)
-    # create temp view
-    df_visa=df_visa.na.drop("any")
-    df_visa.createOrReplaceTempView("map_visa")
-    print(f"loading {i94visa_label_target_file} into dataframe complete.")
-    print("-"*50)
+    # store parsed maps for later runs with the same labels file
+    if map_cache_path:
+        write_label_map_cache(spark, map_cache_path, maps_fingerprint, labels_hash,
+                              {df_name:map_props.get('view_name') for df_name, map_props in code_maps_dict.items()})
+        prune_label_map_cache(map_cache_props.get('cache_directory'), map_cache_props.get('max_versions'))
     
     end_time=time.time()
     duration=end_time-start_time
     print(f"execution of function complete: {inspect.stack()[0][3]}; duration: {duration} seconds.")
     print('-'*50)
+    return map_cache_path
+
+def load_port_city_index(spark, port_city_props, index_fingerprint, map_cache_path=None):
+    '''
+        - Builds the lookup index port code:demographics city from map_port and the staged demographics data
+        - Port and city names are matched on normalized names, names listed in the alias table get resolved first
+        - Index is persisted next to the label maps of the same labels file and reloaded while demographics data,
+          aliases and index query are unchanged
+        - Reports the number of ports without matching city
+        - Creates the index view and caches it (small, gets broadcast in the demographics join)
+        
+            Args:
+                spark: spark session
+                port_city_props (dict): view names, index query, aliases and expected number of columns of the index
+                index_fingerprint (string): fingerprint of the demographics data, the index query and the aliases
+                map_cache_path (string): directory of the label map cache version, None builds the index without persisting it
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    start_time=time.time()
+    view_name = port_city_props.get('view_name')
+    index_metadata = {}
+    if map_cache_path and os.path.exists(os.path.join(map_cache_path, "_port_city_index.json")):
+        with open(os.path.join(map_cache_path, "_port_city_index.json")) as f_marker:
+            index_metadata = json.load(f_marker)
+    if index_metadata.get('index_fingerprint') == index_fingerprint:
+        df_index = spark.read.parquet(os.path.join(map_cache_path, view_name))
+        check_df_cols(df_index, port_city_props.get('expected_num_cols'))
+        print(f"{view_name} loaded from {map_cache_path}")
+    else:
+        alias_schema = StructType([StructField('alias_name', StringType(), True), StructField('city_name', StringType(), True)])
+        spark.createDataFrame(list(port_city_props.get('aliases').items()), alias_schema) \
+            .createOrReplaceTempView(port_city_props.get('alias_view_name'))
+        df_index = spark.sql(port_city_props.get('sql_query'))
+        check_df_cols(df_index, port_city_props.get('expected_num_cols'))
+        df_index.createOrReplaceTempView(view_name)
+        unmatched_ports = [row['port_name'] for row in spark.sql(f"""select mp.port_name from map_port mp
+            left anti join {view_name} pc on mp.port_code = pc.port_code order by mp.port_name""").collect()]
+        index_metadata = {'index_fingerprint':index_fingerprint,
+                          'num_ports':spark.table("map_port").count(),
+                          'matched_ports':df_index.count(),
+                          'unmatched_ports':unmatched_ports,
+                          'created_at':time.strftime("%Y-%m-%dT%H:%M:%S")}
+        if map_cache_path:
+            df_index.coalesce(1).write.mode("overwrite").parquet(os.path.join(map_cache_path, view_name))
+            with open(os.path.join(map_cache_path, "_port_city_index.json"), 'w') as f_marker:
+                json.dump(index_metadata, f_marker, indent=2)
+            df_index = spark.read.parquet(os.path.join(map_cache_path, view_name))
+            print(f"{view_name} cached in {map_cache_path}")
+    df_index.cache().createOrReplaceTempView(view_name)
+    print(f"ports matched to a city: {index_metadata.get('matched_ports')} of {index_metadata.get('num_ports')}; "
+          f"unmatched ports: {len(index_metadata.get('unmatched_ports'))}, e.g. {index_metadata.get('unmatched_ports')[:10]}")
+    end_time=time.time()
+    print(f"execution of function complete: {inspect.stack()[0][3]}; duration: {end_time-start_time} seconds.")
+    print('-'*50)
+    return index_metadata
     
-def create_target_tables(spark, target_directory, props_dictionary):
+def get_referenced_views(sql_query, view_names):
+    '''
+        - Returns the names of the given views which are referenced in a sql query
+        
+            Args:
+                sql_query (string): sql query to be scanned
+                view_names (list): view names to be searched for
+        
+    '''
+    return [view_name for view_name in view_names if re.search(rf"\b{re.escape(view_name)}\b", sql_query)]
+
+def get_cached_rdd_sizes(spark):
+    '''
+        - Returns a dictionary rdd_id:(memory size, disk size, cached partitions) of all persisted rdds
+        
+            Args:
+                spark: spark session
+        
+    '''
+    return {rdd_info.id():(rdd_info.memSize(), rdd_info.diskSize(), rdd_info.numCachedPartitions())
+            for rdd_info in spark.sparkContext._jsc.sc().getRDDStorageInfo()}
+
+def cache_staging_view(spark, view_name, cache_props):
+    '''
+        - Projects a staging view to the columns consumed by the target table queries
+        - Persists the projected data with the configured storage level and materializes it
+        - Replaces the staging view with the cached data
+        - Returns a dictionary describing the cache (used to track consumers and release the cache)
+        
+            Args:
+                spark: spark session
+                view_name (string): name of the staging view
+                cache_props (dict): cache properties (storage_level, columns)
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    storage_level_name = cache_props.get('storage_level','MEMORY_AND_DISK')
+    storage_level = getattr(StorageLevel, storage_level_name)
+    columns = cache_props.get('columns')
+    df = spark.table(view_name)
+    if columns:
+        print(f"projecting {view_name} to columns: {columns}")
+        df = df.select(columns)
+    rdd_ids_before = set(get_cached_rdd_sizes(spark))
+    df.persist(storage_level)
+    df.createOrReplaceTempView(view_name)
+    print(f"materializing cache for {view_name} with storage level {storage_level_name}...")
+    num_rows = df.count()
+    check_num_rows(num_rows)
+    cached_rdd_sizes = {rdd_id:sizes for rdd_id, sizes in get_cached_rdd_sizes(spark).items() if rdd_id not in rdd_ids_before}
+    mem_size = sum(sizes[0] for sizes in cached_rdd_sizes.values())
+    disk_size = sum(sizes[1] for sizes in cached_rdd_sizes.values())
+    print(f"cache for {view_name} ready. rows:{num_rows}; memory size:{mem_size} bytes; disk size:{disk_size} bytes")
+    return {'view_name':view_name,
+            'dataframe':df,
+            'storage_level':storage_level_name,
+            'num_rows':num_rows,
+            'mem_size':mem_size,
+            'disk_size':disk_size,
+            'cache_hits':0}
+
+def extract_staging_keys(spark, staging_keys_props):
+    '''
+        - Collects the distinct key tuples of the staged immigration data in a single aggregation
+        - Caches the key table, so all dimensions get derived from it without scanning staging again
+        - Returns a dictionary describing the cache (see cache_staging_view)
+        
+            Args:
+                spark: spark session
+                staging_keys_props (dict): view name, sql query and cache properties of the key table
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    df_keys = spark.sql(staging_keys_props.get('sql_query'))
+    df_keys.createOrReplaceTempView(staging_keys_props.get('view_name'))
+    return cache_staging_view(spark, staging_keys_props.get('view_name'), staging_keys_props.get('cache_props'))
+
+def release_staging_cache(cache_info):
+    '''
+        - Unpersists a cached staging view and reports its usage
+        
+            Args:
+                cache_info (dict): cache description returned by cache_staging_view
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    cache_info.get('dataframe').unpersist()
+    print(f"cache for {cache_info.get('view_name')} released. storage level:{cache_info.get('storage_level')}; "
+          f"rows:{cache_info.get('num_rows')}; memory size:{cache_info.get('mem_size')} bytes; "
+          f"disk size:{cache_info.get('disk_size')} bytes; cache hits:{cache_info.get('cache_hits')}")
+
+def get_cached_rdd_ids(df):
+    '''
+        - Returns the ids of the cached rdds a dataframe reads from (InMemoryRelation nodes of its plan with cached data)
+        - Caches which are not materialized yet are skipped
+        
+            Args:
+                df (dataframe): spark dataframe
+        
+    '''
+    rdd_ids = set()
+    plans = [df._jdf.queryExecution().withCachedData()]
+    while plans:
+        plan = plans.pop()
+        if plan.nodeName() == "InMemoryRelation":
+            cache_builder = plan.cacheBuilder()
+            if cache_builder.isCachedColumnBuffersLoaded():
+                rdd_ids.add(cache_builder.cachedColumnBuffers().id())
+        else:
+            children = plan.children()
+            plans.extend(children.apply(index) for index in range(children.size()))
+    return rdd_ids
+
+def detect_skewed_keys(spark, view_name, skew_props):
+    '''
+        - Samples a view and determines heavy keys of a join column
+        - Reports the estimated rows per shuffle partition of a join shuffled on the key column
+        - Tunes the thresholds of adaptive skew join handling if heavy keys are found
+        - Skew join handling only applies to joins shuffled on the key: dimensions deduplicate their port keys
+          and the fact table broadcasts its dimensions below broadcast_threshold_bytes, so it covers larger dimensions only
+        - Partition sizes which actually ran get reported by the metrics of each table (shuffle read per task)
+        - Returns list of heavy keys
+        
+            Args:
+                spark: spark session
+                view_name (string): name of the view to be analyzed
+                skew_props (dict): skew properties (key_column, sample_fraction, heavy_key_ratio, seed, adaptive skew join thresholds)
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    key_column = skew_props.get('key_column')
+    num_partitions = int(spark.conf.get("spark.sql.shuffle.partitions"))
+    df_sample = spark.table(view_name).sample(fraction=skew_props.get('sample_fraction'), seed=skew_props.get('seed', 42))
+    key_counts = dict((row[key_column], row['count']) for row in df_sample.groupBy(key_column).count().collect())
+    num_sampled_rows = sum(key_counts.values())
+    if not num_sampled_rows:
+        print("sample is empty. skipping skew analysis.")
+        return []
+    heavy_keys = [key for key, key_count in sorted(key_counts.items(), key=lambda key_count: -key_count[1])
+                  if key_count / num_sampled_rows >= skew_props.get('heavy_key_ratio')]
+    heavy_share = sum(key_counts[key] for key in heavy_keys) / num_sampled_rows
+    print(f"sampled rows:{num_sampled_rows}; heavy keys of {key_column}:{heavy_keys}; share of rows:{heavy_share:.2%}")
+    
+    # rows per shuffle partition of a join shuffled on the key column (hash partitioning)
+    df_distribution = df_sample.selectExpr(f"pmod(hash({key_column}), {num_partitions}) as partition_id")
+    partition_rows = sorted(row['count'] for row in df_distribution.groupBy("partition_id").count().collect())
+    partition_rows = [0] * (num_partitions - len(partition_rows)) + partition_rows
+    median_rows = partition_rows[len(partition_rows) // 2]
+    print(f"estimated sampled rows per partition of a join shuffled on {key_column}: "
+          f"min:{partition_rows[0]}; median:{median_rows}; max:{partition_rows[-1]}; "
+          f"max/median:{partition_rows[-1] / median_rows if median_rows else float('inf'):.1f}")
+    
+    if heavy_keys:
+        # adaptive skew join handling is enabled by create_spark_session, heavy partitions of shuffled joins get split at runtime
+        spark.conf.set("spark.sql.adaptive.skewJoin.skewedPartitionFactor", str(skew_props.get('skewed_partition_factor')))
+        spark.conf.set("spark.sql.adaptive.skewJoin.skewedPartitionThresholdInBytes", str(skew_props.get('skewed_partition_threshold_bytes')))
+        spark.conf.set("spark.sql.adaptive.advisoryPartitionSizeInBytes", str(skew_props.get('advisory_partition_size_bytes')))
+        print(f"adaptive skew join tuned: skewed partition factor:{skew_props.get('skewed_partition_factor')}; "
+              f"threshold:{skew_props.get('skewed_partition_threshold_bytes')} bytes")
+    return heavy_keys
+
+def select_new_source_months(spark, view_name, fact_path, partition_columns):
+    '''
+        - Compares the arrival months in the staged immigration data with the partitions already written for the fact table
+        - Restricts the staging view to the months which have not been loaded yet
+        - Returns the list of new (year, month) tuples
+        
+            Args:
+                spark: spark session
+                view_name (string): name of the staging view of immigration data
+                fact_path (string): target path of the partitioned fact table
+                partition_columns (list): partition columns of the fact table (year column, month column)
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    year_column, month_column = partition_columns
+    # months available in source data
+    staged_months = spark.sql(f"""select distinct i94yr as {year_column},
+        i94mon as {month_column}
+        from {view_name}
+        where i94yr is not null and i94mon is not null""").collect()
+    staged_months = set((row[year_column], row[month_column]) for row in staged_months)
+    print(f"months in source data: {sorted(staged_months)}")
+    
+    # months already loaded into target (partition directories year=yyyy/month=m)
+    # directories without integer value (e.g. __HIVE_DEFAULT_PARTITION__) are skipped
+    loaded_months = set()
+    if os.path.exists(fact_path):
+        for year_dir in os.listdir(fact_path):
+            if not year_dir.startswith(f"{year_column}=") or not year_dir.split("=")[1].isdigit():
+                continue
+            for month_dir in os.listdir(os.path.join(fact_path, year_dir)):
+                if month_dir.startswith(f"{month_column}=") and month_dir.split("=")[1].isdigit():
+                    loaded_months.add((int(year_dir.split("=")[1]), int(month_dir.split("=")[1])))
+    print(f"months already loaded: {sorted(loaded_months)}")
+    
+    new_months = sorted(staged_months - loaded_months)
+    print(f"months to be loaded: {new_months}")
+    if new_months:
+        month_filter = " or ".join(f"(i94yr={source_year} and i94mon={source_month})" for source_year, source_month in new_months)
+        df = spark.sql(f"select * from {view_name} where {month_filter}")
+        df.createOrReplaceTempView(view_name)
+    return new_months
+
+def merge_dimension(spark, df, file_path, natural_key):
+    '''
+        - Compares a freshly built dimension with the dimension already written into target
+        - Keeps only rows with natural keys which do not exist in target yet
+        - Surrogate keys are derived from natural keys, so new rows need no renumbering
+        - Returns dataframe including the new rows
+        
+            Args:
+                spark: spark session
+                df (dataframe): dimension built from the current source data
+                file_path (string): target path of the dimension
+                natural_key (list): columns identifying a dimension row
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    if not os.path.exists(file_path):
+        print(f"no existing data found in {file_path}. all rows are new.")
+        return df
+    df_existing = spark.read.parquet(file_path)
+    df_new = df.join(df_existing.select(natural_key), on=natural_key, how="left_anti")
+    # keep column order of the existing dimension
+    return df_new.select(df_existing.columns)
+
+def merge_fact_partitions(spark, df, file_path, key_columns, partition_filter):
+    '''
+        - Compares a delta of the fact table with the rows already written into the affected partitions
+        - Keeps only rows with keys which do not exist in these partitions yet, so replayed deltas add no duplicates
+        - Returns dataframe including the new rows
+        
+            Args:
+                spark: spark session
+                df (dataframe): fact rows built from the current source data
+                file_path (string): target path of the partitioned fact table
+                key_columns (list): columns identifying a fact row
+                partition_filter (string): sql condition selecting the partitions affected by the delta
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    if not os.path.exists(file_path):
+        print(f"no existing data found in {file_path}. all rows are new.")
+        return df
+    df_existing = spark.read.parquet(file_path).where(partition_filter).select(key_columns)
+    return df.join(df_existing, on=key_columns, how="left_anti")
+
+def get_path_size(path):
+    '''
+        - Returns the size in bytes of a file or of all files below a directory
+        
+            Args:
+                path (string): file or directory path
+        
+    '''
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total_size = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        total_size += sum(os.path.getsize(os.path.join(dir_path, file_name)) for file_name in file_names)
+    return total_size
+
+def build_broadcast_hint(table, broadcast_candidates, table_sizes, threshold_bytes):
+    '''
+        - Decides for each joined dimension if it gets broadcast, based on its measured size
+        - Logs the chosen join strategy for each dimension
+        - Returns a sql hint for the broadcast dimensions (empty string if none)
+        
+            Args:
+                table (string): name of the table to be built
+                broadcast_candidates (dict): alias:view name of the dimensions joined in the query
+                table_sizes (dict): view name:measured size in bytes
+                threshold_bytes (int): maximum size of a dimension to be broadcast
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    broadcast_aliases = []
+    for alias, view_name in broadcast_candidates.items():
+        size = table_sizes.get(view_name)
+        if size is not None and size <= threshold_bytes:
+            broadcast_aliases.append(alias)
+            strategy = "broadcast hash join"
+        else:
+            strategy = "shuffle join (chosen by spark)"
+        print(f"{table}: join with {view_name} as {alias}; measured size:{size} bytes; threshold:{threshold_bytes} bytes; strategy:{strategy}")
+    if not broadcast_aliases:
+        return ""
+    return f"/*+ BROADCAST({', '.join(broadcast_aliases)}) */ "
+
+def log_join_strategies(table, df):
+    '''
+        - Logs the join operators of the physical plan of a dataframe
+        
+            Args:
+                table (string): name of the table to be built
+                df (dataframe): spark dataframe
+        
+    '''
+    plan_summary = plan_diff.get_plan_summary(df._jdf.queryExecution().executedPlan().toString())
+    print(f"{table}: planned joins: {dict((k, v) for k, v in plan_summary.get('join_counts').items() if v)}; "
+          f"shuffle exchanges: {plan_summary.get('shuffle_exchanges')}")
+
+def get_query_plan(table, df):
+    '''
+        - Captures the optimized and physical plan of a dataframe before it gets executed
+        - With adaptive query execution, the physical plan is the initial plan (isFinalPlan=false): strategies changed at runtime
+          (e.g. a sort merge join demoted to a broadcast join) are not contained, runs get compared on their initial plans
+        - Returns a dictionary with both plans, the estimated size of the optimizer and the plan summary (see plan_diff.get_plan_summary)
+        
+            Args:
+                table (string): name of the table to be built
+                df (dataframe): spark dataframe
+        
+    '''
+    query_execution = df._jdf.queryExecution()
+    optimized_plan = query_execution.optimizedPlan()
+    physical_plan = query_execution.executedPlan().toString()
+    plan_statistics = optimized_plan.stats()
+    return {'table':table,
+            'run_id':etl_metrics.metrics_config.get('run_id'),
+            'captured_at':time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'estimated':{'size_bytes':int(str(plan_statistics.sizeInBytes())),
+                         'row_count':int(str(plan_statistics.rowCount().get())) if plan_statistics.rowCount().isDefined() else None},
+            'adaptive_initial_plan':"isFinalPlan=false" in physical_plan,
+            'summary':plan_diff.get_plan_summary(physical_plan),
+            'optimized_plan':optimized_plan.toString(),
+            'physical_plan':physical_plan}
+
+def write_query_plan(plan_directory, query_plan, actual_sizes):
+    '''
+        - Writes a captured query plan together with the actual sizes of the written table into <plan_directory>/<table>.json
+        
+            Args:
+                plan_directory (string): directory of the plan files
+                query_plan (dict): plan captured by get_query_plan
+                actual_sizes (dict): actual number of rows and bytes of the written table
+        
+    '''
+    os.makedirs(plan_directory, exist_ok=True)
+    query_plan['actual'] = actual_sizes
+    plan_file = os.path.join(plan_directory, f"{query_plan.get('table')}.json")
+    with open(plan_file, 'w') as f_plan:
+        json.dump(query_plan, f_plan, indent=2)
+    print(f"query plan of {query_plan.get('table')} written into {plan_file}")
+
+def get_table_dependencies(props_dictionary):
+    '''
+        - Derives dependencies between target tables from the view names referenced in their sql queries
+        - Returns a dictionary table:list of tables which have to be built before
+        
+            Args:
+                props_dictionary (dict): dictionary containing target object names, sql queries to perform and other properties
+        
+    '''
+    view_tables = {processing_props.get('view_name'):table for table, processing_props in props_dictionary.items()}
+    table_dependencies = {}
+    for table, processing_props in props_dictionary.items():
+        referenced_views = get_referenced_views(processing_props.get('sql_query'), list(view_tables))
+        table_dependencies[table] = [view_tables[view_name] for view_name in referenced_views if view_tables[view_name] != table]
+    return table_dependencies
+
+def get_table_fingerprints(props_dictionary, view_fingerprints):
+    '''
+        - Fingerprints each target table by its processing properties (including the sql query), the fingerprints
+          of the source views it reads and the fingerprints of the tables it depends on
+        - A changed input therefore changes the fingerprints of all tables reading it (directly or through other tables)
+        - Returns a dictionary table:fingerprint
+        
+            Args:
+                props_dictionary (dict): dictionary containing target object names, sql queries to perform and other properties
+                view_fingerprints (dict): view name:fingerprint of the views created from source data (staging and map views)
+        
+    '''
+    table_dependencies = get_table_dependencies(props_dictionary)
+    table_fingerprints = {}
+    def get_fingerprint(table):
+        if table not in table_fingerprints:
+            processing_props = props_dictionary.get(table)
+            referenced_views = get_referenced_views(processing_props.get('sql_query'), list(view_fingerprints))
+            table_fingerprints[table] = etl_checkpoints.get_text_fingerprint(processing_props,
+                                                                             [view_fingerprints[view_name] for view_name in sorted(referenced_views)],
+                                                                             [get_fingerprint(dependency) for dependency in sorted(table_dependencies[table])])
+        return table_fingerprints[table]
+    for table in props_dictionary:
+        get_fingerprint(table)
+    return table_fingerprints
+
+def run_table_dag(spark, table_dependencies, build_function, max_parallel_tables, scheduler_pool=None):
+    '''
+        - Builds tables concurrently in a thread pool sharing the spark session
+        - Submits a table as soon as all tables it depends on are complete
+        - Raises the first exception of a failed table build
+        
+            Args:
+                spark: spark session
+                table_dependencies (dict): table:list of tables which have to be built before
+                build_function (function): function building a single table, called with the table name
+                max_parallel_tables (int): maximum number of tables built at the same time
+                scheduler_pool (string): FAIR scheduler pool for the jobs of the table builds, None for default pool
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    print(f"table dependencies: {table_dependencies}")
+    
+    def run_in_pool(table):
+        if scheduler_pool:
+            spark.sparkContext.setLocalProperty("spark.scheduler.pool", scheduler_pool)
+        build_function(table)
+    
+    pending_tables = list(table_dependencies)
+    completed_tables = set()
+    running_tables = {}
+    with ThreadPoolExecutor(max_workers=max_parallel_tables) as executor:
+        while pending_tables or running_tables:
+            ready_tables = [table for table in pending_tables
+                            if all(dependency in completed_tables for dependency in table_dependencies[table])]
+            for table in ready_tables:
+                print(f"submitting table: {table}")
+                pending_tables.remove(table)
+                running_tables[executor.submit(run_in_pool, table)] = table
+            if not running_tables:
+                raise Exception(f"unresolvable table dependencies: {pending_tables}")
+            done_futures, _ = wait(running_tables, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                table = running_tables.pop(future)
+                future.result()
+                completed_tables.add(table)
+
+def get_partition_filter(partition_by, partition_values_list):
+    '''
+        - Returns a sql condition selecting the given partitions, e.g. (year=2016 and month=4) or (...)
+        
+            Args:
+                partition_by (list): partition columns
+                partition_values_list (list): tuples of partition values
+        
+    '''
+    return " or ".join("(" + " and ".join(f"{column}={value}" for column, value in zip(partition_by, partition_values)) + ")"
+                       for partition_values in partition_values_list)
+
+def apply_table_layout(table, df, layout_props, partition_by=None, num_rows=None):
+    '''
+        - Arranges rows of a table before it gets written
+        - Estimates the written size from a measured number of rows (rows of the cached view the table is built from)
+          and the row width of its schema, reduced by the expected compression of parquet
+        - Small tables (single_file, e.g. dimensions bounded by the label maps) and tables without partition and sort columns
+          fitting into one file get coalesced into a single file without a shuffle
+        - Other tables get range partitioned on partition and sort columns into the number of files of the estimated size
+        - Sorts rows within files, so parquet row groups get narrow min/max statistics on the sort columns
+        - Files exceeding max_records_per_file get split by the parquet writer
+        - Returns the rearranged dataframe
+        
+            Args:
+                table (string): name of the table
+                df (dataframe): table to be written
+                layout_props (dict): layout properties (single_file, sort_by, row_source_view, target_file_size_bytes, compression_ratio, max_files)
+                partition_by (list): partition columns of the table
+                num_rows (int): measured number of rows the table is built from, None if not measured
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    if not layout_props:
+        return df
+    partition_by = partition_by or []
+    sort_by = layout_props.get('sort_by') or []
+    if layout_props.get('single_file') and not partition_by:
+        print(f"{table}: writing a single file")
+        return df.coalesce(1).sortWithinPartitions(*sort_by) if sort_by else df.coalesce(1)
+    if num_rows is None:
+        # without a measured size the files of the last stage are kept, only rows get sorted within them
+        print(f"{table}: number of rows not measured. keeping partitioning; sort columns:{partition_by + sort_by}")
+        return df.sortWithinPartitions(*(partition_by + sort_by)) if partition_by or sort_by else df
+    row_bytes = df._jdf.schema().defaultSize()
+    estimated_file_bytes = num_rows * row_bytes / layout_props.get('compression_ratio', 1)
+    num_files = int(min(max(1, -(-estimated_file_bytes // layout_props.get('target_file_size_bytes'))), layout_props.get('max_files', 1000)))
+    print(f"{table}: measured rows:{num_rows}; row width:{row_bytes} bytes; estimated size:{int(estimated_file_bytes)} bytes; "
+          f"number of files:{num_files}; sort columns:{partition_by + sort_by}")
+    if partition_by or sort_by:
+        df = df.repartitionByRange(num_files, *(partition_by + sort_by)).sortWithinPartitions(*(partition_by + sort_by))
+    elif num_files == 1:
+        df = df.coalesce(1)
+    else:
+        df = df.repartition(num_files)
+    return df
+
+def get_layout_write_options(layout_props):
+    '''
+        - Returns parquet writer options of a table: compression codec, dictionary encoding, bloom filters, file and row group size
+        
+            Args:
+                layout_props (dict): layout properties (compression, dictionary_encoding, bloom_filter_columns, max_records_per_file, row_group_size_bytes)
+        
+    '''
+    layout_props = layout_props or {}
+    write_options = {}
+    if layout_props.get('compression'):
+        write_options['compression'] = layout_props.get('compression')
+    if layout_props.get('dictionary_encoding') is not None:
+        write_options['parquet.enable.dictionary'] = str(layout_props.get('dictionary_encoding')).lower()
+    for bloom_filter_column in layout_props.get('bloom_filter_columns') or []:
+        write_options[f'parquet.bloom.filter.enabled#{bloom_filter_column}'] = 'true'
+    if layout_props.get('max_records_per_file'):
+        write_options['maxRecordsPerFile'] = str(layout_props.get('max_records_per_file'))
+    if layout_props.get('row_group_size_bytes'):
+        write_options['parquet.block.size'] = str(layout_props.get('row_group_size_bytes'))
+    return write_options
+
+def create_target_tables(spark, target_directory, props_dictionary, load_mode="full", staging_caches=None, load_partitions=None, max_parallel_tables=4,
+                         table_fingerprints=None, fresh_tables=None, plan_directory=None, retained_views=None):
     '''
         - Reads a props dictionary including target tables of star schema and related processing props
-        - Creates tables
+        - Creates tables, independent tables are built concurrently
         - Calls quality check functions
         - Writes tables into parquet files
+        - In incremental mode, appends new dimension keys and replaces only the affected fact partitions
+        - In streaming mode, appends new dimension keys and the fact rows of a micro-batch not written yet; dimensions get cached
+        - Reloads tables which are up to date (fresh tables) from parquet instead of building them
+        - Records the state of each built table in the run manifest, so a failed run resumes with the failed/stale tables
+        - Optionally saves optimized and physical plan, estimated and actual size of each built table (compared by plan_diff.py)
         
             Args:
                 spark: spark session
                 target_directory (string): target directory for generated parquet files
                 props_dictionary (dict): dictionary containing target object names, sql queries to perform and other properties
+                load_mode (string): "full" rebuilds all tables, "incremental" merges the staged delta into existing tables,
+                                    "streaming" merges a micro-batch into existing tables
+                staging_caches (list): cache descriptions of staging views, released after their last consumer
+                load_partitions (list): partition values (year, month) loaded in incremental/streaming mode
+                max_parallel_tables (int): maximum number of tables built at the same time
+                table_fingerprints (dict): table:fingerprint recorded in the run manifest
+                fresh_tables (list): tables completed by a previous run with unchanged fingerprint
+                plan_directory (string): directory query plans get written into, None disables plan capture
+                retained_views (list): cached staging views kept after their last consumer (released by the caller)
         
     '''
     print(f"running function: {inspect.stack()[0][3]}...")
     start_time=time.time()
+    table_fingerprints = table_fingerprints or {}
+    fresh_tables = fresh_tables or []
+    print(f"tables up to date (reloaded from parquet): {fresh_tables}")
     print("-"*50)
-    # create udf for tiemstamp conversion
-    get_datetime = udf(lambda vdt:(datetime(1960,1,1)+timedelta(days=vdt)).isoformat())
-    spark.udf.register("get_datetime", get_datetime)
-    
+    print(f"load mode:{load_mode}")
     # create target tables
     processing_props_dict=props_dictionary
     spark_warehouse_path = target_directory
     print(f"specified target directory:{spark_warehouse_path}")
-    for table,processing_props in processing_props_dict.items():
-        print(f"processing table: {table}")
-        file_path=os.path.join(spark_warehouse_path,processing_props.get('target_file_name'))
-        print(f"specified processing properties:{processing_props}")
-        
-        # exclusive processing for arrival date: data enriched before creating a new dataframe
-        if table == 'df_dim_arrival_date':
-            df=spark.sql("select distinct cast (arrdate as int) as arrdate from staging_immigration_table")
-            df=df.withColumn("arrdate_conv", get_datetime(col("arrdate")))
-            df.createOrReplaceTempView(processing_props.get('view_name'))
-            df=spark.sql(processing_props.get('sql_query'))
-            df.createOrReplaceTempView(processing_props.get('view_name'))
-        else:
-            df=spark.sql(processing_props.get('sql_query'))
+    # measured sizes of written tables, used for join strategy decisions
+    table_sizes = {}
+    
+    # count consumers of each cached staging view
+    staging_caches = staging_caches or []
+    staging_cache_lock = threading.Lock()
+    for cache_info in staging_caches:
+        cache_info['remaining_consumers'] = [table for table, processing_props in processing_props_dict.items()
+                                             if table not in fresh_tables and get_referenced_views(processing_props.get('sql_query'), [cache_info.get('view_name')])]
+        print(f"consumers of cached view {cache_info.get('view_name')}: {cache_info.get('remaining_consumers')}")
+    
+    def build_target_table(table):
+        with etl_metrics.track_phase(spark, "creating_target_tables", table) as table_metrics:
+            processing_props=processing_props_dict.get(table)
+            print(f"processing table: {table}")
+            file_path=os.path.join(spark_warehouse_path,processing_props.get('target_file_name'))
+            print(f"specified processing properties:{processing_props}")
+            sql_query=processing_props.get('sql_query')
+            broadcast_candidates=processing_props.get('broadcast_candidates')
+            if broadcast_candidates:
+                join_hint=build_broadcast_hint(table, broadcast_candidates, table_sizes, processing_props.get('broadcast_threshold_bytes'))
+                sql_query=sql_query.format(join_hint=join_hint)
+            df=spark.sql(sql_query)
+            if broadcast_candidates:
+                log_join_strategies(table, df)
+            query_plan=get_query_plan(table, df) if plan_directory else None
+            # a hit is counted for each cached view whose data is read by the table, not for any cached data in the plan
+            table_rdd_ids=get_cached_rdd_ids(df)
+            with staging_cache_lock:
+                for cache_info in staging_caches:
+                    view_rdd_ids=get_cached_rdd_ids(spark.table(cache_info.get('view_name')))
+                    if table in cache_info.get('remaining_consumers') and view_rdd_ids & table_rdd_ids:
+                        cache_info['cache_hits'] += 1
+                        print(f"{table} reads cached view {cache_info.get('view_name')}")
+        
+            partition_by=processing_props.get('partition_by')
+            partition_filter=None
+            layout_props=processing_props.get('layout_props')
+            write_options=get_layout_write_options(layout_props)
+            print(f"{table}: parquet write options:{write_options}")
+            key_columns=processing_props.get('key_columns')
+            # rows of the cached view the table is built from, used to size the written files
+            num_source_rows=next((cache_info.get('num_rows') for cache_info in staging_caches
+                                  if cache_info.get('view_name') == (layout_props or {}).get('row_source_view')), None)
+            check_df_cols(df, processing_props.get('expected_num_cols'))
+            if processing_props.get('surrogate_key') and processing_props.get('natural_key'):
+                check_surrogate_keys(spark, df, processing_props.get('surrogate_key'), processing_props.get('natural_key'),
+                                     file_path if load_mode in ('incremental','streaming') else None)
+            # quality checks get collected by the write itself (observed metrics), the written table is not read back for them
+            if load_mode in ('incremental','streaming') and processing_props.get('natural_key'):
+                # dimensions: append only keys which are not in target yet, the delta may be empty
+                df=merge_dimension(spark, df, file_path, processing_props.get('natural_key'))
+                df, observation=observe_table_checks(table, df, key_columns)
+                print(f"appending new keys of {table} to {file_path}")
+                df.write.options(**write_options).mode("append").parquet(file_path)
+                allow_empty=True
+            elif load_mode == 'streaming':
+                # fact: append rows of the micro-batch which are not in their partitions yet (replayed batches add no duplicates)
+                partition_filter=get_partition_filter(partition_by, load_partitions)
+                df=merge_fact_partitions(spark, df, file_path, [processing_props.get('surrogate_key')], partition_filter)
+                df, observation=observe_table_checks(table, apply_table_layout(table, df, layout_props, partition_by, num_source_rows), key_columns)
+                print(f"appending {table} to {file_path}")
+                df.write.options(**write_options).mode("append").partitionBy(*partition_by).parquet(file_path)
+                allow_empty=True
+            else:
+                print(f"writing {table} into {file_path}")
+                df, observation=observe_table_checks(table, apply_table_layout(table, df, layout_props, partition_by, num_source_rows), key_columns)
+                writer=df.write.options(**write_options).mode("overwrite")
+                if partition_by:
+                    # incremental loads replace only the partitions contained in the staged delta
+                    overwrite_mode = "dynamic" if load_mode == 'incremental' else "static"
+                    writer=writer.option("partitionOverwriteMode",overwrite_mode).partitionBy(*partition_by)
+                writer.parquet(file_path)
+                allow_empty=False
+            print(f"{table} written. running quality check...")
+            table_metrics['rows_written']=check_observed_metrics(observation, key_columns, allow_empty)
+            # subsequent queries read the persisted table instead of recomputing it
+            df=spark.read.parquet(file_path)
+            if processing_props.get('check_unique_surrogate_key'):
+                # replayed micro-batches and merges drop fact rows by id, so ids have to be unique
+                # overwritten partitions contain the observed rows only, appended partitions get counted with the keys
+                written_filter=get_partition_filter(partition_by, load_partitions) if load_partitions else None
+                df_written=df.where(written_filter) if written_filter else df
+                check_unique_keys(df_written.select(processing_props.get('surrogate_key')), processing_props.get('surrogate_key'),
+                                  None if load_mode == 'streaming' else table_metrics['rows_written'])
+            if load_mode == 'streaming' and not partition_by:
+                # micro-batches join against cached dimensions, the cache of the previous batch gets replaced
+                spark.sql(f"uncache table if exists {processing_props.get('view_name')}")
+                df.createOrReplaceTempView(processing_props.get('view_name'))
+                spark.sql(f"cache table {processing_props.get('view_name')}")
+            else:
+                df.createOrReplaceTempView(processing_props.get('view_name'))
+            table_sizes[processing_props.get('view_name')]=get_path_size(file_path)
+            table_metrics['table_bytes']=table_sizes[processing_props.get('view_name')]
+            if query_plan:
+                write_query_plan(plan_directory, query_plan, {'rows_written':table_metrics.get('rows_written'),
+                                                              'table_bytes':table_metrics.get('table_bytes')})
+        
+            # release staging caches which are not needed anymore
+            with staging_cache_lock:
+                for cache_info in staging_caches:
+                    if table in cache_info.get('remaining_consumers'):
+                        cache_info.get('remaining_consumers').remove(table)
+                        if not cache_info.get('remaining_consumers') and cache_info.get('view_name') not in (retained_views or []):
+                            release_staging_cache(cache_info)
+            print(f"processing complete: {table}")
+            print("-"*50)
+            return table_metrics.get('rows_written')
+    
+    def reload_target_table(table):
+        with etl_metrics.track_phase(spark, "reloading_target_tables", table) as table_metrics:
+            processing_props=processing_props_dict.get(table)
+            file_path=os.path.join(spark_warehouse_path,processing_props.get('target_file_name'))
+            print(f"{table} is up to date. reloading from {file_path}")
+            df=spark.read.parquet(file_path)
             df.createOrReplaceTempView(processing_props.get('view_name'))
-        print(f"{table} created. running quality check...")
-        check_empty_df(df)
-        check_df_cols(df,processing_props.get('expected_num_cols'))
-        print(f"writing {table} into {file_path}")    
-        df.write.mode("overwrite").parquet(file_path)
-        print(f"processing complete: {table}")
-        print("-"*50)
+            table_sizes[processing_props.get('view_name')]=get_path_size(file_path)
+            table_metrics['table_bytes']=table_sizes[processing_props.get('view_name')]
+    
+    def checkpoint_target_table(table):
+        if table in fresh_tables:
+            reload_target_table(table)
+            return
+        fingerprint=table_fingerprints.get(table)
+        etl_checkpoints.record_table_state(table, fingerprint, "running", run_id=etl_metrics.metrics_config.get('run_id'))
+        try:
+            rows_written=build_target_table(table)
+        except Exception as e:
+            etl_checkpoints.record_table_state(table, fingerprint, "failed", run_id=etl_metrics.metrics_config.get('run_id'), error=str(e)[:1000])
+            raise
+        etl_checkpoints.record_table_state(table, fingerprint, "complete", run_id=etl_metrics.metrics_config.get('run_id'), rows_written=rows_written)
+    
+    # build tables in order of their dependencies, independent tables run concurrently
+    table_dependencies=get_table_dependencies(processing_props_dict)
+    run_table_dag(spark, table_dependencies, checkpoint_target_table, max_parallel_tables, "etl_target_tables")
     print("-"*50)
     end_time=time.time()
     duration=end_time-start_time
     print(f"execution of function complete: {inspect.stack()[0][3]}; duration: {duration} seconds.")
     print('-'*50)
     
-def main():
+def create_rollup_tables(spark, target_directory, rollup_props_dict, load_mode="full", load_partitions=None):
+    '''
+        - Materializes pre-aggregated arrival counts of the fact table for configured grouping columns
+        - Writes rollups partitioned like the fact table; in incremental mode only the loaded partitions get replaced
+        - Writes a manifest (rollups.json) describing the rollups, used by rollup_router.py to route queries
+        
+            Args:
+                spark: spark session
+                target_directory (string): target directory for generated parquet files
+                rollup_props_dict (dict): dictionary containing rollup names, grouping columns and target file names
+                load_mode (string): "full" rebuilds all rollups, "incremental" replaces only the loaded partitions
+                load_partitions (list): partition values (year, month) loaded in incremental mode
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    print("-"*50)
+    rollup_manifest = {}
+    for rollup, rollup_props in rollup_props_dict.items():
+        print(f"processing rollup: {rollup}")
+        file_path=os.path.join(target_directory,rollup_props.get('target_file_name'))
+        partition_by=rollup_props.get('partition_by')
+        group_by_columns=partition_by + rollup_props.get('group_by_columns')
+        partition_filter=None
+        if load_mode == 'incremental':
+            partition_filter=get_partition_filter(partition_by, load_partitions)
+        sql_query=sql_queries.rollup_arrivals_sql.format(group_by_columns=", ".join(group_by_columns),
+                                                         source_view=rollup_props.get('source_view'),
+                                                         partition_filter=f"where {partition_filter}" if partition_filter else "")
+        df=spark.sql(sql_query)
+        check_df_cols(df, len(group_by_columns) + 1)
+        df, observation=observe_table_checks(rollup, df, group_by_columns)
+        print(f"writing {rollup} into {file_path}")
+        overwrite_mode = "dynamic" if load_mode == 'incremental' else "static"
+        df.write.option("partitionOverwriteMode",overwrite_mode).partitionBy(*partition_by).mode("overwrite").parquet(file_path)
+        print(f"{rollup} written. running quality check...")
+        check_observed_metrics(observation, group_by_columns)
+        rollup_manifest[rollup] = {'path':file_path,
+                                   'source_view':rollup_props.get('source_view'),
+                                   'group_by_columns':group_by_columns,
+                                   'measure':'arrivals'}
+        print(f"processing complete: {rollup}")
+        print("-"*50)
+    rollup_manifest_file=os.path.join(target_directory,"rollups.json")
+    with open(rollup_manifest_file,'w') as f_manifest:
+        json.dump(rollup_manifest, f_manifest, indent=2)
+    print(f"rollup manifest written into {rollup_manifest_file}")
+    
+def stream_immigration_data(spark, source_props, target_directory, processing_props_dict, staging_keys_props, stream_props,
+                            rollup_props_dict=None, max_parallel_tables=4):
+    '''
+        - Watches the immigration source files with structured streaming and loads new files in micro-batches
+        - Each micro-batch extracts its staging keys, appends new dimension keys, appends its fact rows to their partitions
+          and replaces the affected partitions of the rollup tables
+        - Output is written exactly once: the stream checkpoint tracks processed files, replayed micro-batches are merged again,
+          dimension keys and fact rows already written are not appended again and rollup partitions get replaced
+        - Blocks until the stream terminates (trigger availableNow stops when all available files are loaded)
+        
+            Args:
+                spark: spark session, label maps and staging views of other sources have to be created before
+                source_props (dict): staging properties of the immigration data (path, schema, filter, columns, view name)
+                target_directory (string): target directory for generated parquet files
+                processing_props_dict (dict): dictionary containing target object names, sql queries to perform and other properties
+                staging_keys_props (dict): view name, sql query and cache properties of the key table
+                stream_props (dict): stream name, checkpoint location, files per trigger and trigger (e.g. {'processingTime':'1 minute'})
+                rollup_props_dict (dict): rollups to be updated after each micro-batch, None to skip rollups
+                max_parallel_tables (int): maximum number of tables built at the same time
+        
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    stream_name=stream_props.get('stream_name')
+    df_stream=spark.readStream.schema(source_props.get('schema'))\
+        .option("maxFilesPerTrigger", stream_props.get('max_files_per_trigger'))\
+        .format(source_props.get('data_format')).load(source_props.get('path'))
+    if source_props.get('source_filter'):
+        df_stream=df_stream.where(source_props.get('source_filter'))
+    if source_props.get('select_columns'):
+        df_stream=df_stream.selectExpr(*source_props.get('select_columns'))
+    
+    def process_batch(batch_df, batch_id):
+        # replayed micro-batches are not skipped by batch id: ids restart at 0 with a new checkpoint,
+        # the merges of dimensions, fact partitions and rollups are idempotent instead
+        # views and tables of the micro-batch live in the session of the stream
+        batch_spark=batch_df.sparkSession
+        with etl_metrics.track_phase(batch_spark, "streaming_batch", f"{stream_name}:{batch_id}") as batch_metrics:
+            batch_df.persist(StorageLevel.MEMORY_AND_DISK)
+            batch_df.createOrReplaceTempView(source_props.get('view_name'))
+            batch_month_rows=batch_df.groupBy("i94yr","i94mon").count().collect()
+            batch_months=sorted((row.i94yr, row.i94mon) for row in batch_month_rows)
+            print(f"micro-batch {batch_id} of {stream_name}: months {batch_months}")
+            batch_metrics['batch_months']=batch_months
+            if batch_months:
+                # the persisted micro-batch is described like a staging cache, so the fact files get sized by its rows
+                batch_cache={'view_name':source_props.get('view_name'),
+                             'dataframe':batch_df,
+                             'storage_level':'MEMORY_AND_DISK',
+                             'num_rows':sum(row['count'] for row in batch_month_rows),
+                             'mem_size':None,
+                             'disk_size':None,
+                             'cache_hits':0}
+                staging_caches=[batch_cache, extract_staging_keys(batch_spark, staging_keys_props)]
+                create_target_tables(batch_spark, target_directory, processing_props_dict, "streaming", staging_caches, batch_months, max_parallel_tables)
+                if rollup_props_dict:
+                    create_rollup_tables(batch_spark, target_directory, rollup_props_dict, "incremental", batch_months)
+            batch_df.unpersist()
+        etl_checkpoints.record_batch(stream_name, batch_id, batch_months=batch_months)
+        print(f"micro-batch {batch_id} of {stream_name} committed.")
+    
+    writer=df_stream.writeStream.queryName(stream_name)\
+        .foreachBatch(process_batch)\
+        .option("checkpointLocation", stream_props.get('checkpoint_location'))\
+        .trigger(**stream_props.get('trigger'))
+    print(f"starting stream {stream_name}; trigger: {stream_props.get('trigger')}; checkpoint: {stream_props.get('checkpoint_location')}")
+    query=writer.start()
+    query.awaitTermination()
+    print(f"stream {stream_name} terminated.")
+
+def main(load_mode="full", workspace_path="/home/workspace", build_rollups=True, session_profile="auto", resume=True, stream_trigger="1 minute",
+         sas_source_path=None, capture_plans=False, validate=True):
     """
     - Main function which executes functions stage_source_data, load_code_label_map and create_target_tables
+    - Returns the id of the run used in the metrics file
+    
+        Args:
+            load_mode (string): "full" rebuilds the star schema, "incremental" loads only new source months,
+                                "streaming" loads new source files continuously
+            workspace_path (string): directory containing the source data and the spark warehouse
+            build_rollups (bool): materializes rollup tables after the star schema if True
+            session_profile (string): spark session profile (see session_profiles), "auto" selects it from paths and input size
+            resume (bool): skips tables whose inputs did not change since they were completed (full load mode only)
+            stream_trigger (string): processing time interval of micro-batches (e.g. "30 seconds") or "availableNow" (streaming mode only)
+            sas_source_path (string): glob pattern of raw SAS7BDAT files converted into sas_data before staging, None skips the conversion
+            capture_plans (bool): saves query plans and sizes of the built tables into <warehouse>/_plans (see plan_diff.py)
+            validate (bool): validates keys and joins of the star schema after the target tables are built (batch load modes only)
     
     """
     print(f"running function: {inspect.stack()[0][3]}...")
-    immigration_data_basepath="/home/workspace/sas_data"
+    immigration_data_basepath=os.path.join(workspace_path,"sas_data")
     immigration_data_path=os.path.join(immigration_data_basepath,'*.parquet')
 
     # demographics data
-    demographics_data_path="/home/workspace/us-cities-demographics.csv"
+    demographics_data_path=os.path.join(workspace_path,"us-cities-demographics.csv")
 
     # labels data
-    labels_data = "/home/workspace/I94_SAS_Labels_Descriptions.SAS"
+    labels_data = os.path.join(workspace_path,"I94_SAS_Labels_Descriptions.SAS")
 
     # set target path for spark warehouse
-    spark_warehouse_path="/home/workspace/spark-warehouse"
+    spark_warehouse_path=os.path.join(workspace_path,"spark-warehouse")
+    # merges, table sizes, partition listings, run manifest, metrics and map caches use the local file system
+    if "://" in spark_warehouse_path:
+        print(f"ERROR:warehouse path {spark_warehouse_path} is not supported. workspace and warehouse have to be on a local or mounted file system.")
+        raise Exception(f"unsupported warehouse path: {spark_warehouse_path}")
     
     # dictionary to be used as staging source data
     source_data_dict = {'immigration_data':{ 'path':immigration_data_path,
                                         'df_name':'df_staging_immigration',
                                         'view_name':'staging_immigration_table',
-                                        'expected_num_cols':28,
-                                       'data_format':'parquet'},
+                                        'expected_num_cols':14,
+                                       'data_format':'parquet',
+                                       'schema':source_schemas.immigration_schema,
+                                       'source_filter':source_schemas.immigration_source_filter,
+                                       'select_columns':source_schemas.immigration_staging_columns,
+                                       'cache_props':{'storage_level':'MEMORY_AND_DISK'}},
                     'demographics_data':{'path':demographics_data_path,
                                          'df_name':'df_staging_demographics',
                                          'view_name':'staging_demographics_table',
                                          'expected_num_cols':12,
                                          'separator_in_source':";",
+                                         'schema':source_schemas.demographics_schema,
                                          'data_format':'csv'}}
     
     # dictionary to check number of columns in each map dataframe
@@ -453,54 +1530,347 @@ def main():
                            'df_port':3,
                            'df_visa':2}
     
+    # views created by load_code_label_map from the labels file
+    label_map_views = ['map_cit_res','map_addr','map_transport_mode','map_port','map_visa']
+    
+    # lookup index port code:demographics city, built from map_port and the staged demographics data
+    # aliases map names of ports or cities to the city name they are matched with (normalized before matching)
+    port_city_props = {'view_name':'map_port_city',
+                       'alias_view_name':'map_port_city_alias',
+                       'sql_query':sql_queries.port_city_index_sql,
+                       'expected_num_cols':4,
+                       'aliases':{'Urban Honolulu':'Honolulu',
+                                  'Boise City':'Boise',
+                                  'Washington DC':'Washington'}}
+    
+    # view containing all dimension keys of the staged immigration data
+    staging_keys_props = {'view_name':'staging_keys_table',
+                          'sql_query':sql_queries.staging_keys_sql,
+                          'cache_props':{'storage_level':'MEMORY_AND_DISK'}}
+    
     # dictionary specifying processing parameters as creating dimension and fact tables
     processing_props_dict={'df_dim_arrival_location':{'view_name':'dim_arrival_location',
                                              'sql_query':sql_queries.df_dim_arrival_location_sql,
                                             'expected_num_cols':4,
+                                            'natural_key':['port_code','state_code'],
+                                            'key_columns':['id','port_code'],
+                                            'surrogate_key':'id',
+                                            'layout_props':{'target_file_size_bytes':128*1024*1024,
+                                                            'single_file':True,
+                                                            'compression':'snappy'},
                                             'target_file_name':'arrival_location.parquet'},
                   'df_dim_demographics':{'view_name':'dim_demographics',
                                          'sql_query':sql_queries.df_dim_demographics_sql,
                                         'expected_num_cols':17,
+                                        'natural_key':['port_code','city','state_code'],
+                                        'key_columns':['id','port_code'],
+                                        'surrogate_key':'id',
+                                        'layout_props':{'target_file_size_bytes':128*1024*1024,
+                                                        'single_file':True,
+                                                        'compression':'snappy'},
                                         'target_file_name':'demographics.parquet'},
                   'df_dim_origin_country':{'view_name':'dim_origin_country',
                                            'sql_query':sql_queries.df_dim_origin_country_sql,
                                         'expected_num_cols':2,
+                                        'natural_key':['country_id'],
+                                        'key_columns':['country_id'],
+                                        'surrogate_key':None,
+                                        'layout_props':{'target_file_size_bytes':128*1024*1024,
+                                                        'single_file':True,
+                                                        'compression':'snappy'},
                                         'target_file_name':'origin_country.parquet'},
                   'df_dim_arrival_date':{'view_name':'dim_arrival_date',
                                          'sql_query':sql_queries.df_dim_arrival_date_sql,
                                         'expected_num_cols':10,
+                                        'natural_key':['arrdate'],
+                                        'key_columns':['arrdate'],
+                                        'surrogate_key':None,
+                                        'layout_props':{'target_file_size_bytes':128*1024*1024,
+                                                        'single_file':True,
+                                                        'compression':'snappy'},
                                         'target_file_name':'arrival_date.parquet'},
                   'df_dim_junk_visa_transport':{'view_name':'dim_junk_visa_transport',
                                                 'sql_query':sql_queries.df_dim_junk_visa_transport_sql,
                                         'expected_num_cols':5,
+                                        'natural_key':['id'],
+                                        'key_columns':['id','visa_code','transport_code'],
+                                        'surrogate_key':None,
+                                        'layout_props':{'target_file_size_bytes':128*1024*1024,
+                                                        'single_file':True,
+                                                        'compression':'snappy'},
                                         'target_file_name':'junk_visa_transport.parquet'},
                   'df_fact_immigration':{'view_name':'fact_immigration',
                                          'sql_query':sql_queries.df_fact_immigration_sql,
-                                        'expected_num_cols':11,
+                                        'expected_num_cols':13,
+                                        'partition_by':['arrival_year','arrival_month'],
+                                        'surrogate_key':'id',
+                                        'check_unique_surrogate_key':True,
+                                        'key_columns':['id','arrival_location_id','arrival_date_id','visa_transport_id',
+                                                       'country_id_citizenship','country_id_residence','arrlocation_demographics_id'],
+                                        'broadcast_candidates':{'dal':'dim_arrival_location',
+                                                                'djvt':'dim_junk_visa_transport',
+                                                                'doc1':'dim_origin_country',
+                                                                'doc2':'dim_origin_country',
+                                                                'dd':'dim_demographics'},
+                                        'broadcast_threshold_bytes':64*1024*1024,
+                                        'layout_props':{'sort_by':['arrival_date_id','arrival_location_id'],
+                                                        'target_file_size_bytes':128*1024*1024,
+                                                        'row_source_view':'staging_immigration_table',
+                                                        'compression_ratio':4,
+                                                        'max_files':2000,
+                                                        'max_records_per_file':10000000,
+                                                        'compression':'snappy',
+                                                        'dictionary_encoding':True,
+                                                        'bloom_filter_columns':['country_id_citizenship','country_id_residence']},
                                         'target_file_name':'immigration.parquet'}}
     
     
-    # build spark session
-    spark = create_spark_session()
+    # dictionary specifying rollups of the fact table (arrivals counted per grouping columns)
+    rollup_props_dict={'rollup_arrivals_port_month':{'source_view':'fact_immigration',
+                                                     'partition_by':['arrival_year','arrival_month'],
+                                                     'group_by_columns':['arrival_location_id'],
+                                                     'target_file_name':'rollup_arrivals_port_month.parquet'},
+                       'rollup_arrivals_citizenship_visa':{'source_view':'fact_immigration',
+                                                           'partition_by':['arrival_year','arrival_month'],
+                                                           'group_by_columns':['country_id_citizenship','visa_transport_id'],
+                                                           'target_file_name':'rollup_arrivals_citizenship_visa.parquet'},
+                       'rollup_arrivals_port_citizenship_visa':{'source_view':'fact_immigration',
+                                                                'partition_by':['arrival_year','arrival_month'],
+                                                                'group_by_columns':['arrival_location_id','arrlocation_demographics_id',
+                                                                                    'country_id_citizenship','visa_transport_id'],
+                                                                'target_file_name':'rollup_arrivals_port_citizenship_visa.parquet'}}
+    
+    # write structured metrics of each phase and table into the warehouse directory
+    run_id = etl_metrics.configure_metrics(os.path.join(spark_warehouse_path,"etl_metrics.jsonl"))
+    print(f"run id: {run_id}")
+    
+    # convert raw SAS files into parquet source data (no spark involved)
+    if sas_source_path:
+        print("PHASE: INGESTING SAS FILES")
+        ingest_props = {'source_path':sas_source_path,
+                        'target_directory':immigration_data_basepath,
+                        'chunk_size':500000,
+                        'max_workers':os.cpu_count()}
+        ingest_start_time = time.time()
+        conversions = sas_ingest.ingest_sas_files(ingest_props)
+        etl_metrics.write_metrics_record({'run_id':run_id,
+                                          'phase':'ingesting_sas_files',
+                                          'table':None,
+                                          'status':'succeeded',
+                                          'wall_time_seconds':round(time.time() - ingest_start_time, 3),
+                                          'files_converted':len(conversions),
+                                          'rows_converted':sum(conversion.get('num_rows') for conversion in conversions)})
+        print("PHASE: INGESTING SAS FILES complete.")
+    
+    # set based validation of the star schema: unique keys, foreign key coverage, join loss and fan out of the fact table
+    validation_props = {'staging_keys_view':staging_keys_props.get('view_name'),
+                        'fact_view':'fact_immigration',
+                        'unique_keys':{'dim_arrival_location':[['id'],['port_code']],
+                                       'dim_demographics':[['id'],['port_code']],
+                                       'dim_origin_country':[['country_id']],
+                                       'dim_arrival_date':[['arrdate']],
+                                       'dim_junk_visa_transport':[['id'],['visa_code','transport_code']]},
+                        'source_unique_keys':{'map_port':[['port_code','port_state']],
+                                              'map_port_city':[['port_code']],
+                                              'map_cit_res':[['country_id']],
+                                              'map_transport_mode':[['transport_code']]},
+                        'foreign_keys':[{'name':'arrival_location_id', 'staging_columns':['i94port'],
+                                         'dim_view':'dim_arrival_location', 'dim_columns':['port_code']},
+                                        {'name':'arrlocation_demographics_id', 'staging_columns':['i94port'],
+                                         'dim_view':'dim_demographics', 'dim_columns':['port_code']},
+                                        {'name':'visa_transport_id', 'staging_columns':['i94visa','i94mode'],
+                                         'dim_view':'dim_junk_visa_transport', 'dim_columns':['visa_code','transport_code']},
+                                        {'name':'country_id_citizenship', 'staging_columns':['i94cit'],
+                                         'dim_view':'dim_origin_country', 'dim_columns':['country_id']},
+                                        {'name':'country_id_residence', 'staging_columns':['i94res'],
+                                         'dim_view':'dim_origin_country', 'dim_columns':['country_id']},
+                                        {'name':'arrival_date_id', 'staging_columns':['arrdate'],
+                                         'dim_view':'dim_arrival_date', 'dim_columns':['arrdate']}],
+                        'thresholds':{'max_duplicate_keys':0,
+                                      'max_source_duplicate_keys':None,
+                                      'min_fk_coverage':0.5,
+                                      'max_join_loss_ratio':0.5,
+                                      'max_fan_out_rows':0},
+                        'fail_on_error':True,
+                        'report_file':os.path.join(spark_warehouse_path,"validation_report.json")}
+    validate = validate and load_mode != 'streaming'
+    
+    # build spark session sized by the input data
+    source_paths = [value.get('path') for value in source_data_dict.values()] + [labels_data]
+    input_size_bytes = get_input_size(source_paths)
+    session_profile = select_session_profile(session_profile, input_size_bytes)
+    spark = create_spark_session(session_profile, input_size_bytes)
+    if capture_plans:
+        # file scans list their pushed filters in full, set before the staging views get cached (cached plans keep their metadata)
+        spark.conf.set("spark.sql.maxMetadataStringLength", "10000")
+    
+    # fingerprint inputs and skip tables completed by a previous run with the same fingerprint
+    print("PHASE: CHECKING RUN MANIFEST")
+    etl_checkpoints.load_run_manifest(os.path.join(spark_warehouse_path,"etl_run_manifest.json"))
+    view_fingerprints = {value.get('view_name'):get_staging_fingerprint(spark, value) for value in source_data_dict.values()}
+    view_fingerprints[staging_keys_props.get('view_name')] = etl_checkpoints.get_text_fingerprint(
+        staging_keys_props.get('sql_query'), view_fingerprints.get(source_data_dict.get('immigration_data').get('view_name')))
+    labels_fingerprint = get_label_maps_fingerprint(etl_checkpoints.file_sha256(labels_data), code_maps_exp_num_cols)
+    view_fingerprints.update({view_name:labels_fingerprint for view_name in label_map_views})
+    port_city_fingerprint = etl_checkpoints.get_text_fingerprint(
+        view_fingerprints.get(source_data_dict.get('demographics_data').get('view_name')), port_city_props.get('sql_query'), port_city_props.get('aliases'))
+    view_fingerprints[port_city_props.get('view_name')] = etl_checkpoints.get_text_fingerprint(labels_fingerprint, port_city_fingerprint)
+    table_fingerprints = get_table_fingerprints(processing_props_dict, view_fingerprints)
+    resume = resume and load_mode == 'full'
+    fresh_tables = [table for table, processing_props in processing_props_dict.items()
+                    if resume and etl_checkpoints.is_table_fresh(table, table_fingerprints[table],
+                                                                 os.path.join(spark_warehouse_path,processing_props.get('target_file_name')))]
+    rollup_source_views = [rollup_props.get('source_view') for rollup_props in rollup_props_dict.values()]
+    rollup_fingerprint = etl_checkpoints.get_text_fingerprint(rollup_props_dict, sql_queries.rollup_arrivals_sql,
+                                                              [table_fingerprints[table] for table, processing_props in processing_props_dict.items()
+                                                               if processing_props.get('view_name') in rollup_source_views])
+    rollups_fresh = resume and etl_checkpoints.is_table_fresh("rollup_tables", rollup_fingerprint, os.path.join(spark_warehouse_path,"rollups.json"))
+    # source views read by the tables to be built, phases preparing other views get skipped
+    required_views = get_referenced_views("\n".join(processing_props.get('sql_query') for table, processing_props in processing_props_dict.items()
+                                                    if table not in fresh_tables), list(view_fingerprints))
+    if validate and validation_props.get('staging_keys_view') not in required_views:
+        required_views.append(validation_props.get('staging_keys_view'))
+    print(f"tables to be built: {[table for table in processing_props_dict if table not in fresh_tables]}; required views: {required_views}")
+    print("PHASE: CHECKING RUN MANIFEST complete.")
+    if len(fresh_tables) == len(processing_props_dict) and (rollups_fresh or not build_rollups):
+        print("all tables are up to date. nothing to load.")
+        print(f"function: {inspect.stack()[0][3]} complete")
+        return run_id
     
     # stage source data
     print("PHASE:STAGING")
-    stage_source_data(spark, source_data_dict)
+    with etl_metrics.track_phase(spark, "staging"):
+        stage_source_data(spark, source_data_dict)
     print("PHASE: STAGING complete.")
     
     # extract & load code maps
     print("PHASE: LOADING MAPS")
     target_csv_delimeter=";"
-    load_code_label_map(spark, spark_warehouse_path, labels_data,target_csv_delimeter,code_maps_exp_num_cols)
+    write_csv_maps=False
+    map_cache_props={'cache_directory':os.path.join(spark_warehouse_path,"_label_maps"),
+                     'max_versions':3}
+    map_cache_path=None
+    with etl_metrics.track_phase(spark, "loading_maps"):
+        if any(view_name in required_views for view_name in label_map_views + [port_city_props.get('view_name')]):
+            map_cache_path = load_code_label_map(spark, spark_warehouse_path, labels_data,target_csv_delimeter,code_maps_exp_num_cols,write_csv_maps,map_cache_props)
+        if port_city_props.get('view_name') in required_views:
+            load_port_city_index(spark, port_city_props, port_city_fingerprint, map_cache_path)
     print("PHASE: LOADING MAPS complete.")
     
+    # load new immigration files continuously in micro-batches
+    if load_mode == 'streaming':
+        print("PHASE: STREAMING")
+        stream_props = {'stream_name':'immigration_stream',
+                        'checkpoint_location':os.path.join(spark_warehouse_path,"_checkpoints","immigration_stream"),
+                        'max_files_per_trigger':4,
+                        'trigger':{'availableNow':True} if stream_trigger == 'availableNow' else {'processingTime':stream_trigger}}
+        stream_immigration_data(spark, source_data_dict.get('immigration_data'), spark_warehouse_path, processing_props_dict,
+                                staging_keys_props, stream_props, rollup_props_dict if build_rollups else None)
+        print("PHASE: STREAMING complete.")
+        print(f"function: {inspect.stack()[0][3]} complete")
+        return run_id
+    
+    # restrict staged data to months which are not loaded yet
+    if load_mode == 'incremental':
+        print("PHASE: SELECTING NEW SOURCE MONTHS")
+        fact_props = processing_props_dict.get('df_fact_immigration')
+        with etl_metrics.track_phase(spark, "selecting_new_source_months"):
+            new_months = select_new_source_months(spark,
+                                                  source_data_dict.get('immigration_data').get('view_name'),
+                                                  os.path.join(spark_warehouse_path,fact_props.get('target_file_name')),
+                                                  fact_props.get('partition_by'))
+        print("PHASE: SELECTING NEW SOURCE MONTHS complete.")
+        if not new_months:
+            print("no new source months found. nothing to load.")
+            print(f"function: {inspect.stack()[0][3]} complete")
+            return run_id
+    
+    # cache staging data which is read by several target tables
+    print("PHASE: CACHING STAGING DATA")
+    with etl_metrics.track_phase(spark, "caching_staging_data"):
+        staging_caches = [cache_staging_view(spark, value.get('view_name'), value.get('cache_props'))
+                          for value in source_data_dict.values() if value.get('cache_props') and value.get('view_name') in required_views]
+    print("PHASE: CACHING STAGING DATA complete.")
+    
+    # detect heavy ports and tune skew handling of the joins on i94port
+    print("PHASE: ANALYZING SKEW")
+    skew_props = {'key_column':'i94port',
+                  'sample_fraction':0.01,
+                  'heavy_key_ratio':0.05,
+                  'skewed_partition_factor':3,
+                  'skewed_partition_threshold_bytes':64*1024*1024,
+                  'advisory_partition_size_bytes':32*1024*1024}
+    with etl_metrics.track_phase(spark, "analyzing_skew"):
+        if source_data_dict.get('immigration_data').get('view_name') in required_views:
+            detect_skewed_keys(spark, source_data_dict.get('immigration_data').get('view_name'), skew_props)
+    print("PHASE: ANALYZING SKEW complete.")
+    
+    # extract all dimension keys from staging in a single scan
+    print("PHASE: EXTRACTING STAGING KEYS")
+    with etl_metrics.track_phase(spark, "extracting_staging_keys"):
+        if staging_keys_props.get('view_name') in required_views:
+            staging_caches.append(extract_staging_keys(spark, staging_keys_props))
+    print("PHASE: EXTRACTING STAGING KEYS complete.")
+    
     # create target tables
     print("PHASE: CREATING TARGET TABLES")
-    create_target_tables(spark,spark_warehouse_path,processing_props_dict)
+    load_partitions = new_months if load_mode == 'incremental' else None
+    max_parallel_tables = 4
+    plan_directory = os.path.join(spark_warehouse_path,"_plans") if capture_plans else None
+    # the staging keys stay cached for the validation
+    retained_views = [validation_props.get('staging_keys_view')] if validate else []
+    with etl_metrics.track_phase(spark, "creating_target_tables"):
+        create_target_tables(spark,spark_warehouse_path,processing_props_dict,load_mode,staging_caches,load_partitions,max_parallel_tables,
+                             table_fingerprints,fresh_tables,plan_directory,retained_views)
     print("PHASE: CREATING TARGET TABLES complete.")
     
+    # validate keys and joins of the star schema on the cached staging keys and the dimensions
+    if validate:
+        print("PHASE: VALIDATING STAR SCHEMA")
+        fact_props = processing_props_dict.get('df_fact_immigration')
+        partition_filter = get_partition_filter(fact_props.get('partition_by'), load_partitions) if load_partitions else None
+        with etl_metrics.track_phase(spark, "validating_star_schema"):
+            etl_validation.validate_star_schema(spark, validation_props, partition_filter)
+        for cache_info in staging_caches:
+            if cache_info.get('view_name') in retained_views:
+                release_staging_cache(cache_info)
+        print("PHASE: VALIDATING STAR SCHEMA complete.")
+    
+    # pre-aggregate arrivals for frequent analytical queries
+    if build_rollups and rollups_fresh:
+        print("rollup tables are up to date.")
+    elif build_rollups:
+        print("PHASE: CREATING ROLLUP TABLES")
+        etl_checkpoints.record_table_state("rollup_tables", rollup_fingerprint, "running", run_id=run_id)
+        try:
+            with etl_metrics.track_phase(spark, "creating_rollup_tables"):
+                create_rollup_tables(spark,spark_warehouse_path,rollup_props_dict,load_mode,load_partitions)
+        except Exception as e:
+            etl_checkpoints.record_table_state("rollup_tables", rollup_fingerprint, "failed", run_id=run_id, error=str(e)[:1000])
+            raise
+        etl_checkpoints.record_table_state("rollup_tables", rollup_fingerprint, "complete", run_id=run_id)
+        print("PHASE: CREATING ROLLUP TABLES complete.")
+    
     print(f"function: {inspect.stack()[0][3]} complete")
+    return run_id
     
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="ETL pipeline for US immigration data lake")
+    parser.add_argument("--load-mode", choices=["full","incremental","streaming"], default="full",
+                        help="full: rebuild all tables; incremental: load only new source months; streaming: load new source files continuously")
+    parser.add_argument("--workspace", default="/home/workspace",
+                        help="directory containing the source data and the spark warehouse")
+    parser.add_argument("--no-rollups", action="store_true", help="skip creation of rollup tables")
+    parser.add_argument("--session-profile", choices=["auto"] + list(session_profiles), default="auto",
+                        help="spark session profile, auto: local-small/local-large by input size")
+    parser.add_argument("--no-resume", action="store_true", help="rebuild all tables, even if their inputs did not change")
+    parser.add_argument("--trigger", default="1 minute",
+                        help="streaming mode: interval of micro-batches (e.g. '30 seconds') or 'availableNow' (load available files and stop)")
+    parser.add_argument("--sas-source", help="glob pattern of raw SAS7BDAT files converted into <workspace>/sas_data before staging, "
+                                             "e.g. '../../data/18-83510-I94-Data-2016/*.sas7bdat'")
+    parser.add_argument("--capture-plans", action="store_true", help="save query plans and sizes of built tables into <warehouse>/_plans")
+    parser.add_argument("--no-validation", action="store_true", help="skip the validation of keys and joins of the star schema")
+    args = parser.parse_args()
+    main(args.load_mode, args.workspace, not args.no_rollups, args.session_profile, not args.no_resume, args.trigger, args.sas_source,
+         args.capture_plans, not args.no_validation)
     
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import threading
+
+# run manifest of the warehouse, loaded by load_run_manifest
+checkpoint_config = {'manifest_file':None,
+                     'manifest':None}
+manifest_file_lock = threading.Lock()
+
+
+def file_sha256(file_path, block_size=1024*1024):
+    '''
+        - Returns the sha256 hash of the content of a file
+
+            Args:
+                file_path (string): path of the file
+                block_size (int): number of bytes read at once
+
+    '''
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f_input:
+        for block in iter(lambda: f_input.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_text_fingerprint(*values):
+    '''
+        - Returns the sha256 hash of json serializable values (e.g. sql queries, processing properties, other fingerprints)
+
+            Args:
+                values: values to be fingerprinted
+
+    '''
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_files_fingerprint(path, spark=None):
+    '''
+        - Fingerprints source files by their paths, sizes and modification times (file contents are not read)
+        - Local paths may contain glob patterns, other paths (e.g. s3a://) are listed through the hadoop file system of the spark session
+        - Returns the sha256 hash of the file listing
+
+            Args:
+                path (string): file, directory or glob pattern
+                spark: spark session, required for paths which are not local
+
+    '''
+    file_listing = []
+    if "://" in path:
+        hadoop_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+        file_system = hadoop_path.getFileSystem(spark._jsc.hadoopConfiguration())
+        for status in (file_system.globStatus(hadoop_path) or []):
+            files = file_system.listFiles(status.getPath(), True)
+            while files.hasNext():
+                file_status = files.next()
+                file_listing.append((file_status.getPath().toString(), file_status.getLen(), file_status.getModificationTime()))
+    else:
+        for matched_path in glob.glob(path):
+            file_paths = [matched_path] if os.path.isfile(matched_path) else \
+                         [os.path.join(dir_path, file_name) for dir_path, dir_names, file_names in os.walk(matched_path) for file_name in file_names]
+            for file_path in file_paths:
+                file_stat = os.stat(file_path)
+                file_listing.append((file_path, file_stat.st_size, file_stat.st_mtime_ns))
+    return get_text_fingerprint(sorted(file_listing))
+
+
+def load_run_manifest(manifest_file):
+    '''
+        - Loads the run manifest of the warehouse (fingerprints and states of the tables of previous runs)
+        - Starts an empty manifest if the file does not exist
+
+            Args:
+                manifest_file (string): path of the run manifest (json)
+
+    '''
+    manifest = {'tables':{}}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f_manifest:
+            manifest = json.load(f_manifest)
+    checkpoint_config['manifest_file'] = manifest_file
+    checkpoint_config['manifest'] = manifest
+    return manifest
+
+
+def is_table_fresh(table, fingerprint, file_path):
+    '''
+        - Checks if a table has been completed by a previous run with the same fingerprint and still exists
+
+            Args:
+                table (string): name of the table
+                fingerprint (string): fingerprint of the inputs and processing properties of the table
+                file_path (string): path of the written table
+
+    '''
+    table_state = (checkpoint_config.get('manifest') or {'tables':{}}).get('tables').get(table, {})
+    return table_state.get('status') == 'complete' and table_state.get('fingerprint') == fingerprint and os.path.exists(file_path)
+
+
+def record_table_state(table, fingerprint, status, **details):
+    '''
+        - Records the state of a table in the run manifest and writes the manifest (replaced atomically)
+
+            Args:
+                table (string): name of the table
+                fingerprint (string): fingerprint of the inputs and processing properties of the table
+                status (string): running, complete or failed
+                details: further values to be recorded (e.g. run id, written rows)
+
+    '''
+    if not checkpoint_config.get('manifest_file'):
+        return
+    with manifest_file_lock:
+        table_state = {'fingerprint':fingerprint,
+                       'status':status,
+                       'updated_at':time.strftime("%Y-%m-%dT%H:%M:%S")}
+        table_state.update(details)
+        checkpoint_config.get('manifest').get('tables')[table] = table_state
+        write_run_manifest()
+
+
+def record_batch(stream_name, batch_id, **details):
+    '''
+        - Records the last committed micro-batch of a stream in the run manifest and writes the manifest (informational, replays are not skipped)
+
+            Args:
+                stream_name (string): name of the stream
+                batch_id (int): id of the micro-batch
+                details: further values to be recorded (e.g. loaded months)
+
+    '''
+    if not checkpoint_config.get('manifest_file'):
+        return
+    with manifest_file_lock:
+        stream_state = {'last_batch_id':batch_id,
+                        'updated_at':time.strftime("%Y-%m-%dT%H:%M:%S")}
+        stream_state.update(details)
+        checkpoint_config.get('manifest').setdefault('streams', {})[stream_name] = stream_state
+        write_run_manifest()
+
+
+def write_run_manifest():
+    '''
+        - Writes the run manifest, the file gets replaced atomically (callers hold manifest_file_lock)
+    '''
+    manifest_file = checkpoint_config.get('manifest_file')
+    manifest_dir = os.path.dirname(manifest_file)
+    if manifest_dir:
+        os.makedirs(manifest_dir, exist_ok=True)
+    with open(manifest_file + ".tmp", 'w') as f_manifest:
+        json.dump(checkpoint_config.get('manifest'), f_manifest, indent=2, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
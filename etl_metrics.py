@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextlib
+import urllib.request
+
+# metrics configuration of the current run, set by configure_metrics
+metrics_config = {'metrics_file':None,
+                  'run_id':None}
+metrics_file_lock = threading.Lock()
+
+# stage metrics of the spark monitoring api collected for each record
+stage_metric_names = ['inputBytes','inputRecords','outputBytes','outputRecords',
+                      'shuffleReadBytes','shuffleReadRecords','shuffleWriteBytes','shuffleWriteRecords',
+                      'memoryBytesSpilled','diskBytesSpilled','executorRunTime','executorCpuTime']
+
+
+def configure_metrics(metrics_file, run_id=None):
+    '''
+        - Sets the metrics file records get appended to and the id of the current run
+        
+            Args:
+                metrics_file (string): path of the metrics file (json lines)
+                run_id (string): id of the run, generated if not given
+        
+    '''
+    metrics_config['metrics_file'] = metrics_file
+    metrics_config['run_id'] = run_id or time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+    return metrics_config['run_id']
+
+
+def get_stage_metrics(spark, stage_ids, timeout_seconds=5):
+    '''
+        - Reads metrics of the given stages from the spark monitoring api (spark ui)
+        - Sums the metrics of all attempts of all stages
+        - Returns None if the spark ui is not available
+        
+            Args:
+                spark: spark session
+                stage_ids (list): ids of the stages
+                timeout_seconds (int): maximum time to wait for stages to be reported as complete
+        
+    '''
+    ui_url = spark.sparkContext.uiWebUrl
+    if not ui_url:
+        return None
+    totals = dict((metric_name, 0) for metric_name in stage_metric_names)
+    for stage_id in stage_ids:
+        stage_url = f"{ui_url}/api/v1/applications/{spark.sparkContext.applicationId}/stages/{stage_id}"
+        deadline = time.time() + timeout_seconds
+        while True:
+            try:
+                with urllib.request.urlopen(stage_url) as response:
+                    stage_attempts = json.loads(response.read().decode())
+            except Exception as e:
+                print(f"metrics for stage {stage_id} not available: {e}")
+                stage_attempts = []
+                break
+            # listener events are processed asynchronously, wait until metrics are final
+            if all(attempt.get('status') != 'ACTIVE' for attempt in stage_attempts) or time.time() > deadline:
+                break
+            time.sleep(0.2)
+        for attempt in stage_attempts:
+            for metric_name in stage_metric_names:
+                totals[metric_name] += attempt.get(metric_name, 0) or 0
+    return totals
+
+
+def get_shuffle_read_partitions(spark, stage_ids, quantiles=(0.0, 0.5, 1.0)):
+    '''
+        - Reads the distribution of shuffle read records per task of the given stages from the spark monitoring api
+        - Tasks of a stage reading a shuffle process one (coalesced or skew split) partition each, so the distribution
+          shows the partition sizes which actually ran, after adaptive query execution
+        - Returns a dictionary stage id:records per task at the given quantiles (stages without shuffle read are left out),
+          None if the spark ui is not available
+        
+            Args:
+                spark: spark session
+                stage_ids (list): ids of the stages
+                quantiles (tuple): quantiles of the distribution (p0, p50, p100 by default)
+        
+    '''
+    ui_url = spark.sparkContext.uiWebUrl
+    if not ui_url:
+        return None
+    stages_url = f"{ui_url}/api/v1/applications/{spark.sparkContext.applicationId}/stages"
+    partitions = {}
+    for stage_id in stage_ids:
+        try:
+            with urllib.request.urlopen(f"{stages_url}/{stage_id}") as response:
+                stage_attempts = json.loads(response.read().decode())
+            for attempt in stage_attempts:
+                if not attempt.get('shuffleReadRecords'):
+                    continue
+                summary_url = f"{stages_url}/{stage_id}/{attempt.get('attemptId')}/taskSummary?quantiles={','.join(str(q) for q in quantiles)}"
+                with urllib.request.urlopen(summary_url) as response:
+                    task_summary = json.loads(response.read().decode())
+                partitions[stage_id] = dict(zip([f"p{round(quantile*100)}" for quantile in quantiles],
+                                                task_summary.get('shuffleReadMetrics', {}).get('readRecords', [])))
+        except Exception as e:
+            print(f"task summary for stage {stage_id} not available: {e}")
+    return partitions
+
+
+def write_metrics_record(record):
+    '''
+        - Appends a metrics record as json line to the configured metrics file
+        
+            Args:
+                record (dict): metrics record
+        
+    '''
+    metrics_file = metrics_config.get('metrics_file')
+    if not metrics_file:
+        return
+    with metrics_file_lock:
+        metrics_dir = os.path.dirname(metrics_file)
+        if metrics_dir:
+            os.makedirs(metrics_dir, exist_ok=True)
+        with open(metrics_file, 'a') as f_metrics:
+            f_metrics.write(json.dumps(record) + "\n")
+
+
+@contextlib.contextmanager
+def track_phase(spark, phase, table=None):
+    '''
+        - Tracks the spark jobs started in the current thread within the block using a job group
+        - Collects wall time, job and stage ids, input/output rows and bytes, shuffle, spill and cpu time
+        - Writes a structured record into the metrics file
+        - Yields the record, so callers can add own values (e.g. number of written rows)
+        - Jobs get attributed to the innermost tracked block only
+        
+            Args:
+                spark: spark session
+                phase (string): name of the etl phase
+                table (string): name of the table processed in the phase, if any
+        
+    '''
+    spark_context = spark.sparkContext
+    job_group = f"{phase}:{table or ''}:{uuid.uuid4().hex[:8]}"
+    previous_job_group = spark_context.getLocalProperty("spark.jobGroup.id")
+    previous_description = spark_context.getLocalProperty("spark.job.description")
+    spark_context.setJobGroup(job_group, f"{phase} {table or ''}".strip())
+    record = {'run_id':metrics_config.get('run_id'),
+              'phase':phase,
+              'table':table,
+              'start_time':time.strftime("%Y-%m-%dT%H:%M:%S")}
+    start_time = time.time()
+    status = 'failed'
+    try:
+        yield record
+        status = 'succeeded'
+    finally:
+        record['wall_time_seconds'] = round(time.time() - start_time, 3)
+        record['status'] = status
+        status_tracker = spark_context.statusTracker()
+        job_ids = sorted(status_tracker.getJobIdsForGroup(job_group))
+        stage_ids = []
+        for job_id in job_ids:
+            job_info = status_tracker.getJobInfo(job_id)
+            if job_info:
+                stage_ids.extend(job_info.stageIds)
+        record['job_ids'] = job_ids
+        record['stage_ids'] = sorted(set(stage_ids))
+        stage_metrics = get_stage_metrics(spark, record['stage_ids'])
+        if stage_metrics is not None:
+            record.update(stage_metrics)
+        if stage_metrics and stage_metrics.get('shuffleReadRecords'):
+            # rows per shuffle partition which actually ran (e.g. joins on hot ports)
+            record['shuffle_read_partitions'] = get_shuffle_read_partitions(spark, record['stage_ids'])
+            for stage_id, stage_partitions in (record['shuffle_read_partitions'] or {}).items():
+                print(f"metrics: phase:{phase}; table:{table}; stage:{stage_id}; shuffle read records per partition: {stage_partitions}")
+        spark_context.setLocalProperty("spark.jobGroup.id", previous_job_group)
+        spark_context.setLocalProperty("spark.job.description", previous_description)
+        write_metrics_record(record)
+        print(f"metrics: phase:{phase}; table:{table}; status:{status}; wall time:{record['wall_time_seconds']} seconds; "
+              f"jobs:{len(job_ids)}; stages:{len(record['stage_ids'])}")
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import inspect
+
+
+def get_existing_views(spark, view_names):
+    '''
+        - Returns the given view names which are registered in the spark session
+
+            Args:
+                spark: spark session
+                view_names (list): view names to be checked
+
+    '''
+    registered_views = set(table.name for table in spark.catalog.listTables())
+    return [view_name for view_name in view_names if view_name in registered_views]
+
+
+def check_unique_keys(spark, unique_keys, max_duplicate_keys, severity):
+    '''
+        - Counts rows and distinct values of each key of a view in a single aggregation per view
+        - Returns one result per view and key (rows, distinct keys, duplicate rows, passed)
+
+            Args:
+                spark: spark session
+                unique_keys (dict): view name:list of keys (list of columns) which have to be unique
+                max_duplicate_keys (int): maximum number of duplicate rows per key, None only reports duplicates
+                severity (string): error (fails validation) or warning
+
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    results = []
+    existing_views = get_existing_views(spark, list(unique_keys))
+    for view_name, keys in unique_keys.items():
+        if view_name not in existing_views:
+            results.append({'check':'unique_key', 'view':view_name, 'status':'skipped', 'detail':"view not available"})
+            continue
+        check_exprs = ["count(*) as num_rows"] + [f"count(distinct struct({', '.join(key)})) as distinct_{key_number}"
+                                                  for key_number, key in enumerate(keys)]
+        check_result = spark.table(view_name).selectExpr(*check_exprs).collect()[0]
+        for key_number, key in enumerate(keys):
+            duplicate_rows = check_result['num_rows'] - check_result[f"distinct_{key_number}"]
+            passed = max_duplicate_keys is None or duplicate_rows <= max_duplicate_keys
+            results.append({'check':'unique_key', 'view':view_name, 'key':key,
+                            'num_rows':check_result['num_rows'],
+                            'distinct_keys':check_result[f"distinct_{key_number}"],
+                            'duplicate_rows':duplicate_rows,
+                            'severity':severity,
+                            'status':'passed' if passed else 'failed'})
+    return results
+
+
+def check_join_coverage(spark, staging_keys_view, foreign_keys, fact_view, thresholds, partition_filter=None):
+    '''
+        - Measures how many staged rows find a row in each joined dimension, using the (small) staging key table with
+          its row counts instead of the staged data: one aggregation left joining the distinct dimension keys
+        - Compares the rows expected from the joins with the rows of the fact table (row count from parquet metadata)
+        - Join loss: share of staged rows dropped by the inner joins of the fact query
+        - Fan out: fact rows exceeding the expected rows, caused by dimension keys matching several rows
+        - Returns one result per foreign key and one result for join loss and fan out
+
+            Args:
+                spark: spark session
+                staging_keys_view (string): view of the distinct key tuples of the staged data, including column num_rows
+                foreign_keys (list): dictionaries of foreign key name, staging columns, dimension view and dimension columns
+                fact_view (string): view of the fact table
+                thresholds (dict): min_fk_coverage, max_join_loss_ratio, max_fan_out_rows
+                partition_filter (string): sql condition selecting the fact partitions loaded from the staged data
+
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    required_views = [staging_keys_view, fact_view] + [foreign_key.get('dim_view') for foreign_key in foreign_keys]
+    missing_views = sorted(set(required_views) - set(get_existing_views(spark, required_views)))
+    if missing_views:
+        return [{'check':'join_coverage', 'status':'skipped', 'detail':f"views not available: {missing_views}"}]
+    joins = []
+    matched_conditions = []
+    check_exprs = ["sum(sk.num_rows) as staging_rows"]
+    for fk_number, foreign_key in enumerate(foreign_keys):
+        dim_columns = ", ".join(f"{dim_column} as key_{column_number}" for column_number, dim_column in enumerate(foreign_key.get('dim_columns')))
+        join_condition = " and ".join(f"sk.{staging_column} = fk{fk_number}.key_{column_number}"
+                                      for column_number, staging_column in enumerate(foreign_key.get('staging_columns')))
+        joins.append(f"left join (select distinct {dim_columns}, 1 as matched from {foreign_key.get('dim_view')}) fk{fk_number} on {join_condition}")
+        matched_conditions.append(f"fk{fk_number}.matched is not null")
+        check_exprs.append(f"sum(case when fk{fk_number}.matched is null then sk.num_rows else 0 end) as unmatched_{fk_number}")
+    check_exprs.append(f"sum(case when {' and '.join(matched_conditions)} then sk.num_rows else 0 end) as expected_fact_rows")
+    check_result = spark.sql(f"select {', '.join(check_exprs)} from {staging_keys_view} sk {' '.join(joins)}").collect()[0]
+    fact_rows = spark.sql(f"select count(*) as num_rows from {fact_view} {'where ' + partition_filter if partition_filter else ''}").collect()[0]['num_rows']
+
+    staging_rows = check_result['staging_rows'] or 0
+    results = []
+    for fk_number, foreign_key in enumerate(foreign_keys):
+        unmatched_rows = check_result[f"unmatched_{fk_number}"] or 0
+        fk_coverage = 1 - unmatched_rows / staging_rows if staging_rows else 1.0
+        results.append({'check':'fk_coverage', 'foreign_key':foreign_key.get('name'), 'view':foreign_key.get('dim_view'),
+                        'staging_rows':staging_rows,
+                        'unmatched_rows':unmatched_rows,
+                        'coverage':round(fk_coverage, 6),
+                        'severity':'error',
+                        'status':'passed' if fk_coverage >= thresholds.get('min_fk_coverage') else 'failed'})
+    expected_fact_rows = check_result['expected_fact_rows'] or 0
+    join_loss_ratio = 1 - expected_fact_rows / staging_rows if staging_rows else 0.0
+    results.append({'check':'join_loss', 'view':fact_view,
+                    'staging_rows':staging_rows,
+                    'expected_fact_rows':expected_fact_rows,
+                    'join_loss_ratio':round(join_loss_ratio, 6),
+                    'severity':'error',
+                    'status':'passed' if join_loss_ratio <= thresholds.get('max_join_loss_ratio') else 'failed'})
+    fan_out_rows = fact_rows - expected_fact_rows
+    results.append({'check':'fan_out', 'view':fact_view,
+                    'expected_fact_rows':expected_fact_rows,
+                    'fact_rows':fact_rows,
+                    'fan_out_rows':fan_out_rows,
+                    'severity':'error',
+                    'status':'passed' if abs(fan_out_rows) <= thresholds.get('max_fan_out_rows') else 'failed'})
+    return results
+
+
+def validate_star_schema(spark, validation_props, partition_filter=None):
+    '''
+        - Validates the star schema with set based checks on cached staging keys and the (small) dimension tables:
+          uniqueness of dimension keys, duplicate keys in label maps (hidden by check_var filters of the dimension queries),
+          foreign key coverage, join loss and fan out of the fact table
+        - Writes the results as json report
+        - Raises exception if a check with severity error fails and fail_on_error is set
+        - Returns the report
+
+            Args:
+                spark: spark session
+                validation_props (dict): views, keys, foreign keys, thresholds and report file of the validation
+                partition_filter (string): sql condition selecting the fact partitions loaded in this run (incremental mode)
+
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    start_time = time.time()
+    thresholds = validation_props.get('thresholds')
+    results = check_unique_keys(spark, validation_props.get('unique_keys'), thresholds.get('max_duplicate_keys'), 'error')
+    results += check_unique_keys(spark, validation_props.get('source_unique_keys'), thresholds.get('max_source_duplicate_keys'), 'warning')
+    results += check_join_coverage(spark, validation_props.get('staging_keys_view'), validation_props.get('foreign_keys'),
+                                   validation_props.get('fact_view'), thresholds, partition_filter)
+    failed_checks = [result for result in results if result.get('status') == 'failed']
+    for result in results:
+        print(f"validation: {result.get('status'):<8}{result}")
+    report = {'validated_at':time.strftime("%Y-%m-%dT%H:%M:%S"),
+              'partition_filter':partition_filter,
+              'thresholds':thresholds,
+              'status':'failed' if any(result.get('severity') == 'error' for result in failed_checks) else 'passed',
+              'duration_seconds':round(time.time() - start_time, 3),
+              'results':results}
+    report_file = validation_props.get('report_file')
+    if report_file:
+        os.makedirs(os.path.dirname(report_file), exist_ok=True)
+        with open(report_file, 'w') as f_report:
+            json.dump(report, f_report, indent=2, default=str)
+        print(f"validation report written into {report_file}")
+    if report.get('status') == 'failed' and validation_props.get('fail_on_error'):
+        print(f"ERROR:validation of star schema failed: {[(result.get('check'), result.get('view')) for result in failed_checks]}")
+        raise Exception("quality check for dataframe:failed!")
+    return report
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import argparse
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# view name:file name of the tables written into the spark warehouse by etl.py
+warehouse_tables = {'fact_immigration':'immigration.parquet',
+                    'dim_arrival_location':'arrival_location.parquet',
+                    'dim_demographics':'demographics.parquet',
+                    'dim_origin_country':'origin_country.parquet',
+                    'dim_arrival_date':'arrival_date.parquet',
+                    'dim_junk_visa_transport':'junk_visa_transport.parquet'}
+
+
+def open_warehouse(warehouse_path):
+    '''
+        - Opens the target tables (and rollup tables, if built) of the spark warehouse as pyarrow datasets
+        - Partition directories (arrival_year=/arrival_month=) are read as columns, spark marker files (_SUCCESS) are ignored
+        - Only file metadata gets read, rows are read by scan_table/run_sql
+        - Returns a dictionary view name:dataset, view names are the ones used in etl.py
+
+            Args:
+                warehouse_path (string): spark warehouse directory
+
+    '''
+    table_paths = {view_name:os.path.join(warehouse_path, file_name) for view_name, file_name in warehouse_tables.items()}
+    rollup_manifest_file = os.path.join(warehouse_path, "rollups.json")
+    if os.path.exists(rollup_manifest_file):
+        with open(rollup_manifest_file) as f_manifest:
+            table_paths.update({rollup:rollup_props.get('path') for rollup, rollup_props in json.load(f_manifest).items()})
+    return {view_name:ds.dataset(table_path, format="parquet", partitioning="hive")
+            for view_name, table_path in table_paths.items() if os.path.exists(table_path)}
+
+
+def build_filter_expression(filters):
+    '''
+        - Converts a dictionary of filters into a pyarrow filter expression (conditions combined with and)
+        - Returns None if no filters are given
+
+            Args:
+                filters (dict): column:value or list of values, e.g. {'arrival_year':2016, 'arrival_month':[1,2]}
+
+    '''
+    expression = None
+    for filter_column, filter_value in (filters or {}).items():
+        if isinstance(filter_value, (list, tuple, set)):
+            condition = ds.field(filter_column).isin(list(filter_value))
+        else:
+            condition = ds.field(filter_column) == filter_value
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def get_dataset(warehouse, view_name):
+    '''
+        - Returns the dataset of a table, raises an exception listing the available tables if it does not exist
+
+            Args:
+                warehouse (dict): view name:dataset as returned by open_warehouse
+                view_name (string): table name, e.g. fact_immigration
+
+    '''
+    if view_name not in warehouse:
+        raise Exception(f"table {view_name} not found in warehouse. available tables: {sorted(warehouse)}")
+    return warehouse.get(view_name)
+
+
+def scan_table(warehouse, view_name, columns=None, filters=None):
+    '''
+        - Reads a table with column projection and predicate pushdown
+        - Filters on partition columns prune directories, other filters skip row groups by their statistics
+        - Returns a pyarrow table
+
+            Args:
+                warehouse (dict): view name:dataset as returned by open_warehouse
+                view_name (string): table to read, e.g. fact_immigration
+                columns (list): columns to read, all columns if None
+                filters (dict): column:value or list of values
+
+    '''
+    return get_dataset(warehouse, view_name).to_table(columns=columns, filter=build_filter_expression(filters))
+
+
+def run_sql(warehouse, sql_query):
+    '''
+        - Runs a sql query on the warehouse tables with duckdb (embedded, no jvm required)
+        - Tables are registered under their view names, so queries written for spark.sql (e.g. in tests_with_final_model.ipynb) can be reused
+        - Datasets are scanned through arrow, so duckdb pushes projections and filters down into the parquet files
+        - Returns a pyarrow table
+
+            Args:
+                warehouse (dict): view name:dataset as returned by open_warehouse
+                sql_query (string): sql query
+
+    '''
+    import duckdb
+    connection = duckdb.connect()
+    for view_name, dataset in warehouse.items():
+        connection.register(view_name, dataset)
+    try:
+        result = connection.execute(sql_query).arrow()
+        # newer duckdb versions return a record batch reader instead of a table
+        return result.read_all() if isinstance(result, pa.RecordBatchReader) else result
+    finally:
+        connection.close()
+
+
+def print_result(result, max_rows):
+    '''
+        - Prints the first rows of a pyarrow table
+
+            Args:
+                result (pyarrow table): query result
+                max_rows (int): maximum number of printed rows
+
+    '''
+    print("\t".join(result.column_names))
+    for row in result.slice(0, max_rows).to_pylist():
+        print("\t".join(str(value) for value in row.values()))
+    print(f"({result.num_rows} rows)")
+
+
+def parse_filter(filter_string, schema):
+    '''
+        - Converts a filter argument column=value[,value...] into column and value(s)
+        - Values are converted into the type of the column in the table schema (e.g. "1" stays a string for string columns)
+
+            Args:
+                filter_string (string): filter argument, e.g. arrival_month=1,2
+                schema (pyarrow schema): schema of the filtered table
+
+    '''
+    filter_column, _, filter_values = filter_string.partition("=")
+    if filter_column not in schema.names:
+        raise Exception(f"filter column {filter_column} not found. available columns: {schema.names}")
+    column_type = schema.field(filter_column).type
+    values = []
+    for value in filter_values.split(","):
+        try:
+            values.append(pa.scalar(value).cast(column_type).as_py())
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            raise Exception(f"filter value {value} cannot be converted into type {column_type} of column {filter_column}")
+    return filter_column, values if len(values) > 1 else values[0]
+
+
+def main():
+    """
+    - Answers queries on the spark warehouse without starting a spark session
+    - Runs a sql query (duckdb) or a filtered scan of one table (pyarrow)
+
+    """
+    parser = argparse.ArgumentParser(description="query the spark warehouse written by etl.py without spark")
+    parser.add_argument("query", nargs="?", help="sql query, tables are available under their view names (e.g. fact_immigration)")
+    parser.add_argument("--warehouse", default="/home/workspace/spark-warehouse", help="spark warehouse directory")
+    parser.add_argument("--table", help="scan this table instead of running a sql query")
+    parser.add_argument("--columns", nargs="+", help="columns to read with --table")
+    parser.add_argument("--filter", action="append", default=[], help="filter column=value[,value...] for --table, can be repeated")
+    parser.add_argument("--max-rows", type=int, default=20, help="maximum number of printed rows")
+    parser.add_argument("--list-tables", action="store_true", help="list tables and their columns")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    warehouse = open_warehouse(args.warehouse)
+    if args.list_tables:
+        for view_name, dataset in sorted(warehouse.items()):
+            print(f"{view_name}: {', '.join(dataset.schema.names)}")
+        return
+    if args.table:
+        dataset_schema = get_dataset(warehouse, args.table).schema
+        result = scan_table(warehouse, args.table, args.columns, dict(parse_filter(f, dataset_schema) for f in args.filter))
+    elif args.query:
+        result = run_sql(warehouse, args.query)
+    else:
+        parser.error("either a sql query or --table is required")
+    print_result(result, args.max_rows)
+    print(f"query time: {round(time.time() - start_time, 3)}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import os
+import re
+import sys
+import glob
+import json
+import argparse
+
+# join operators which need a shuffle or compare all rows, more of them is a regression
+shuffled_join_operators = ['SortMergeJoin','ShuffledHashJoin','BroadcastNestedLoopJoin','CartesianProduct']
+
+
+def split_plan_list(plan_list):
+    '''
+        - Splits a comma separated list of a plan string (e.g. pushed filters) into its top level elements
+
+            Args:
+                plan_list (string): list content, e.g. IsNotNull(i94port), In(i94mode, [1,2])
+
+    '''
+    elements = []
+    depth = 0
+    element = ""
+    for character in plan_list:
+        if character == "," and depth == 0:
+            elements.append(element.strip())
+            element = ""
+            continue
+        depth += 1 if character in "([" else -1 if character in ")]" else 0
+        element += character
+    if element.strip():
+        elements.append(element.strip())
+    return elements
+
+
+def get_plan_summary(physical_plan):
+    '''
+        - Extracts the properties of a physical plan which matter for regressions
+        - Returns a dictionary with counts and order of join operators, number of shuffle exchanges and the
+          partition and pushed filters of each file scan (identified by the name of the scanned directory/file)
+
+            Args:
+                physical_plan (string): physical plan of a dataframe
+
+    '''
+    join_operators = ['BroadcastHashJoin','SortMergeJoin','ShuffledHashJoin','BroadcastNestedLoopJoin','CartesianProduct']
+    join_pattern = r"\b(" + "|".join(join_operators) + r")\b"
+    scans = []
+    for plan_line in physical_plan.splitlines():
+        if "FileScan" not in plan_line:
+            continue
+        location = re.search(r"Location: \w+(?:\((\d+) paths?\))?\[([^\],]*)", plan_line)
+        # lists longer than spark.sql.maxMetadataStringLength end with "..." instead of "]"
+        partition_filters = re.search(r"PartitionFilters: \[(.*?)\]?, PushedFilters", plan_line)
+        pushed_filters = re.search(r"PushedFilters: \[(.*?)\]?(?:, ReadSchema|$)", plan_line)
+        location_path = location.group(2).rstrip("/") if location else None
+        if location_path and int(location.group(1) or 1) > 1:
+            # scans of several files are identified by their directory
+            location_path = os.path.dirname(location_path)
+        scans.append({'location':os.path.basename(location_path) if location_path else None,
+                      'partition_filters':split_plan_list(partition_filters.group(1)) if partition_filters else [],
+                      'pushed_filters':split_plan_list(pushed_filters.group(1)) if pushed_filters else []})
+    return {'join_counts':{join_operator:len(re.findall(rf"\b{join_operator}\b", physical_plan)) for join_operator in join_operators},
+            'join_sequence':re.findall(join_pattern, physical_plan),
+            'shuffle_exchanges':len(re.findall(r"\bExchange (?:hashpartitioning|rangepartitioning|RoundRobinPartitioning|SinglePartition)", physical_plan)),
+            'scans':sorted(scans, key=lambda scan: (scan.get('location') or "", scan.get('pushed_filters')))}
+
+
+def load_plans(plan_directory):
+    '''
+        - Reads the query plans written by etl.py (--capture-plans)
+        - Returns a dictionary table:plan
+
+            Args:
+                plan_directory (string): directory of the plan files (<warehouse>/_plans)
+
+    '''
+    plans = {}
+    for plan_file in sorted(glob.glob(os.path.join(plan_directory, "*.json"))):
+        with open(plan_file) as f_plan:
+            plan = json.load(f_plan)
+        plans[plan.get('table')] = plan
+    return plans
+
+
+def normalize_filters(filters):
+    '''
+        - Removes expression ids (e.g. #12) from filters, so filters of different runs can be compared
+
+            Args:
+                filters (list): filters of a file scan
+
+    '''
+    return set(re.sub(r"#\d+L?", "", plan_filter) for plan_filter in filters)
+
+
+def get_scan_filters(plan, filter_type):
+    '''
+        - Returns a dictionary location:filters of the file scans of a plan
+
+            Args:
+                plan (dict): query plan
+                filter_type (string): pushed_filters or partition_filters
+
+    '''
+    scan_filters = {}
+    for scan in plan.get('summary').get('scans'):
+        scan_filters.setdefault(scan.get('location'), set()).update(normalize_filters(scan.get(filter_type)))
+    return scan_filters
+
+
+def compare_plans(baseline_plans, current_plans, size_change_ratio=2.0):
+    '''
+        - Compares the query plans of two runs table by table
+        - Regressions: new shuffle exchanges, fewer broadcast joins or more shuffled joins, lost pushed or partition filters
+        - Information: changed join order, missing or new tables, changed estimated or actual sizes
+        - Returns a list of findings (table, severity, check, detail)
+
+            Args:
+                baseline_plans (dict): table:plan of the baseline run
+                current_plans (dict): table:plan of the current run
+                size_change_ratio (float): sizes changing by more than this factor are reported
+
+    '''
+    findings = []
+    def add_finding(table, severity, check, detail):
+        findings.append({'table':table, 'severity':severity, 'check':check, 'detail':detail})
+
+    for table in sorted(set(baseline_plans) | set(current_plans)):
+        if table not in current_plans:
+            add_finding(table, 'info', 'missing table', "table has no plan in the current run")
+            continue
+        if table not in baseline_plans:
+            add_finding(table, 'info', 'new table', "table has no plan in the baseline run")
+            continue
+        baseline_summary = baseline_plans[table].get('summary')
+        current_summary = current_plans[table].get('summary')
+
+        if current_summary.get('shuffle_exchanges') > baseline_summary.get('shuffle_exchanges'):
+            add_finding(table, 'regression', 'new shuffles',
+                        f"shuffle exchanges: {baseline_summary.get('shuffle_exchanges')} -> {current_summary.get('shuffle_exchanges')}")
+
+        baseline_joins = baseline_summary.get('join_counts')
+        current_joins = current_summary.get('join_counts')
+        for join_operator in sorted(set(baseline_joins) | set(current_joins)):
+            baseline_count = baseline_joins.get(join_operator, 0)
+            current_count = current_joins.get(join_operator, 0)
+            if baseline_count == current_count:
+                continue
+            is_regression = (join_operator in shuffled_join_operators and current_count > baseline_count) or \
+                            (join_operator == 'BroadcastHashJoin' and current_count < baseline_count)
+            add_finding(table, 'regression' if is_regression else 'info', 'changed join strategies',
+                        f"{join_operator}: {baseline_count} -> {current_count}")
+        if baseline_joins == current_joins and baseline_summary.get('join_sequence') != current_summary.get('join_sequence'):
+            add_finding(table, 'info', 'changed join order',
+                        f"{baseline_summary.get('join_sequence')} -> {current_summary.get('join_sequence')}")
+
+        for filter_type in ['pushed_filters','partition_filters']:
+            current_filters = get_scan_filters(current_plans[table], filter_type)
+            for location, baseline_filters in get_scan_filters(baseline_plans[table], filter_type).items():
+                lost_filters = baseline_filters - current_filters.get(location, set())
+                if lost_filters:
+                    add_finding(table, 'regression', f"lost {filter_type.replace('_', ' ')}",
+                                f"scan of {location}: {sorted(lost_filters)}")
+
+        for size_type, size_key in [('estimated','size_bytes'), ('actual','rows_written'), ('actual','table_bytes')]:
+            baseline_size = (baseline_plans[table].get(size_type) or {}).get(size_key)
+            current_size = (current_plans[table].get(size_type) or {}).get(size_key)
+            if baseline_size and current_size and max(baseline_size, current_size) / min(baseline_size, current_size) > size_change_ratio:
+                add_finding(table, 'info', f"changed {size_type} size", f"{size_key}: {baseline_size} -> {current_size}")
+    return findings
+
+
+def print_findings(findings):
+    '''
+        - Prints findings, regressions first
+
+            Args:
+                findings (list): findings returned by compare_plans
+
+    '''
+    if not findings:
+        print("plans are equivalent.")
+    for finding in sorted(findings, key=lambda finding: (finding.get('severity') != 'regression', finding.get('table'))):
+        print(f"{finding.get('severity').upper():<12}{finding.get('table'):<30}{finding.get('check'):<28}{finding.get('detail')}")
+
+
+def main():
+    """
+    - Compares the query plans of two runs (plan directories written by etl.py --capture-plans)
+    - Exits with code 1 if regressions were found
+
+    """
+    parser = argparse.ArgumentParser(description="compare query plans of two etl runs")
+    parser.add_argument("baseline", help="plan directory of the baseline run")
+    parser.add_argument("current", help="plan directory of the current run")
+    parser.add_argument("--size-change-ratio", type=float, default=2.0, help="report sizes changing by more than this factor")
+    args = parser.parse_args()
+
+    findings = compare_plans(load_plans(args.baseline), load_plans(args.current), args.size_change_ratio)
+    print_findings(findings)
+    if any(finding.get('severity') == 'regression' for finding in findings):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
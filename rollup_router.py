@@ -0,0 +1,70 @@
+import os
+import json
+import inspect
+from pyspark.sql.functions import col, count, sum as sum_
+
+
+def load_rollup_manifest(warehouse_path):
+    '''
+        - Reads the rollup manifest written by etl.create_rollup_tables
+        - Returns a dictionary rollup name:rollup properties (empty if no rollups exist)
+
+            Args:
+                warehouse_path (string): spark warehouse directory
+
+    '''
+    rollup_manifest_file = os.path.join(warehouse_path, "rollups.json")
+    if not os.path.exists(rollup_manifest_file):
+        return {}
+    with open(rollup_manifest_file) as f_manifest:
+        return json.load(f_manifest)
+
+
+def find_rollup(rollup_manifest, required_columns):
+    '''
+        - Returns the name of the smallest rollup containing all required columns, None if no rollup matches
+
+            Args:
+                rollup_manifest (dict): rollup name:rollup properties
+                required_columns (list): fact table columns used for grouping and filtering
+
+    '''
+    matching_rollups = [(len(rollup_props.get('group_by_columns')), rollup)
+                        for rollup, rollup_props in rollup_manifest.items()
+                        if set(required_columns) <= set(rollup_props.get('group_by_columns'))]
+    return min(matching_rollups)[1] if matching_rollups else None
+
+
+def query_arrivals(spark, warehouse_path, group_by_columns, filters=None, fact_file_name="immigration.parquet"):
+    '''
+        - Counts arrivals grouped by columns of the fact table
+        - Routes the query to the smallest matching rollup table, falls back to the fact table otherwise
+        - Returns a dataframe with the grouping columns and the number of arrivals (column arrivals)
+        - Dimension attributes (e.g. port_name) can be joined to the result using the key columns
+
+            Args:
+                spark: spark session
+                warehouse_path (string): spark warehouse directory
+                group_by_columns (list): fact table columns to group by, e.g. ['arrival_location_id']
+                filters (dict): fact table column:value or list of values, e.g. {'arrival_year':2016}
+                fact_file_name (string): file name of the fact table in the warehouse
+
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    filters = filters or {}
+    rollup_manifest = load_rollup_manifest(warehouse_path)
+    rollup = find_rollup(rollup_manifest, list(group_by_columns) + list(filters))
+    if rollup:
+        print(f"query routed to rollup: {rollup}")
+        df = spark.read.parquet(rollup_manifest.get(rollup).get('path'))
+        measure = sum_(col(rollup_manifest.get(rollup).get('measure')))
+    else:
+        print("no matching rollup found. query routed to fact table.")
+        df = spark.read.parquet(os.path.join(warehouse_path, fact_file_name))
+        measure = count("*")
+    for filter_column, filter_value in filters.items():
+        if isinstance(filter_value, (list, tuple, set)):
+            df = df.where(col(filter_column).isin(list(filter_value)))
+        else:
+            df = df.where(col(filter_column) == filter_value)
+    return df.groupBy(*group_by_columns).agg(measure.cast("long").alias("arrivals"))
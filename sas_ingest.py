@@ -0,0 +1,140 @@
+import os
+import glob
+import json
+import time
+import inspect
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def get_arrow_schema(df_chunk):
+    '''
+        - Derives a typed parquet schema from the columns of the first chunk of a SAS file
+        - SAS knows numeric (double) and character columns only, so types are stable across chunks
+          (character columns containing only missing values are still typed as string)
+
+            Args:
+                df_chunk (dataframe): pandas dataframe of the first chunk
+
+    '''
+    fields = []
+    for column, dtype in df_chunk.dtypes.items():
+        if dtype.kind in 'fiu':
+            fields.append(pa.field(column, pa.float64()))
+        elif dtype.kind == 'M':
+            fields.append(pa.field(column, pa.timestamp('ms')))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+
+def get_conversion_marker(sas_file, target_directory):
+    '''
+        - Returns the path of the marker file written after a SAS file has been converted completely
+
+            Args:
+                sas_file (string): path of the SAS file
+                target_directory (string): directory of the parquet files
+
+    '''
+    file_stem = os.path.splitext(os.path.basename(sas_file))[0]
+    return os.path.join(target_directory, "_converted", f"{file_stem}.json")
+
+
+def is_converted(sas_file, target_directory):
+    '''
+        - Checks if a SAS file has been converted completely and did not change since (size and modification time)
+
+            Args:
+                sas_file (string): path of the SAS file
+                target_directory (string): directory of the parquet files
+
+    '''
+    marker_file = get_conversion_marker(sas_file, target_directory)
+    if not os.path.exists(marker_file):
+        return False
+    with open(marker_file) as f_marker:
+        conversion = json.load(f_marker)
+    file_stat = os.stat(sas_file)
+    return conversion.get('source_size') == file_stat.st_size and conversion.get('source_mtime_ns') == file_stat.st_mtime_ns
+
+
+def convert_sas_file(sas_file, target_directory, chunk_size, encoding="ISO-8859-1"):
+    '''
+        - Converts a SAS7BDAT file into parquet files, reading and writing one chunk of rows at a time (bounded memory)
+        - Each chunk becomes one parquet file <file name>-<chunk number>.parquet with the schema derived from the first chunk
+        - Files are written under a temporary name and renamed when complete, parquet files of an interrupted conversion get replaced
+        - Writes a marker file when the whole SAS file has been converted
+        - Returns a dictionary summarizing the conversion
+
+            Args:
+                sas_file (string): path of the SAS file
+                target_directory (string): directory of the parquet files
+                chunk_size (int): number of rows per chunk
+                encoding (string): encoding of character columns
+
+    '''
+    start_time = time.time()
+    file_stem = os.path.splitext(os.path.basename(sas_file))[0]
+    for stale_file in glob.glob(os.path.join(target_directory, f"{file_stem}-*.parquet")):
+        os.remove(stale_file)
+    arrow_schema = None
+    num_rows = 0
+    chunk_files = []
+    with pd.read_sas(sas_file, format="sas7bdat", chunksize=chunk_size, encoding=encoding) as sas_reader:
+        for chunk_number, df_chunk in enumerate(sas_reader):
+            arrow_schema = arrow_schema or get_arrow_schema(df_chunk)
+            chunk_file = os.path.join(target_directory, f"{file_stem}-{chunk_number:05d}.parquet")
+            table = pa.Table.from_pandas(df_chunk, schema=arrow_schema, preserve_index=False)
+            pq.write_table(table, chunk_file + ".tmp", compression="snappy")
+            os.replace(chunk_file + ".tmp", chunk_file)
+            num_rows += len(df_chunk)
+            chunk_files.append(os.path.basename(chunk_file))
+    file_stat = os.stat(sas_file)
+    conversion = {'source_file':sas_file,
+                  'source_size':file_stat.st_size,
+                  'source_mtime_ns':file_stat.st_mtime_ns,
+                  'num_rows':num_rows,
+                  'chunk_files':chunk_files,
+                  'duration_seconds':round(time.time() - start_time, 3),
+                  'converted_at':time.strftime("%Y-%m-%dT%H:%M:%S")}
+    marker_file = get_conversion_marker(sas_file, target_directory)
+    with open(marker_file, 'w') as f_marker:
+        json.dump(conversion, f_marker, indent=2)
+    return conversion
+
+
+def ingest_sas_files(ingest_props):
+    '''
+        - Converts raw monthly I94 SAS7BDAT files into parquet files read by stage_source_data
+        - Files are converted in parallel in a process pool, each file in chunks of a fixed number of rows
+        - Files converted by a previous run (unchanged size and modification time) are skipped
+        - Returns a list of conversion summaries of the converted files
+
+            Args:
+                ingest_props (dict): source path (glob pattern), target directory, chunk size and maximum number of worker processes
+
+    '''
+    print(f"running function: {inspect.stack()[0][3]}...")
+    target_directory = ingest_props.get('target_directory')
+    os.makedirs(os.path.join(target_directory, "_converted"), exist_ok=True)
+    sas_files = sorted(glob.glob(ingest_props.get('source_path')))
+    print(f"sas files found: {len(sas_files)}")
+    pending_files = [sas_file for sas_file in sas_files if not is_converted(sas_file, target_directory)]
+    print(f"sas files already converted: {len(sas_files) - len(pending_files)}; sas files to be converted: {len(pending_files)}")
+    conversions = []
+    if not pending_files:
+        return conversions
+    # each process converts a whole file chunk by chunk, memory is bounded by workers x chunk size
+    with ProcessPoolExecutor(max_workers=min(ingest_props.get('max_workers'), len(pending_files))) as executor:
+        futures = {executor.submit(convert_sas_file, sas_file, target_directory, ingest_props.get('chunk_size')):sas_file
+                   for sas_file in pending_files}
+        for future in as_completed(futures):
+            conversion = future.result()
+            print(f"{futures[future]} converted: rows:{conversion.get('num_rows')}; files:{len(conversion.get('chunk_files'))}; "
+                  f"duration:{conversion.get('duration_seconds')} seconds")
+            conversions.append(conversion)
+    return conversions
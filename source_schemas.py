@@ -0,0 +1,57 @@
+from pyspark.sql.types import StructType, StructField, StringType, DoubleType, FloatType, LongType
+
+# schemas of the source data and projections applied during staging
+
+# immigration data (parquet): only columns consumed by the star schema queries get read
+immigration_schema = StructType([
+    StructField("cicid", DoubleType(), True),
+    StructField("i94yr", DoubleType(), True),
+    StructField("i94mon", DoubleType(), True),
+    StructField("i94cit", DoubleType(), True),
+    StructField("i94res", DoubleType(), True),
+    StructField("i94port", StringType(), True),
+    StructField("arrdate", DoubleType(), True),
+    StructField("i94mode", DoubleType(), True),
+    StructField("i94addr", StringType(), True),
+    StructField("i94bir", DoubleType(), True),
+    StructField("i94visa", DoubleType(), True),
+    StructField("biryear", DoubleType(), True),
+    StructField("gender", StringType(), True),
+    StructField("airline", StringType(), True)])
+
+# numeric codes are cast once during staging
+immigration_staging_columns = ["cast(cicid as long) as cicid",
+                               "cast(i94yr as int) as i94yr",
+                               "cast(i94mon as int) as i94mon",
+                               "cast(i94cit as int) as i94cit",
+                               "cast(i94res as int) as i94res",
+                               "i94port",
+                               "cast(arrdate as int) as arrdate",
+                               "cast(i94mode as int) as i94mode",
+                               "i94addr",
+                               "cast(i94bir as int) as i94bir",
+                               "cast(i94visa as int) as i94visa",
+                               "cast(biryear as int) as biryear",
+                               "gender",
+                               "airline"]
+
+# records without the keys joined in the fact table can't be loaded, they get filtered while reading
+immigration_source_filter = ("i94port is not null and arrdate is not null "
+                             "and i94cit is not null and i94res is not null "
+                             "and i94visa is not null and i94mode is not null "
+                             "and i94yr is not null and i94mon is not null")
+
+# demographics data (csv): all columns are used, schema is positional
+demographics_schema = StructType([
+    StructField("City", StringType(), True),
+    StructField("State", StringType(), True),
+    StructField("Median Age", FloatType(), True),
+    StructField("Male Population", LongType(), True),
+    StructField("Female Population", LongType(), True),
+    StructField("Total Population", LongType(), True),
+    StructField("Number of Veterans", LongType(), True),
+    StructField("Foreign-born", LongType(), True),
+    StructField("Average Household Size", DoubleType(), True),
+    StructField("State Code", StringType(), True),
+    StructField("Race", StringType(), True),
+    StructField("Count", LongType(), True)])
@@ -1,16 +1,59 @@
+# distinct key tuples of the staged immigration data, extracted in a single scan
+# all dimensions derive their keys from this (small) table instead of scanning staging again
+staging_keys_sql=("""
+select i94port, i94addr, i94cit, i94res, arrdate, i94visa, i94mode, count(*) as num_rows
+    from staging_immigration_table
+    group by i94port, i94addr, i94cit, i94res, arrdate, i94visa, i94mode
+""")
+
+# port keys get deduplicated before the joins, so hot ports don't pile up in a few partitions
 df_dim_arrival_location_sql=("""
-with cte1 as (select distinct i94port as port_code,
+with cte_port_keys as (select distinct i94port, i94addr from staging_keys_table),
+    cte1 as (select distinct i94port as port_code,
     i94addr as state_code,
     port_name
-    from staging_immigration_table sit
+    from cte_port_keys sit
     join map_port mp on sit.i94port=mp.port_code and sit.i94addr = mp.port_state),
     cte2 as (select cte1.*, 
         count(*) over (partition by port_code, state_code) as check_var
         from cte1)
-    select monotonically_increasing_id() as id,port_code, state_code, port_name 
+    select xxhash64(port_code, state_code) as id,port_code, state_code, port_name 
     from cte2 where check_var=1
 """)
 
+# normalized name of ports and cities: upper case, text after a comma, parenthesis or # removed (state suffix, "(balance)"),
+# punctuation replaced by blanks and abbreviations expanded, e.g. "St. Louis" and "ST LOUIS, MO" -> "SAINT LOUIS"
+normalized_name_sql=("""regexp_replace(regexp_replace(regexp_replace(trim(regexp_replace(regexp_replace(upper({name}),
+    '[,(#].*$', ''), '[^A-Z0-9]+', ' ')), '^ST ', 'SAINT '), '^FT ', 'FORT '), '^MT ', 'MOUNT ')""")
+
+# lookup index port code -> demographics city, matched on normalized names after resolving aliases
+# names get matched completely (rank 1) or by their first part before / or - (rank 2), e.g. "DALLAS/FORT WORTH" -> "DALLAS",
+# "Nashville-Davidson metropolitan government (balance)" -> "NASHVILLE"; each port keeps its best match
+port_city_index_sql=("""
+with cte_aliases as (select distinct {alias_key} as alias_key, {alias_city_key} as name_key from map_port_city_alias),
+    cte_port_names as (select port_code, port_state, port_name as name, 1 as name_rank from map_port
+    union all
+    select port_code, port_state, regexp_extract(port_name, '^[^/-]+', 0), 2 from map_port),
+    cte_city_names as (select distinct City as city, `State Code` as state_code, City as name, 1 as name_rank from staging_demographics_table
+    union all
+    select distinct City, `State Code`, regexp_extract(City, '^[^/-]+', 0), 2 from staging_demographics_table),
+    cte_port_keys as (select pn.port_code, pn.port_state, pn.name_rank, coalesce(a.name_key, pn.name_key) as name_key
+    from (select *, {name_key} as name_key from cte_port_names) pn
+    left join cte_aliases a on pn.name_key = a.alias_key),
+    cte_city_keys as (select cn.city, cn.state_code, cn.name_rank, coalesce(a.name_key, cn.name_key) as name_key
+    from (select *, {name_key} as name_key from cte_city_names) cn
+    left join cte_aliases a on cn.name_key = a.alias_key),
+    cte_matches as (select pk.port_code, pk.port_state, ck.city, ck.state_code,
+        row_number() over (partition by pk.port_code order by pk.name_rank + ck.name_rank, ck.name_rank, ck.city) as match_order
+    from cte_port_keys pk
+    join cte_city_keys ck on pk.name_key = ck.name_key and substr(upper(trim(pk.port_state)), 1, 2) = ck.state_code
+    where pk.name_key != '')
+select port_code, port_state, city, state_code
+    from cte_matches where match_order = 1
+""").format(name_key=normalized_name_sql.format(name='name'),
+            alias_key=normalized_name_sql.format(name='alias_name'),
+            alias_city_key=normalized_name_sql.format(name='city_name'))
+
 df_dim_demographics_sql=("""
 with cte_demographics_agg as (select * 
     from staging_demographics_table
@@ -21,38 +64,38 @@ with cte_demographics_agg as (select *
                     'Black or African-American' as african_american,
                     'American Indian and Alaska Native' as native,
                     'Asian' as asian)
-    ) order by City)
-    select monotonically_increasing_id() as id,t1.*
-    from (select distinct
+    ) order by City),
+    cte_port_keys as (select distinct i94port, i94addr from staging_keys_table)
+    select xxhash64(t1.port_code, t1.city, t1.state_code) as id,t1.*
+    from (select /*+ BROADCAST(pc) */ distinct
     i94port as port_code,
     sdt.City as city,
     sdt.State as state,
     sdt.`State Code` as state_code,
-    cast (sdt.`Median Age` as float) as median_age,
-    cast (sdt.`Male Population` as long) as male_population,
-    cast (sdt.`Female Population` as long) as female_population,
-    cast (sdt.`Total Population` as long) as total_population,
-    cast (sdt.`Number of Veterans` as long) as number_of_veterans,
-    cast (sdt.`Foreign-born` as long) as foreign_born,
-    cast (sdt.`Average Household Size` as double) as average_household_size,
-    cast (sdt.hispanic_latino as long) as hispanic_latino_population,
-    cast (sdt.white as long) as white_population,
-    cast (sdt.african_american as long) as african_american_population,
-    cast (sdt.native as long) as native_population,
-    cast (sdt.asian as long) as asian_population
-    from staging_immigration_table sit
-    join map_port mp on sit.i94port=mp.port_code and sit.i94addr = mp.port_state
-    join cte_demographics_agg sdt on lower(mp.port_name)=lower(sdt.City) and mp.port_state = sdt.`State Code`
+    sdt.`Median Age` as median_age,
+    sdt.`Male Population` as male_population,
+    sdt.`Female Population` as female_population,
+    sdt.`Total Population` as total_population,
+    sdt.`Number of Veterans` as number_of_veterans,
+    sdt.`Foreign-born` as foreign_born,
+    sdt.`Average Household Size` as average_household_size,
+    sdt.hispanic_latino as hispanic_latino_population,
+    sdt.white as white_population,
+    sdt.african_american as african_american_population,
+    sdt.native as native_population,
+    sdt.asian as asian_population
+    from cte_port_keys sit
+    join map_port_city pc on sit.i94port=pc.port_code and sit.i94addr = pc.port_state
+    join cte_demographics_agg sdt on pc.city=sdt.City and pc.state_code = sdt.`State Code`
     )t1
-    order by id
 """)
 
 df_dim_origin_country_sql=("""
-with cte1 as (select distinct i94cit as country_id from staging_immigration_table
+with cte1 as (select distinct i94cit as country_id from staging_keys_table
     union 
-    select distinct i94res from staging_immigration_table),
+    select distinct i94res from staging_keys_table),
     cte2 as (
-    select cast (cte1.country_id as int) as country_id, t2.country_name
+    select cte1.country_id, t2.country_name
     from cte1
     join map_cit_res t2
     on cte1.country_id = t2.country_id),
@@ -61,16 +104,22 @@ with cte1 as (select distinct i94cit as country_id from staging_immigration_tabl
 """)
 
 df_dim_arrival_date_sql=("""
-select da.*,
-    year(arrdate_conv) as year,
-    month(arrdate_conv) as month,
-    dayofmonth(arrdate_conv) as dayofmonth,
-    dayofweek(arrdate_conv) as dayofweek,
-    date_format(arrdate_conv,'E') as dayofweek_name,
-    dayofyear(arrdate_conv) as dayofyear,
-    weekofyear(arrdate_conv) as weekofyear,
-    quarter(arrdate_conv) as quarter
-    from dim_arrival_date da
+with cte_range as (select min(arrdate) as min_arrdate,
+    max(arrdate) as max_arrdate
+    from staging_keys_table),
+    cte_calendar as (select explode(sequence(min_arrdate, max_arrdate)) as arrdate from cte_range),
+    cte_dates as (select arrdate, date_add(to_date('1960-01-01'), arrdate) as arrival_date from cte_calendar)
+select arrdate,
+    date_format(arrival_date,"yyyy-MM-dd'T'HH:mm:ss") as arrdate_conv,
+    year(arrival_date) as year,
+    month(arrival_date) as month,
+    dayofmonth(arrival_date) as dayofmonth,
+    dayofweek(arrival_date) as dayofweek,
+    date_format(arrival_date,'E') as dayofweek_name,
+    dayofyear(arrival_date) as dayofyear,
+    weekofyear(arrival_date) as weekofyear,
+    quarter(arrival_date) as quarter
+    from cte_dates
 """)
 
 df_dim_junk_visa_transport_sql=("""
@@ -89,18 +138,21 @@ with cte_transport_mode as (select transport_code,
 """)
 
 
+# {join_hint} gets replaced by the broadcast hint for dimensions chosen in create_target_tables
 df_fact_immigration_sql=("""
-select monotonically_increasing_id() as id,
+select {join_hint}xxhash64(sit.i94yr, sit.i94mon, sit.cicid) as id,
     dal.id as arrival_location_id,
-    cast(arrdate as int) as arrival_date_id,
+    sit.arrdate as arrival_date_id,
     djvt.id as visa_transport_id,
     doc1.country_id as country_id_citizenship,
     doc2.country_id as country_id_residence,
     dd.id as arrlocation_demographics_id,
-    cast(sit.i94bir as int) as immigrant_age,
-    cast(sit.biryear as int) as immigrant_birthyear,
+    sit.i94bir as immigrant_age,
+    sit.biryear as immigrant_birthyear,
     sit.gender as immigrant_gender,
-    sit.airline
+    sit.airline,
+    sit.i94yr as arrival_year,
+    sit.i94mon as arrival_month
     from staging_immigration_table sit
     join dim_arrival_location dal on dal.port_code=sit.i94port
     join dim_junk_visa_transport djvt 
@@ -110,3 +162,23 @@ select monotonically_increasing_id() as id,
     join dim_origin_country doc2 on doc2.country_id=sit.i94res
     join dim_demographics dd on dd.port_code=sit.i94port
 """)
+
+
+# arrivals per grouping columns of the fact table, used for rollup tables
+rollup_arrivals_sql=("""
+select {group_by_columns}, count(*) as arrivals
+    from {source_view}
+    {partition_filter}
+    group by {group_by_columns}
+""")
+
+# invalid labels of countries get a common id
+map_cit_res_cleanup_sql=("""
+with cte_1 as (select cast(country_code as int) as country_id,
+case when lower(country_name) like '%collapsed%' 
+or lower(country_name) like '%invalid%' 
+or lower(country_name) like '%no country code%' 
+then 'Unknown Country' else country_name end as country_name 
+from map_cit_res)
+select distinct case when country_name = 'Unknown Country' then 9999 else country_id end as country_id, country_name from cte_1
+""")
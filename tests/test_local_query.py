@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import local_query
+
+
+# small warehouse written like etl.py does: fact table partitioned by arrival_year/arrival_month, dimension in one file
+@pytest.fixture
+def warehouse_path(tmp_path):
+    fact_path = tmp_path / "immigration.parquet"
+    for arrival_year, arrival_month, rows in [(2016, 1, [(1, 10), (2, 11)]), (2016, 2, [(3, 10)]), (2017, 1, [(4, 12)])]:
+        partition_path = fact_path / f"arrival_year={arrival_year}" / f"arrival_month={arrival_month}"
+        partition_path.mkdir(parents=True)
+        pq.write_table(pa.table({'id':[row[0] for row in rows], 'arrival_location_id':[row[1] for row in rows]}),
+                       partition_path / "part-00000.parquet")
+    (fact_path / "_SUCCESS").touch()
+    location_path = tmp_path / "arrival_location.parquet"
+    location_path.mkdir()
+    pq.write_table(pa.table({'id':[10, 11, 12], 'port_code':["001", "NYC", "LOS"], 'state_code':["NY", "NY", "CA"]}),
+                   location_path / "part-00000.parquet")
+    (location_path / "_SUCCESS").touch()
+    return str(tmp_path)
+
+
+def test_open_warehouse_opens_existing_tables(warehouse_path):
+    warehouse = local_query.open_warehouse(warehouse_path)
+    assert sorted(warehouse) == ['dim_arrival_location', 'fact_immigration']
+    assert warehouse.get('fact_immigration').schema.names == ['id', 'arrival_location_id', 'arrival_year', 'arrival_month']
+
+
+def test_parse_filter_converts_values_into_column_types(warehouse_path):
+    warehouse = local_query.open_warehouse(warehouse_path)
+    fact_schema = warehouse.get('fact_immigration').schema
+    assert local_query.parse_filter("arrival_year=2016", fact_schema) == ('arrival_year', 2016)
+    assert local_query.parse_filter("arrival_month=1,2", fact_schema) == ('arrival_month', [1, 2])
+    # numeric looking values of string columns stay strings
+    assert local_query.parse_filter("port_code=001", warehouse.get('dim_arrival_location').schema) == ('port_code', "001")
+    with pytest.raises(Exception):
+        local_query.parse_filter("arrival_year=abc", fact_schema)
+    with pytest.raises(Exception):
+        local_query.parse_filter("unknown_column=1", fact_schema)
+
+
+def test_scan_table_filters_partitions(warehouse_path):
+    warehouse = local_query.open_warehouse(warehouse_path)
+    fact_schema = warehouse.get('fact_immigration').schema
+    filters = dict(local_query.parse_filter(f, fact_schema) for f in ["arrival_year=2016", "arrival_month=1"])
+    result = local_query.scan_table(warehouse, 'fact_immigration', ['id'], filters)
+    assert sorted(result.column('id').to_pylist()) == [1, 2]
+    result = local_query.scan_table(warehouse, 'dim_arrival_location', ['id'],
+                                    dict([local_query.parse_filter("port_code=001", warehouse.get('dim_arrival_location').schema)]))
+    assert result.column('id').to_pylist() == [10]
+    with pytest.raises(Exception):
+        local_query.scan_table(warehouse, 'dim_demographics')
+
+
+def test_run_sql_joins_tables(warehouse_path):
+    pytest.importorskip("duckdb")
+    warehouse = local_query.open_warehouse(warehouse_path)
+    result = local_query.run_sql(warehouse, """
+        select al.state_code, count(*) as num_rows
+        from fact_immigration fi
+        join dim_arrival_location al on fi.arrival_location_id = al.id
+        where fi.arrival_year = 2016
+        group by al.state_code
+        order by al.state_code
+    """)
+    assert result.to_pylist() == [{'state_code':'NY', 'num_rows':3}]
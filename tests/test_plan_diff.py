@@ -0,0 +1,147 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plan_diff
+
+# physical plans of the fact table as printed by spark: dimensions broadcast (baseline) or shuffled (regression)
+broadcast_plan = """AdaptiveSparkPlan isFinalPlan=false
++- Project [xxhash64(i94yr#1, i94mon#2, cicid#0L, 42) AS id#50L, id#29L AS arrival_location_id#51L]
+   +- BroadcastHashJoin [i94visa#8, i94mode#7], [visa_code#40, transport_code#41], Inner, BuildRight, false
+      :- BroadcastHashJoin [i94port#5], [port_code#30], Inner, BuildRight, false
+      :  :- FileScan parquet [cicid#0L,i94yr#1,i94mon#2,i94port#5,i94mode#7,i94visa#8] Batched: true, DataFilters: [isnotnull(i94port#5)], Format: Parquet, Location: InMemoryFileIndex(12 paths)[file:/home/workspace/sas_data/part-00000.parquet, file:/home/workspace/sas_data/part-00001.parquet], PartitionFilters: [], PushedFilters: [IsNotNull(i94port), In(i94mode, [1,2,3,9])], ReadSchema: struct<cicid:double,i94port:string>
+      :  +- BroadcastExchange HashedRelationBroadcastMode(List(input[1, string, false]),false), [plan_id=41]
+      :     +- FileScan parquet [id#29L,port_code#30] Batched: true, DataFilters: [isnotnull(port_code#30)], Format: Parquet, Location: InMemoryFileIndex(1 paths)[file:/home/workspace/spark-warehouse/arrival_location.parquet], PartitionFilters: [], PushedFilters: [IsNotNull(port_code)], ReadSchema: struct<id:bigint,port_code:string>
+      +- BroadcastExchange HashedRelationBroadcastMode(List(input[1, int, false], input[2, int, false]),false), [plan_id=45]
+         +- FileScan parquet [id#39L,visa_code#40,transport_code#41] Batched: true, DataFilters: [isnotnull(visa_code#40)], Format: Parquet, Location: InMemoryFileIndex(1 paths)[file:/home/workspace/spark-warehouse/junk_visa_transport.parquet], PartitionFilters: [], PushedFilters: [IsNotNull(visa_code), IsNotNull(transport_code)], ReadSchema: struct<id:bigint,visa_code:int,transport_code:int>
+"""
+
+shuffled_plan = """AdaptiveSparkPlan isFinalPlan=false
++- Project [xxhash64(i94yr#1, i94mon#2, cicid#0L, 42) AS id#50L, id#29L AS arrival_location_id#51L]
+   +- BroadcastHashJoin [i94visa#8, i94mode#7], [visa_code#40, transport_code#41], Inner, BuildRight, false
+      :- SortMergeJoin [i94port#5], [port_code#30], Inner
+      :  :- Sort [i94port#5 ASC NULLS FIRST], false, 0
+      :  :  +- Exchange hashpartitioning(i94port#5, 200), ENSURE_REQUIREMENTS, [plan_id=38]
+      :  :     +- FileScan parquet [cicid#0L,i94yr#1,i94mon#2,i94port#5,i94mode#7,i94visa#8] Batched: true, DataFilters: [isnotnull(i94port#5)], Format: Parquet, Location: InMemoryFileIndex(12 paths)[file:/home/workspace/sas_data/part-00000.parquet, file:/home/workspace/sas_data/part-00001.parquet], PartitionFilters: [], PushedFilters: [IsNotNull(i94port)], ReadSchema: struct<cicid:double,i94port:string>
+      :  +- Sort [port_code#30 ASC NULLS FIRST], false, 0
+      :     +- Exchange hashpartitioning(port_code#30, 200), ENSURE_REQUIREMENTS, [plan_id=39]
+      :        +- FileScan parquet [id#29L,port_code#30] Batched: true, DataFilters: [isnotnull(port_code#30)], Format: Parquet, Location: InMemoryFileIndex(1 paths)[file:/home/workspace/spark-warehouse/arrival_location.parquet], PartitionFilters: [], PushedFilters: [IsNotNull(port_code)], ReadSchema: struct<id:bigint,port_code:string>
+      +- BroadcastExchange HashedRelationBroadcastMode(List(input[1, int, false], input[2, int, false]),false), [plan_id=45]
+         +- FileScan parquet [id#39L,visa_code#40,transport_code#41] Batched: true, DataFilters: [isnotnull(visa_code#40)], Format: Parquet, Location: InMemoryFileIndex(1 paths)[file:/home/workspace/spark-warehouse/junk_visa_transport.parquet], PartitionFilters: [], PushedFilters: [IsNotNull(visa_code), IsNotNull(transport_code)], ReadSchema: struct<id:bigint,visa_code:int,transport_code:int>
+"""
+
+partitioned_scan_plan = """FileScan parquet [id#10L,arrival_year#60,arrival_month#61] Batched: true, DataFilters: [], Format: Parquet, Location: InMemoryFileIndex(1 paths)[file:/home/workspace/spark-warehouse/immigration.parquet], PartitionFilters: [isnotnull(arrival_year#60), (arrival_year#60 = 2016)], PushedFilters: [], ReadSchema: struct<id:bigint>
+"""
+
+
+def get_plan(physical_plan, table="fact_immigration"):
+    return {'table':table, 'summary':plan_diff.get_plan_summary(physical_plan)}
+
+
+def test_split_plan_list_keeps_nested_lists():
+    assert plan_diff.split_plan_list("IsNotNull(i94port), In(i94mode, [1,2,3,9]), EqualTo(i94yr,2016)") == \
+        ["IsNotNull(i94port)", "In(i94mode, [1,2,3,9])", "EqualTo(i94yr,2016)"]
+    assert plan_diff.split_plan_list("") == []
+
+
+def test_plan_summary_of_broadcast_joins():
+    summary = plan_diff.get_plan_summary(broadcast_plan)
+    assert summary.get('join_counts').get('BroadcastHashJoin') == 2
+    assert summary.get('join_counts').get('SortMergeJoin') == 0
+    assert summary.get('join_sequence') == ['BroadcastHashJoin', 'BroadcastHashJoin']
+    # broadcast exchanges are no shuffles
+    assert summary.get('shuffle_exchanges') == 0
+    assert [scan.get('location') for scan in summary.get('scans')] == \
+        ['arrival_location.parquet', 'junk_visa_transport.parquet', 'sas_data']
+    assert summary.get('scans')[2].get('pushed_filters') == ['IsNotNull(i94port)', 'In(i94mode, [1,2,3,9])']
+
+
+def test_plan_summary_of_shuffled_join():
+    summary = plan_diff.get_plan_summary(shuffled_plan)
+    assert summary.get('join_counts').get('SortMergeJoin') == 1
+    assert summary.get('join_counts').get('BroadcastHashJoin') == 1
+    assert summary.get('shuffle_exchanges') == 2
+
+
+def test_plan_summary_of_partition_filters():
+    scan = plan_diff.get_plan_summary(partitioned_scan_plan).get('scans')[0]
+    assert scan.get('location') == 'immigration.parquet'
+    assert scan.get('partition_filters') == ['isnotnull(arrival_year#60)', '(arrival_year#60 = 2016)']
+    assert scan.get('pushed_filters') == []
+
+
+def test_plan_summary_of_truncated_filters():
+    # spark cuts lists longer than spark.sql.maxMetadataStringLength and ends them with "..."
+    truncated_scan_plan = "FileScan parquet [cicid#0,i94port#5] Batched: true, DataFilters: [isnotnull(i94port#5), isnotnull(..., " \
+        "Format: Parquet, Location: InMemoryFileIndex(2 paths)[file:/home/workspace/sas_data/part-00000.parq..., PartitionFilters: [], " \
+        "PushedFilters: [IsNotNull(i94port), IsNotNull(arrdate), IsNotNull(i94visa)..., ReadSchema: struct<cicid:double,i94port:string>"
+    scan = plan_diff.get_plan_summary(truncated_scan_plan).get('scans')[0]
+    assert scan.get('location') == 'sas_data'
+    assert scan.get('pushed_filters') == ['IsNotNull(i94port)', 'IsNotNull(arrdate)', 'IsNotNull(i94visa)...']
+
+
+def test_equal_plans_have_no_findings():
+    assert plan_diff.compare_plans({'fact_immigration':get_plan(broadcast_plan)}, {'fact_immigration':get_plan(broadcast_plan)}) == []
+
+
+def test_shuffled_join_and_lost_filter_are_regressions():
+    findings = plan_diff.compare_plans({'fact_immigration':get_plan(broadcast_plan)}, {'fact_immigration':get_plan(shuffled_plan)})
+    regressions = [(finding.get('check'), finding.get('detail')) for finding in findings if finding.get('severity') == 'regression']
+    assert ('new shuffles', "shuffle exchanges: 0 -> 2") in regressions
+    assert ('changed join strategies', "BroadcastHashJoin: 2 -> 1") in regressions
+    assert ('changed join strategies', "SortMergeJoin: 0 -> 1") in regressions
+    assert ('lost pushed filters', "scan of sas_data: ['In(i94mode, [1,2,3,9])']") in regressions
+
+
+def test_improvements_and_new_tables_are_information():
+    findings = plan_diff.compare_plans({'fact_immigration':get_plan(shuffled_plan)},
+                                       {'fact_immigration':get_plan(broadcast_plan),
+                                        'dim_demographics':get_plan(broadcast_plan, 'dim_demographics')})
+    assert all(finding.get('severity') == 'info' for finding in findings)
+    assert ('dim_demographics', 'new table') in [(finding.get('table'), finding.get('check')) for finding in findings]
+
+
+# plans captured by benchmarks/run_benchmark.py --scale-factors 0.1 --months 2 (seed 42)
+baseline_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "plan_baseline", "sf0.1")
+
+# pushed down from source_schemas.immigration_source_filter into the scan of the staged immigration data
+immigration_pushed_filters = ['IsNotNull(i94port)', 'IsNotNull(arrdate)', 'IsNotNull(i94cit)', 'IsNotNull(i94res)',
+                              'IsNotNull(i94visa)', 'IsNotNull(i94mode)', 'IsNotNull(i94yr)', 'IsNotNull(i94mon)']
+
+
+def test_baseline_join_strategies():
+    plans = plan_diff.load_plans(baseline_directory)
+    assert sorted(plans) == ['df_dim_arrival_date', 'df_dim_arrival_location', 'df_dim_demographics',
+                             'df_dim_junk_visa_transport', 'df_dim_origin_country', 'df_fact_immigration']
+    join_counts = {table:{join_operator:count for join_operator, count in plan.get('summary').get('join_counts').items() if count}
+                   for table, plan in plans.items()}
+    assert join_counts == {'df_dim_arrival_date':{},
+                           'df_dim_arrival_location':{'BroadcastHashJoin':1},
+                           'df_dim_demographics':{'BroadcastHashJoin':2},
+                           'df_dim_junk_visa_transport':{'BroadcastNestedLoopJoin':1},
+                           'df_dim_origin_country':{'BroadcastHashJoin':1},
+                           'df_fact_immigration':{'BroadcastHashJoin':5}}
+    # the fact table broadcasts all of its dimensions
+    assert plans.get('df_fact_immigration').get('summary').get('shuffle_exchanges') == 0
+    assert all(plan.get('adaptive_initial_plan') for plan in plans.values())
+
+
+def test_baseline_pushed_and_partition_filters():
+    plans = plan_diff.load_plans(baseline_directory)
+    fact_scans = {scan.get('location'):scan for scan in plans.get('df_fact_immigration').get('summary').get('scans')}
+    assert fact_scans.get('sas_data').get('pushed_filters') == immigration_pushed_filters
+    assert fact_scans.get('arrival_location.parquet').get('pushed_filters') == ['IsNotNull(port_code)']
+    assert fact_scans.get('junk_visa_transport.parquet').get('pushed_filters') == ['IsNotNull(visa_code)', 'IsNotNull(transport_code)']
+    # dimensions read the staged immigration data through the cached key table, which is built from the same filtered scan
+    for table, plan in plans.items():
+        for scan in plan.get('summary').get('scans'):
+            if scan.get('location') == 'sas_data':
+                assert scan.get('pushed_filters') == immigration_pushed_filters, table
+            # a full load reads no partitioned tables
+            assert scan.get('partition_filters') == [], table
+
+
+def test_baseline_compared_with_itself_has_no_findings():
+    plans = plan_diff.load_plans(baseline_directory)
+    assert plan_diff.compare_plans(plans, plans) == []